@@ -18,6 +18,8 @@ from __future__ import with_statement
 
 __author__ = 'kbrisbin@google.com (Kathryn Hurley)'
 
+import collections
+import hashlib
 import json
 import logging
 import os
@@ -26,13 +28,19 @@ import time
 import lib_path
 import google_cloud.gce as gce
 import google_cloud.gce_appengine as gce_appengine
+import google_cloud.gce_exception as error
+import google_cloud.health_probe as health_probe
+import google_cloud.instance_cache as instance_cache
 import google_cloud.oauth as oauth
 import jinja2
 import oauth2client.appengine as oauth2client
 import user_data
 import webapp2
 
-from google.appengine.api import urlfetch
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.api import users
+from google.appengine.ext import deferred
 
 DEMO_NAME = 'fractal'
 CUSTOM_IMAGE = 'fractal-demo-image'
@@ -47,6 +55,22 @@ STARTUP_SCRIPT = os.path.join(VM_FILES, 'startup.sh')
 GO_PROGRAM = os.path.join(VM_FILES, 'mandelbrot.go')
 GO_ARGS = '--portBase=80 --numPorts=1'
 GO_TILESERVER_FLAG = '--tileServers='
+# Publish the Go program once as project metadata, which instances fetch by
+# reference, instead of sending it in the metadata of every instance.
+PUBLISH_GO_PROGRAM = False
+# Prefix of the project metadata key of the published Go program. The key
+# ends with a hash of the program.
+GO_PROGRAM_KEY_PREFIX = 'goprog-'
+# Sliding windows, in seconds, over which tile rates are computed.
+RATE_WINDOWS = (10, 60)
+# Samples kept per instance, and tile intervals kept for the cluster.
+INSTANCE_SAMPLES = 30
+CLUSTER_INTERVALS = 500
+# Percentiles of the tile times reported per tile size.
+TILE_PERCENTILES = (50, 95, 99)
+# Buckets per doubling of the tile time in the tileHist histograms exported
+# by the tile server. Must match histBucketsPerOctave in mandelbrot.go.
+HISTOGRAM_BUCKETS_PER_OCTAVE = 4
 
 jinja_environment = jinja2.Environment(loader=jinja2.FileSystemLoader(''))
 oauth_decorator = oauth.decorator
@@ -58,28 +82,320 @@ parameters = [
 data_handler = user_data.DataHandler(DEMO_NAME, parameters)
 
 
+# A map of VM file path -> (content, SHA-1 hex digest), read once per process.
+_vm_files = {}
+
+
+def read_vm_file(path):
+  """Get the content and hash of a file sent to the VMs.
+
+  Args:
+    path: The path of the file.
+
+  Returns:
+    A (content, digest) tuple, where digest is the SHA-1 hex digest of the
+    content.
+  """
+  vm_file = _vm_files.get(path)
+  if vm_file is None:
+    with open(path, 'r') as f:
+      content = f.read()
+    vm_file = _vm_files[path] = (content, hashlib.sha1(content).hexdigest())
+  return vm_file
+
+
+def refresh_probes(project_id, vars_hosts, lb_hosts):
+  """Probe servers again and cache the results. Runs as a deferred task.
+
+  Args:
+    project_id: The string id of the project the servers belong to.
+    vars_hosts: A list of instance IPs to fetch /debug/vars from.
+    lb_hosts: A list of load balancer IPs to check /health of.
+  """
+
+  probes = [health_probe.VarsProbe(host, host, project_id)
+            for host in vars_hosts]
+  probes.extend(health_probe.HealthProbe(host, host, project_id)
+                for host in lb_hosts)
+  probe_cache.update(probes)
+
+
+def _defer_refresh(probes):
+  """Refresh stale probe results from a deferred task per project."""
+
+  projects = {}
+  for probe in probes:
+    vars_hosts, lb_hosts = projects.setdefault(probe.project_id, ([], []))
+    if isinstance(probe, health_probe.VarsProbe):
+      vars_hosts.append(probe.host)
+    elif isinstance(probe, health_probe.HealthProbe):
+      lb_hosts.append(probe.host)
+  for project_id, (vars_hosts, lb_hosts) in projects.iteritems():
+    try:
+      deferred.defer(refresh_probes, project_id, vars_hosts, lb_hosts)
+    except taskqueue.Error, e:
+      logging.warning('Error scheduling the probe refresh: %s', e)
+
+
+probe_cache = health_probe.ProbeCache(
+    prober=health_probe.HealthProber(deadline=HEALTH_CHECK_TIMEOUT),
+    refresh=_defer_refresh)
+
+
+def parse_tile_histograms(instance_vars):
+  """Get the tile time histograms from server vars.
+
+  Args:
+    instance_vars A parsed JSON object returned from /debug/vars
+
+  Returns:
+    A map of tile-size -> histogram, a map of bucket -> count. Empty for
+    servers that don't export tileHist.
+  """
+  histograms = {}
+  for key, count in instance_vars.get('tileHist', {}).items():
+    size, bucket = key.split(':')
+    histograms.setdefault(size, {})[int(bucket)] = long(count)
+  return histograms
+
+
+def merge_histogram(src_histogram, dest_histogram):
+  """Add the counts of src_histogram into dest_histogram."""
+  for bucket, count in src_histogram.items():
+    dest_histogram[bucket] = dest_histogram.get(bucket, 0L) + count
+
+
+def histogram_percentile(histogram, percentile):
+  """Get a percentile of a tile time histogram.
+
+  Args:
+    histogram A map of bucket -> count.
+    percentile The percentile, between 0 and 100.
+
+  Returns:
+    The time in milliseconds at the geometric middle of the bucket holding
+    the percentile, or None if the histogram is empty.
+  """
+  rank = sum(histogram.values()) * percentile / 100.0
+  if not rank:
+    return None
+  for bucket in sorted(histogram):
+    rank -= histogram[bucket]
+    if rank <= 0:
+      break
+  # Bucket b starts at 2^(b / HISTOGRAM_BUCKETS_PER_OCTAVE) microseconds.
+  return 2 ** ((bucket + 0.5) / HISTOGRAM_BUCKETS_PER_OCTAVE) / 1000
+
+
+class VarsHistory(object):
+  """Bounded history of server vars, persisted in memcache.
+
+  Keeps a ring buffer of samples per instance. Each new sample of an
+  instance adds the tiles rendered since its previous sample, an interval,
+  to a cluster-wide ring buffer, from which rates over sliding windows are
+  computed. Samples are identified by their fetch time, so the same cached
+  vars are only counted once.
+  """
+
+  def __init__(self, key):
+    """Constructor for VarsHistory.
+
+    Args:
+      key: The string memcache key of the history.
+    """
+    self.key = key
+    self._client = memcache.Client()
+    history = self._client.gets(key, namespace=DEMO_NAME)
+    if history is None:
+      self._instances = {}
+      self._intervals = collections.deque(maxlen=CLUSTER_INTERVALS)
+      self._is_new = True
+    else:
+      self._instances, self._intervals = history
+      self._is_new = False
+
+  def add_sample(self, instance_name, timestamp, instance_vars):
+    """Add a sample of an instance's vars.
+
+    Args:
+      instance_name: The string name of the instance.
+      timestamp: The time the vars were fetched.
+      instance_vars: A parsed JSON object returned from /debug/vars
+    """
+    samples = self._instances.setdefault(
+        instance_name, collections.deque(maxlen=INSTANCE_SAMPLES))
+    sample = (timestamp, instance_vars['uptime'],
+              instance_vars['tileCount'], instance_vars['tileTime'],
+              parse_tile_histograms(instance_vars))
+    if samples and samples[-1][0] >= timestamp:
+      return
+    if samples:
+      interval = self._interval(samples[-1], sample)
+      if interval:
+        self._intervals.append(interval)
+    samples.append(sample)
+
+  def _interval(self, previous, sample):
+    """Returns the tiles rendered between two samples of an instance.
+
+    Returns:
+      An (end, duration, tiles) tuple, where tiles maps tile size to a
+      (count, time, histogram) tuple, or None if the server restarted or its
+      vars were reset in between.
+    """
+    if sample[1] < previous[1]:
+      return None
+    tiles = {}
+    for size, count in sample[2].items():
+      count = long(count) - long(previous[2].get(size, 0))
+      tile_time = long(sample[3].get(size, 0)) - long(
+          previous[3].get(size, 0))
+      if count < 0 or tile_time < 0:
+        return None
+      histogram = {}
+      previous_histogram = previous[4].get(size, {})
+      sample_histogram = sample[4].get(size, {})
+      # Bucket counts only grow; one that shrank or vanished was reset.
+      for bucket in set(sample_histogram) | set(previous_histogram):
+        bucket_count = (sample_histogram.get(bucket, 0) -
+                        previous_histogram.get(bucket, 0))
+        if bucket_count < 0:
+          return None
+        if bucket_count:
+          histogram[bucket] = bucket_count
+      if count:
+        tiles[size] = (count, tile_time, histogram)
+    return (sample[0], sample[0] - previous[0], tiles)
+
+  def save(self):
+    """Store the history, dropping instances not seen in any window.
+
+    Concurrent requests may have saved a newer history, which is then kept.
+    """
+    oldest = time.time() - max(RATE_WINDOWS)
+    for instance_name, samples in self._instances.items():
+      if samples[-1][0] < oldest:
+        del self._instances[instance_name]
+    history = (self._instances, self._intervals)
+    if self._is_new:
+      self._client.add(self.key, history, namespace=DEMO_NAME)
+    else:
+      self._client.cas(self.key, history, namespace=DEMO_NAME)
+
+  def get_instance_rate(self, instance_name):
+    """Returns the tiles per second of an instance over the longest window."""
+    samples = [sample for sample in self._instances.get(instance_name, ())
+               if sample[0] > time.time() - max(RATE_WINDOWS)]
+    if len(samples) < 2:
+      return None
+    first, last = samples[0], samples[-1]
+    if last[1] < first[1]:
+      return None
+    count = sum(long(count) for count in last[2].values()) - sum(
+        long(count) for count in first[2].values())
+    return max(count, 0) / (last[0] - first[0])
+
+  def get_rates(self):
+    """Get cluster-wide tile rates over each window in RATE_WINDOWS.
+
+    Returns:
+      A map of window -> rates. Rates have the overall tilesPerSec and a map
+      of tile-size -> tilesPerSec, meanMs and percentiles (ex: p95Ms) of the
+      tile time. Percentiles come from the tile time histograms, or for
+      servers without them, from the mean tile time of the intervals,
+      weighted by their tile counts.
+    """
+    now = time.time()
+    rates = {}
+    for window in RATE_WINDOWS:
+      intervals = [interval for interval in self._intervals
+                   if interval[0] > now - window]
+      if not intervals:
+        continue
+      # Early on, the history doesn't cover the whole window.
+      span = float(min(window, now - min(end - duration
+                                         for end, duration, _ in intervals)))
+      sizes = {}
+      for _, _, tiles in intervals:
+        for size, tile in tiles.items():
+          sizes.setdefault(size, []).append(tile)
+
+      size_rates = {}
+      total = 0
+      for size, tiles in sizes.items():
+        count = sum(tile[0] for tile in tiles)
+        tile_time = sum(tile[1] for tile in tiles)
+        histogram = {}
+        for tile in tiles:
+          merge_histogram(tile[2], histogram)
+        total += count
+        # The raw time is in nanoseconds.
+        size_rate = {
+          'tilesPerSec': count / span,
+          'meanMs': tile_time / float(count) / (1000 * 1000),
+        }
+        for percentile in TILE_PERCENTILES:
+          if histogram:
+            value = histogram_percentile(histogram, percentile)
+          else:
+            value = self._percentile(tiles, percentile) / (1000 * 1000)
+          size_rate['p%dMs' % percentile] = value
+        size_rates[size] = size_rate
+      rates[window] = {
+        'tilesPerSec': total / span,
+        'tiles': size_rates,
+      }
+    return rates
+
+  def _percentile(self, tiles, percentile):
+    """Percentile of the mean time of (count, time, ...) tuples, by count."""
+    means = sorted((tile[1] / float(tile[0]), tile[0]) for tile in tiles)
+    rank = sum(count for _, count in means) * percentile / 100.0
+    for mean, count in means:
+      rank -= count
+      if rank <= 0:
+        break
+    return mean
+
+
 class ServerVarsAggregator(object):
   """Aggregate stats across multiple servers and produce a summary."""
 
-  def __init__(self):
-    """Constructor for ServerVarsAggregator."""
+  def __init__(self, history=None):
+    """Constructor for ServerVarsAggregator.
+
+    Args:
+      history: An optional VarsHistory to record the vars in, to add rates
+          to the summary.
+    """
     # A map of tile-size -> count
     self.tile_counts = {}
     # A map of tile-size -> time
     self.tile_times = {}
+    # A map of tile-size -> histogram of tile times
+    self.tile_histograms = {}
 
     # The uptime of the server that has been up and running the longest.
     self.max_uptime = 0
 
-  def aggregate_vars(self, instance_vars):
+    self.history = history
+
+  def aggregate_vars(self, instance_vars, instance_name=None,
+                     timestamp=None):
     """Integrate instance_vars into the running aggregates.
 
     Args:
       instance_vars A parsed JSON object returned from /debug/vars
+      instance_name The name of the instance, to record it in the history.
+      timestamp The time the vars were fetched, to record it in the history.
     """
     self._aggregate_map(instance_vars['tileCount'], self.tile_counts)
     self._aggregate_map(instance_vars['tileTime'], self.tile_times)
+    for size, histogram in parse_tile_histograms(instance_vars).items():
+      merge_histogram(histogram, self.tile_histograms.setdefault(size, {}))
     self.max_uptime = max(self.max_uptime, instance_vars['uptime'])
+    if self.history and instance_name:
+      self.history.add_sample(instance_name, timestamp, instance_vars)
 
   def _aggregate_map(self, src_map, dest_map):
     """Aggregate one map from src_map into dest_map."""
@@ -89,12 +405,20 @@ class ServerVarsAggregator(object):
   def get_aggregate(self):
     """Get the overall aggregate, including derived values."""
     tile_time_avg = {}
+    tile_time_percentiles = {}
     result = {
       'tileCount': self.tile_counts.copy(),
       'tileTime': self.tile_times.copy(),
       'tileTimeAvgMs': tile_time_avg,
+      'tileTimePercentileMs': tile_time_percentiles,
       'maxUptime': self.max_uptime,
     }
+    for size, histogram in self.tile_histograms.items():
+      tile_time_percentiles[size] = dict(
+          ('p%d' % percentile, histogram_percentile(histogram, percentile))
+          for percentile in TILE_PERCENTILES)
+    if self.history:
+      result['rates'] = self.history.get_rates()
     for size, count in self.tile_counts.items():
       time = self.tile_times.get(size, 0)
       if time and count:
@@ -131,169 +455,165 @@ class Fractal(webapp2.RequestHandler):
 
     Uses app engine app identity to retrieve an access token for the app
     engine service account. No client OAuth required. External IP is used
-    to determine if the instance is actually running.
+    to determine if the instance is actually running. Instances are listed
+    across all zones, through the shared instance cache. Server health and
+    vars come from the shared probe cache, which refreshes them in the
+    background, so monitoring doesn't load the servers per request. The
+    request may long poll, see GceAppEngine.poll_instance_state.
     """
 
     gce_project = self._create_gce()
+    gce_appengine.GceAppEngine().poll_instance_state(
+        self, lambda: self._get_instance_state(gce_project),
+        project_id=gce_project.project_id)
+
+  def _get_instance_state(self, gce_project):
+    """Returns the state of the instances, with health and server vars.
+
+    Args:
+      gce_project: An object of type gce.GceProject.
+
+    Instance records only hold fields that rarely change, so the deltas of
+    write_instance_state stay small. Server vars change on every poll, so
+    they are only sent aggregated, under 'vars', and the tile rate of each
+    serving instance under 'instanceRates'.
+
+    Returns:
+      A dictionary with the instances, aggregated vars, instance tile rates
+      and load balancers.
+    """
+
     instances = gce_appengine.GceAppEngine().run_gce_request(
         self,
-        gce_project.list_instances,
+        instance_cache.list_instances,
         'Error listing instances: ',
+        gce_project=gce_project,
+        user_id=users.get_current_user().user_id(),
+        fields=gce.INSTANCE_NETWORK_FIELDS,
         filter='name eq ^%s-.*' % self.instance_prefix())
 
-    # A map of instanceName -> (ip, RPC)
-    health_rpcs = {}
-
-    # Convert instance info to dict and check server status.
-    num_running = 0
+    # Convert instance info to dict and check server status. Stats are
+    # fetched from /debug/vars of the running servers.
+    probes = []
     instance_dict = {}
     if instances:
       for instance in instances:
-        instance_record = {}
+        instance_record = {'zone': instance.zone_name}
         instance_dict[instance.name] = instance_record
         if instance.status:
           instance_record['status'] = instance.status
         else:
           instance_record['status'] = 'OTHER'
-        ip = None
-        for interface in instance.network_interfaces:
-          for config in interface.get('accessConfigs', []):
-            if 'natIP' in config:
-              ip = config['natIP']
-              instance_record['externalIp'] = ip
-              break
-          if ip: break
-
-        # Ping the instance server. Grab stats from /debug/vars.
+        ip = instance.external_ip
+        if ip:
+          instance_record['externalIp'] = ip
         if ip and instance.status == 'RUNNING':
-          num_running += 1
-          health_url = 'http://%s/debug/vars?t=%d' % (ip, int(time.time()))
-          logging.debug('Health checking %s', health_url)
-          rpc = urlfetch.create_rpc(deadline = HEALTH_CHECK_TIMEOUT)
-          urlfetch.make_fetch_call(rpc, url=health_url)
-          health_rpcs[instance.name] = rpc
+          probes.append(health_probe.VarsProbe(
+              instance.name, ip, gce_project.project_id))
 
     # Ping through a LBs too.  Only if we get success there do we know we are
     # really serving.
     loadbalancers = []
-    lb_rpcs = {}
     if instances and len(instances) > 1:
       loadbalancers = self._get_lb_servers()
-    if num_running > 0 and loadbalancers:
-      for lb in loadbalancers:
-        health_url = 'http://%s/health?t=%d' % (lb, int(time.time()))
-        logging.debug('Health checking %s', health_url)
-        rpc = urlfetch.create_rpc(deadline = HEALTH_CHECK_TIMEOUT)
-        urlfetch.make_fetch_call(rpc, url=health_url)
-        lb_rpcs[lb] = rpc
-
-    # wait for RPCs to complete and update dict as necessary
-    vars_aggregator = ServerVarsAggregator()
-
-    # TODO: there is significant duplication here.  Refactor.
-    for (instance_name, rpc) in health_rpcs.items():
-      result = None
-      instance_record = instance_dict[instance_name]
-      try:
-        result = rpc.get_result()
-        if result and "memstats" in result.content:
-          logging.debug('%s healthy!', instance_name)
-          instance_record['status'] = 'SERVING'
-          instance_vars = {}
-          try:
-            instance_vars = json.loads(result.content)
-            instance_record['vars'] = instance_vars
-            vars_aggregator.aggregate_vars(instance_vars)
-          except ValueError as error:
-            logging.error('Error decoding vars json for %s: %s', instance_name, error)
-        else:
-          logging.debug('%s unhealthy. Content: %s', instance_name, result.content)
-      except urlfetch.Error as error:
-        logging.debug('%s unhealthy: %s', instance_name, str(error))
-
-    # Check health status through the load balancer.
-    loadbalancer_healthy = bool(lb_rpcs)
-    for (lb, lb_rpc) in lb_rpcs.items():
-      result = None
-      try:
-        result = lb_rpc.get_result()
-        if result and "ok" in result.content:
-          logging.info('LB %s healthy: %s\n%s', lb, result.headers, result.content)
+    loadbalancer_healthy = bool(probes and loadbalancers)
+    if loadbalancer_healthy:
+      probes.extend(health_probe.HealthProbe(lb, lb, gce_project.project_id)
+                    for lb in loadbalancers)
+
+    history = VarsHistory('history:%s:%s' % (
+        gce_project.project_id, self.instance_prefix()))
+    vars_aggregator = ServerVarsAggregator(history)
+    instance_rates = {}
+    for result in probe_cache.get_results(probes):
+      probe = result.probe
+      if isinstance(probe, health_probe.HealthProbe):
+        if result.healthy:
+          logging.info('LB %s healthy in %.3fs', probe.key, result.latency)
         else:
-          logging.info('LB %s result not okay: %s, %s', lb, result.status_code, result.content)
+          logging.info('LB %s unhealthy: %s', probe.key,
+                       result.error or result.status_code)
           loadbalancer_healthy = False
-          break
-      except urlfetch.Error as error:
-        logging.info('LB %s fetch error: %s', lb, str(error))
-        loadbalancer_healthy = False
-        break
+      elif result.healthy:
+        logging.debug('%s healthy in %.3fs', probe.key, result.latency)
+        instance_record = instance_dict[probe.key]
+        instance_record['status'] = 'SERVING'
+        if result.value is not None:
+          vars_aggregator.aggregate_vars(
+              result.value, probe.key, result.timestamp)
+          tile_rate = history.get_instance_rate(probe.key)
+          if tile_rate is not None:
+            instance_rates[probe.key] = tile_rate
+      else:
+        logging.debug('%s unhealthy: %s', probe.key,
+                      result.error or result.status_code)
+
+    history.save()
 
     response_dict = {
       'instances': instance_dict,
       'vars': vars_aggregator.get_aggregate(),
+      'instanceRates': instance_rates,
       'loadbalancers': loadbalancers,
       'loadbalancer_healthy': loadbalancer_healthy,
     }
-    self.response.headers['Content-Type'] = 'application/json'
-    self.response.out.write(json.dumps(response_dict))
+    return response_dict
 
   @oauth_decorator.oauth_required
   @data_handler.data_required
   def set_instances(self):
-    """Start/stop instances so we have the requested number running."""
+    """Start/stop instances so we have the requested number running.
 
-    gce_project = self._create_gce()
+    Only the missing instances are built, and instances are added and removed
+    in the same batch requests. The firewall and image are only looked up
+    when adding instances, and their existence is cached by gce.GceProject.
+    """
 
-    self._setup_firewall(gce_project)
-    image = self._get_image(gce_project)
-    disks = self._get_disks(gce_project)
+    gce_project = self._create_gce()
 
-    # Get the list of instances to insert.
+    # Get the names of the instances to run.
     num_instances = int(self.request.get('num_instances'))
-    target = self._get_instance_list(
-        gce_project, num_instances, image, disks)
-    target_set = set()
-    target_map = {}
-    for instance in target:
-      target_set.add(instance.name)
-      target_map[instance.name] = instance
-
-    # Get the list of instances running
+    target_names = self._get_instance_names(num_instances)
+
+    # Get the list of instances running, in any zone. These may be handed to
+    # bulk_apply, so the listing isn't shared with other requests.
     current = gce_appengine.GceAppEngine().run_gce_request(
         self,
-        gce_project.list_instances,
+        gce_project.list_instances_all_zones,
         'Error listing instances: ',
+        coalesce=False,
+        fields=gce.INSTANCE_STATUS_FIELDS,
         filter='name eq ^%s-.*' % self.instance_prefix())
-    current_set = set()
-    current_map = {}
-    for instance in current:
-      current_set.add(instance.name)
-      current_map[instance.name] = instance
-
-    # Add the new instances
-    to_add_set = target_set - current_set
-    to_add = [target_map[name] for name in to_add_set]
-    if to_add:
-      gce_appengine.GceAppEngine().run_gce_request(
-          self,
-          gce_project.bulk_insert,
-          'Error inserting instances: ',
-          resources=to_add)
-
-    # Remove the old instances
-    to_remove_set = current_set - target_set
-    to_remove = [current_map[name] for name in to_remove_set]
-    if to_remove:
-      gce_appengine.GceAppEngine().run_gce_request(
-          self,
-          gce_project.bulk_delete,
-          'Error deleting instances: ',
-          resources=to_remove)
-
-    logging.info("current_set: %s", current_set)
-    logging.info("target_set: %s", target_set)
-    logging.info("to_add_set: %s", to_add_set)
-    logging.info("to_remove_set: %s", to_remove_set)
+    if current is None:
+      return
+
+    def build(names):
+      gce_project.ensure_firewall(gce.Firewall(
+          name=FIREWALL,
+          target_tags=[DEMO_NAME],
+          description=FIREWALL_DESCRIPTION))
+      image = self._get_image(gce_project)
+      return self._get_instance_list(gce_project, names, target_names, image)
+
+    # Add the new instances and remove the old ones.
+    results = {}
+    applied = gce_appengine.GceAppEngine().run_gce_request(
+        self,
+        gce_project.reconcile_instances,
+        'Error updating instances: ',
+        target_names=target_names,
+        current=current,
+        build=build)
+    if applied is not None:
+      results.update(applied.json)
+
+    # Report the outcome per instance, so the failed subset is known without
+    # listing the project again.
+    failed = [name for name, r in results.items() if r['status'] == 'ERROR']
+    if failed:
+      logging.error('Failed instance operations: %s', failed)
+    self.response.headers['Content-Type'] = 'application/json'
+    self.response.out.write(json.dumps({'operations': results}))
 
   @oauth_decorator.oauth_required
   @data_handler.data_required
@@ -322,42 +642,27 @@ class Fractal(webapp2.RequestHandler):
                           project_id=gce_project_id,
                           zone_name=gce_zone_name)
 
-  def _setup_firewall(self, gce_project):
-    "Create the firewall if it doesn't exist."
-    firewalls = gce_project.list_firewalls()
-    firewall_names = [firewall.name for firewall in firewalls]
-    if not FIREWALL in firewall_names:
-      firewall = gce.Firewall(
-          name=FIREWALL,
-          target_tags=[DEMO_NAME],
-          description=FIREWALL_DESCRIPTION)
-      gce_project.insert(firewall)
-
   def _get_image(self, gce_project):
-    """Returns the appropriate image to use.  def _has_custom_image(self, gce_project):
+    """Returns the appropriate image to use.
 
     Args:
       gce_project: An instance of gce.GceProject
 
-    Returns: (project, image_name) for the image to use.
+    Returns: (project, image_name) for the image to use. Both are None if the
+        project has no custom image, so the default image of the settings is
+        used.
     """
-    images = gce_project.list_images(filter='name eq ^%s$' % CUSTOM_IMAGE)
-    if images:
+    if gce_project.resolve_image(CUSTOM_IMAGE):
       return (gce_project.project_id, CUSTOM_IMAGE)
-    return ('google', None)
-
-  def _get_disks(self, gce_project):
-    """Get boot disks for VMs."""
-    disks_array = gce_project.list_disks(
-      filter='name eq ^boot-%s-.*' % self.instance_prefix())
-
-    disks = {}
-    for d in disks_array:
-      disks[d.name] = d
-    return disks
+    return (None, None)
 
   def _get_instance_metadata(self, gce_project, instance_names):
-    """The metadata values to pass into the instance."""
+    """The metadata values to pass into the instances.
+
+    The values are the same for every instance. With PUBLISH_GO_PROGRAM, the
+    Go program is published as project metadata, and only its key is passed
+    as goprog-ref.
+    """
     inline_values = {
       'goargs': GO_ARGS,
     }
@@ -366,6 +671,11 @@ class Fractal(webapp2.RequestHandler):
       'startup-script': STARTUP_SCRIPT,
       'goprog': GO_PROGRAM,
     }
+    if PUBLISH_GO_PROGRAM:
+      goprog_key = self._publish_go_program(gce_project)
+      if goprog_key:
+        inline_values['goprog-ref'] = goprog_key
+        del file_values['goprog']
 
     # Try and use LBs if we have any.  But only do that if we have more than one
     # instance.
@@ -383,55 +693,73 @@ class Fractal(webapp2.RequestHandler):
       metadata.append({'key': k, 'value': v})
 
     for k, fv in file_values.items():
-      v = open(fv, 'r').read()
+      v, _ = read_vm_file(fv)
       metadata.append({'key': k, 'value': v})
     return metadata
 
-  def _get_instance_list(self, gce_project, num_instances, image, disks):
+  def _publish_go_program(self, gce_project):
+    """Publish the Go program as project metadata.
+
+    The key includes a hash of the program, and older versions are removed.
+
+    Returns:
+      The string metadata key of the program, or None if publishing failed.
+    """
+    program, digest = read_vm_file(GO_PROGRAM)
+    key = GO_PROGRAM_KEY_PREFIX + digest[:12]
+    try:
+      gce_project.set_common_metadata(
+          [{'key': key, 'value': program}],
+          replace_prefix=GO_PROGRAM_KEY_PREFIX)
+    except error.GceError, e:
+      logging.error('Error publishing the Go program: %s', e.message)
+      return None
+    return key
+
+  def _get_instance_names(self, num_instances):
+    """Get the names of the instances of a cluster of num_instances."""
+    return ['%s-%02d' % (self.instance_prefix(), i)
+            for i in range(num_instances)]
+
+  def _get_instance_list(self, gce_project, names, instance_names, image):
     """Get a list of instances to start.
 
     Args:
       gce_project: An instance of gce.GceProject.
-      num_instances: The number of instances to start.
+      names: The names of the instances to start.
+      instance_names: The names of all instances of the cluster, which serve
+          tiles for each other.
       image: tuple with (project_name, image_name) for the image to use.
-      disks: A dictionary of disk_name -> disk resources
 
     Returns:
-      A list of gce.Instances.
+      A list of gce.TemplateInstance objects.
     """
 
-
-    instance_names = []
-    for i in range(num_instances):
-      instance_names.append('%s-%02d' % (self.instance_prefix(), i))
-
-    instance_list = []
-    for instance_name in instance_names:
-      disk_name = 'boot-%s' % instance_name
-      disk_mounts = [gce.DiskMount(init_disk_name=disk_name, boot=True, auto_delete=True)]
-
-      gce_zone_name = data_handler.stored_user_data[user_data.GCE_ZONE_NAME]
-      # Define a network interfaces list here that requests an ephemeral
-      # external IP address. We will apply this configuration to all VMs
-      # started by the fractal app. 
-      network = gce.Network('default')
-      network.gce_project = gce_project
-      ext_net = [{ 'network': network.url,
-                   'accessConfigs': [{ 'name': 'External IP access config',
-                                       'type': 'ONE_TO_ONE_NAT'
-                                     }]
-                 }]
-      instance = gce.Instance(
-          name=instance_name,
-          machine_type_name=MACHINE_TYPE,
-          zone_name=gce_zone_name,
-          network_interfaces=ext_net,
-          disk_mounts=disk_mounts,
-          tags=[DEMO_NAME, self.instance_prefix()],
-          metadata=self._get_instance_metadata(gce_project, instance_names),
-          service_accounts=gce_project.settings['cloud_service_account'])
-      instance_list.append(instance)
-    return instance_list
+    gce_zone_name = data_handler.stored_user_data[user_data.GCE_ZONE_NAME]
+    # Define a network interfaces list here that requests an ephemeral
+    # external IP address. We will apply this configuration to all VMs
+    # started by the fractal app.
+    network = gce.Network('default')
+    network.gce_project = gce_project
+    ext_net = [{ 'network': network.url,
+                 'accessConfigs': [{ 'name': 'External IP access config',
+                                     'type': 'ONE_TO_ONE_NAT'
+                                   }]
+               }]
+    # Every instance is the same but for its name and boot disk name.
+    prototype = gce.Instance(
+        machine_type_name=MACHINE_TYPE,
+        zone_name=gce_zone_name,
+        network_interfaces=ext_net,
+        disk_mounts=[gce.DiskMount(boot=True, auto_delete=True,
+                                   init_disk_image=image[1],
+                                   init_disk_project=image[0])],
+        tags=[DEMO_NAME, self.instance_prefix()],
+        metadata=self._get_instance_metadata(gce_project, instance_names),
+        service_accounts=gce_project.settings['cloud_service_account'])
+    template = gce.InstanceTemplate(
+        gce_project, prototype, disk_name_format='boot-%s')
+    return template.instances(names)
 
 
 app = webapp2.WSGIApplication(
@@ -0,0 +1,299 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the fractal demo."""
+
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'lib'))
+
+import google_cloud.testing as testing
+import main
+
+
+class Clock(object):
+  """Stands in for the time module."""
+
+  def __init__(self):
+    self.now = 1000.0
+
+  def time(self):
+    return self.now
+
+
+def server_vars(uptime, count, tile_ms=2, size='256', histogram=None):
+  """Returns the /debug/vars of a server that rendered count tiles.
+
+  Args:
+    uptime: The server's uptime.
+    count: The number of tiles rendered.
+    tile_ms: The time each tile took, in milliseconds.
+    size: The string tile size.
+    histogram: An optional map of bucket -> count of the tile times, to
+        export as tileHist.
+  """
+
+  instance_vars = {
+      'uptime': uptime,
+      'tileCount': {size: count},
+      'tileTime': {size: count * tile_ms * 1000 * 1000},
+  }
+  if histogram is not None:
+    instance_vars['tileHist'] = dict(
+        ('%s:%d' % (size, bucket), bucket_count)
+        for bucket, bucket_count in histogram.items())
+  return instance_vars
+
+
+def bucket_ms(bucket):
+  """Returns the time reported for a histogram bucket, in milliseconds."""
+
+  return 2 ** ((bucket + 0.5) / main.HISTOGRAM_BUCKETS_PER_OCTAVE) / 1000
+
+
+class VarsHistoryTest(unittest.TestCase):
+  """Tests of the time series of server vars kept in memcache."""
+
+  def setUp(self):
+    testing.reset()
+    self.clock = Clock()
+    testing.patch(self, main, 'time', self.clock)
+
+  def history(self):
+    return main.VarsHistory('history')
+
+  def sample_every_10s(self, history, counts, instance_name='fractal-00'):
+    """Adds a sample per count, 10s apart, the last one now."""
+
+    start = self.clock.now - 10 * (len(counts) - 1)
+    for i, count in enumerate(counts):
+      history.add_sample(instance_name, start + 10 * i,
+                         server_vars(10 * i, count))
+
+  def test_samples_and_intervals_are_rings(self):
+    testing.patch(self, main, 'INSTANCE_SAMPLES', 3)
+    testing.patch(self, main, 'CLUSTER_INTERVALS', 2)
+    history = self.history()
+    self.sample_every_10s(history, [0, 10, 20, 30, 40])
+    samples = history._instances['fractal-00']
+    self.assertEqual([980, 990, 1000], [sample[0] for sample in samples])
+    self.assertEqual([990, 1000],
+                     [interval[0] for interval in history._intervals])
+
+  def test_a_sample_is_counted_once(self):
+    history = self.history()
+    history.add_sample('fractal-00', 990, server_vars(0, 0))
+    history.add_sample('fractal-00', 1000, server_vars(10, 10))
+    history.add_sample('fractal-00', 1000, server_vars(10, 10))
+    history.add_sample('fractal-00', 995, server_vars(5, 5))
+    self.assertEqual(2, len(history._instances['fractal-00']))
+    self.assertEqual(1, len(history._intervals))
+
+  def test_restarts_are_not_intervals(self):
+    history = self.history()
+    history.add_sample('fractal-00', 990, server_vars(100, 500))
+    history.add_sample('fractal-00', 1000, server_vars(5, 10))
+    self.assertEqual(0, len(history._intervals))
+    self.assertEqual(None, history.get_instance_rate('fractal-00'))
+
+  def test_rates_over_each_window(self):
+    history = self.history()
+    # 100 tiles per 10s, then 300 in the last 10s.
+    self.sample_every_10s(history, [0, 100, 200, 300, 400, 500, 800])
+    rates = history.get_rates()
+    self.assertEqual([10, 60], sorted(rates))
+    self.assertAlmostEqual(30, rates[10]['tilesPerSec'])
+    self.assertAlmostEqual(800 / 60.0, rates[60]['tilesPerSec'])
+    tiles = rates[60]['tiles']['256']
+    self.assertAlmostEqual(800 / 60.0, tiles['tilesPerSec'])
+    self.assertAlmostEqual(2, tiles['meanMs'])
+    self.assertAlmostEqual(2, tiles['p99Ms'])
+    # The first sample is 60s old, just out of the window.
+    self.assertAlmostEqual(700 / 50.0,
+                           history.get_instance_rate('fractal-00'))
+
+  def test_young_histories_cover_less_than_a_window(self):
+    history = self.history()
+    self.sample_every_10s(history, [0, 100, 200])
+    self.assertAlmostEqual(10, history.get_rates()[60]['tilesPerSec'])
+
+  def test_rates_are_cluster_wide(self):
+    history = self.history()
+    self.sample_every_10s(history, [0, 100], 'fractal-00')
+    self.sample_every_10s(history, [0, 300], 'fractal-01')
+    self.assertAlmostEqual(40, history.get_rates()[10]['tilesPerSec'])
+    self.assertAlmostEqual(10, history.get_instance_rate('fractal-00'))
+    self.assertAlmostEqual(30, history.get_instance_rate('fractal-01'))
+
+  def test_saved_histories_drop_instances_gone_quiet(self):
+    history = self.history()
+    self.sample_every_10s(history, [0, 100], 'fractal-00')
+    self.clock.now += 100
+    self.sample_every_10s(history, [0, 100], 'fractal-01')
+    history.save()
+    self.assertEqual(['fractal-01'], self.history()._instances.keys())
+
+  def test_concurrent_saves_keep_the_first(self):
+    self.history().save()
+    first, second = self.history(), self.history()
+    self.sample_every_10s(first, [0, 100], 'fractal-00')
+    self.sample_every_10s(second, [0, 100], 'fractal-01')
+    first.save()
+    second.save()
+    self.assertEqual(['fractal-00'], self.history()._instances.keys())
+
+
+class HistogramTest(unittest.TestCase):
+  """Tests of the tile time histograms exported as tileHist."""
+
+  def setUp(self):
+    testing.reset()
+    self.clock = Clock()
+    testing.patch(self, main, 'time', self.clock)
+
+  def test_parse_tile_histograms(self):
+    self.assertEqual({
+        '256': {40: 3, 44: 1},
+        '128': {36: 2},
+    }, main.parse_tile_histograms(
+        {'tileHist': {'256:40': 3, '256:44': '1', '128:36': 2}}))
+    self.assertEqual({}, main.parse_tile_histograms(server_vars(1, 1)))
+
+  def test_merge_histogram(self):
+    histogram = {40: 1}
+    main.merge_histogram({40: 2, 44: 3}, histogram)
+    self.assertEqual({40: 3, 44: 3}, histogram)
+
+  def test_percentiles_fall_in_their_bucket(self):
+    histogram = {40: 90, 44: 9, 60: 1}
+    self.assertAlmostEqual(
+        bucket_ms(40), main.histogram_percentile(histogram, 50))
+    self.assertAlmostEqual(
+        bucket_ms(44), main.histogram_percentile(histogram, 95))
+    self.assertAlmostEqual(
+        bucket_ms(44), main.histogram_percentile(histogram, 99))
+    self.assertAlmostEqual(
+        bucket_ms(60), main.histogram_percentile(histogram, 100))
+
+  def test_empty_histograms_have_no_percentiles(self):
+    self.assertEqual(None, main.histogram_percentile({}, 50))
+
+  def test_rates_use_the_histograms_of_the_window(self):
+    history = main.VarsHistory('history')
+    history.add_sample('fractal-00', 980, server_vars(0, 0, histogram={}))
+    # Slow tiles before the last window are left out of it.
+    history.add_sample('fractal-00', 990,
+                       server_vars(10, 10, histogram={60: 10}))
+    history.add_sample('fractal-00', 1000,
+                       server_vars(20, 110, histogram={60: 10, 40: 100}))
+    rates = history.get_rates()
+    self.assertAlmostEqual(bucket_ms(40), rates[10]['tiles']['256']['p99Ms'])
+    self.assertAlmostEqual(bucket_ms(60), rates[60]['tiles']['256']['p99Ms'])
+
+  def test_reset_histograms_are_not_intervals(self):
+    history = main.VarsHistory('history')
+    history.add_sample('fractal-00', 990,
+                       server_vars(10, 10, histogram={40: 10}))
+    history.add_sample('fractal-00', 1000,
+                       server_vars(20, 20, histogram={44: 20}))
+    self.assertEqual(0, len(history._intervals))
+
+  def test_aggregate_percentiles(self):
+    aggregator = main.ServerVarsAggregator()
+    aggregator.aggregate_vars(server_vars(10, 50, histogram={40: 50}))
+    aggregator.aggregate_vars(server_vars(20, 50, histogram={44: 50}))
+    percentiles = aggregator.get_aggregate()['tileTimePercentileMs']['256']
+    self.assertAlmostEqual(bucket_ms(40), percentiles['p50'])
+    self.assertAlmostEqual(bucket_ms(44), percentiles['p95'])
+
+
+class VmFileTest(unittest.TestCase):
+  """Tests of the files sent to the VMs and the published Go program."""
+
+  def setUp(self):
+    testing.reset()
+    testing.patch(self, main, '_vm_files', {})
+    self.project = testing.project()
+    self.fractal = main.Fractal()
+
+  def write(self, path, content):
+    with open(path, 'w') as f:
+      f.write(content)
+
+  def test_vm_files_are_read_once(self):
+    directory = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, directory)
+    path = os.path.join(directory, 'startup.sh')
+    self.write(path, 'v1')
+    self.assertEqual(('v1', hashlib.sha1('v1').hexdigest()),
+                     main.read_vm_file(path))
+    self.write(path, 'v2')
+    self.assertEqual('v1', main.read_vm_file(path)[0])
+
+  def test_the_go_program_is_published_under_its_hash(self):
+    testing.api.add_project(testing.PROJECT, {
+        'sshKeys': 'keys',
+        'goprog-0123456789ab': 'old program',
+    })
+    program, digest = main.read_vm_file(main.GO_PROGRAM)
+    key = self.fractal._publish_go_program(self.project)
+    self.assertEqual('goprog-' + digest[:12], key)
+    self.assertEqual({'sshKeys': 'keys', key: program},
+                     testing.api.metadata())
+
+  def test_a_published_program_is_not_sent_again(self):
+    key = self.fractal._publish_go_program(self.project)
+    self.assertEqual(key, self.fractal._publish_go_program(self.project))
+    self.assertEqual(
+        1, testing.api.count('compute.projects.setCommonInstanceMetadata'))
+
+  def test_failing_to_publish(self):
+    testing.api.fail('compute.projects.setCommonInstanceMetadata',
+                     testing.http_error(403, 'Forbidden'))
+    self.assertEqual(None, self.fractal._publish_go_program(self.project))
+
+  def metadata(self, instance_names):
+    return dict((item['key'], item['value']) for item in
+                self.fractal._get_instance_metadata(self.project,
+                                                    instance_names))
+
+  def test_instance_metadata_refers_to_the_published_program(self):
+    testing.patch(self, main, 'PUBLISH_GO_PROGRAM', True)
+    metadata = self.metadata(['fractal-00'])
+    self.assertFalse('goprog' in metadata)
+    self.assertTrue(metadata['goprog-ref'] in testing.api.metadata())
+    self.assertEqual(main.read_vm_file(main.STARTUP_SCRIPT)[0],
+                     metadata['startup-script'])
+    self.assertEqual('%s %sfractal-00' % (main.GO_ARGS,
+                                          main.GO_TILESERVER_FLAG),
+                     metadata['goargs'])
+
+  def test_instance_metadata_holds_the_program_unless_published(self):
+    metadata = self.metadata(['fractal-00'])
+    self.assertEqual(main.read_vm_file(main.GO_PROGRAM)[0],
+                     metadata['goprog'])
+    self.assertFalse('goprog-ref' in metadata)
+    testing.patch(self, main, 'PUBLISH_GO_PROGRAM', True)
+    testing.api.fail('compute.projects.setCommonInstanceMetadata',
+                     testing.http_error(403, 'Forbidden'))
+    self.assertTrue('goprog' in self.metadata(['fractal-00']))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -254,6 +254,13 @@ Fractal.prototype.LONGITUDE_ = 157.5;
  */
 Fractal.prototype.TILE_SIZE_ = 128;
 
+/**
+ * The window (s) of the server-side tile rates to display.
+ * @type {Number}
+ * @private
+ */
+Fractal.prototype.RATE_WINDOW_ = 10;
+
 /**
  * The minimum zoom on the map
  * @type {Number}
@@ -298,10 +305,24 @@ Fractal.prototype.initialize = function() {
   squaresRow.append(statContainer);
   this.statDisplay_ = new StatDisplay(statContainer, 'Avg Render Time', 'ms',
     function (data) {
+      var rates = this.getRates_(data)['tiles'] || {};
+      if (rates[this.TILE_SIZE_]) {
+        return rates[this.TILE_SIZE_]['meanMs'];
+      }
       var vars = data['vars'] || {};
       var avg_render_time = vars['tileTimeAvgMs'] || {};
       return avg_render_time[this.TILE_SIZE_];
     }.bind(this));
+  this.tailDisplay_ = new StatDisplay(statContainer, 'P95 Render Time', 'ms',
+    function (data) {
+      var rates = this.getRates_(data)['tiles'] || {};
+      return (rates[this.TILE_SIZE_] || {})['p95Ms'];
+    }.bind(this));
+  this.throughputDisplay_ = new StatDisplay(statContainer, 'Throughput',
+    'tiles/s',
+    function (data) {
+      return this.getRates_(data)['tilesPerSec'];
+    }.bind(this));
 
   // DEMO_NAME is set in the index.html template file.
   this.gce_ = new Gce('/' + DEMO_NAME + '/instance',
@@ -313,11 +334,24 @@ Fractal.prototype.initialize = function() {
   this.gce_.setOptions({
     squares: this.squares_,
     statDisplay: this.statDisplay_,
+    tailDisplay: this.tailDisplay_,
+    throughputDisplay: this.throughputDisplay_,
   });
 
   this.gce_.startContinuousHeartbeat(this.heartbeat.bind(this))
 }
 
+/**
+ * Get the cluster-wide tile rates over RATE_WINDOW_ from a status query.
+ * @param  {Object} data Result of a server status query
+ * @return {Object} The rates, or an empty object if there are none yet.
+ * @private
+ */
+Fractal.prototype.getRates_ = function(data) {
+  var rates = (data['vars'] || {})['rates'] || {};
+  return rates[this.RATE_WINDOW_] || {};
+};
+
 /**
  * Handle the heartbeat from the GCE object.
  *
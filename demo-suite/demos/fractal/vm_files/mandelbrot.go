@@ -59,6 +59,12 @@ var tileCount = expvar.NewMap("tileCount")
 // A Map of 'size' -> total time in microseconds
 var tileTime = expvar.NewMap("tileTime")
 
+// A Map of 'size:bucket' -> request count.  This is a histogram of tile times
+// per size, with histBucketsPerOctave buckets for each doubling of the time.
+// Bucket b counts times from 2^(b/histBucketsPerOctave) microseconds up to
+// the next bucket.  Histograms from several servers merge by adding counts.
+var tileHist = expvar.NewMap("tileHist")
+
 const (
 	// The number of iterations of the Mandelbrot calculation.
 	// More iterations mean higher quality at the cost of more CPU time.
@@ -89,6 +95,9 @@ const (
 	leafTileSize = 32
 
 	enableDebugLog = false
+
+	// The number of tileHist buckets per doubling of the tile time.
+	histBucketsPerOctave = 4
 )
 
 // A simple expvar.Var that outputs the time, in seconds, that this server has
@@ -212,7 +221,18 @@ func tileHandler(w http.ResponseWriter, r *http.Request) {
 	w.Header().Set("Content-Length", strconv.Itoa(len(b)))
 	w.Write(b)
 
-	tileTime.Add(strconv.Itoa(tileSize), time.Since(t0).Nanoseconds())
+	elapsed := time.Since(t0)
+	tileTime.Add(strconv.Itoa(tileSize), elapsed.Nanoseconds())
+	tileHist.Add(fmt.Sprintf("%d:%d", tileSize, histBucket(elapsed)), 1)
+}
+
+// Returns the tileHist bucket of a tile time.
+func histBucket(d time.Duration) int {
+	us := float64(d.Nanoseconds()) / 1000
+	if us < 1 {
+		return 0
+	}
+	return int(math.Floor(histBucketsPerOctave * math.Log2(us)))
 }
 
 func healthHandler(w http.ResponseWriter, r *http.Request) {
@@ -253,6 +273,7 @@ func varResetHandler(w http.ResponseWriter, r *http.Request) {
 	resetVarMap(requestTime)
 	resetVarMap(tileCount)
 	resetVarMap(tileTime)
+	resetVarMap(tileHist)
 
 	w.Header().Set("Content-Type", "text/plain")
 	w.Header().Set("Access-Control-Allow-Origin", "*")
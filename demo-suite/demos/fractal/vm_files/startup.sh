@@ -18,7 +18,14 @@ cd /tmp
 function runServer {
   while :
   do
-    $GMV attributes/goprog > ./program.go
+    # The program is either in the instance metadata, or published once as
+    # project metadata under the key in goprog-ref.
+    if GOPROG_REF=$($GMV attributes/goprog-ref 2> /dev/null) && \
+        [ -n "$GOPROG_REF" ]; then
+      $GMV attributes/$GOPROG_REF > ./program.go
+    else
+      $GMV attributes/goprog > ./program.go
+    fi
     PROG_ARGS=$($GMV attributes/goargs)
     CMDLINE="go run ./program.go $PROG_ARGS"
     echo "Running $CMDLINE"
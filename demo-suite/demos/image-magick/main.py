@@ -118,8 +118,8 @@ class Instance(webapp2.RequestHandler):
     # Figure out the image.  Use custom image if it exists.
     (image_project, image_name) = self._get_image_name(gce_project)
 
-    # Create a list of instances to insert.
-    instances = []
+    # Create a list of instances to insert. They share everything but their
+    # name, disk name, and image, sequence and machine number metadata.
     num_instances = int(self.request.get('num_instances'))
     network = gce.Network('default')
     network.gce_project = gce_project
@@ -128,26 +128,29 @@ class Instance(webapp2.RequestHandler):
                                    'type': 'ONE_TO_ONE_NAT'
                                   }]
                }]
+    startup_script = os.path.join(os.path.dirname(__file__), 'startup.sh')
+    prototype = gce.Instance(
+        network_interfaces=ext_net,
+        service_accounts=gce_project.settings['cloud_service_account'],
+        disk_mounts=[gce.DiskMount(boot=True,
+                                   init_disk_image=image_name,
+                                   init_disk_project=image_project,
+                                   auto_delete=True)],
+        metadata=[
+            {'key': 'startup-script', 'value': open(
+                startup_script, 'r').read()},
+            {'key': 'tag', 'value': DEMO_NAME},
+            {'key': 'gcs-path', 'value': gcs_path}])
+    template = gce.InstanceTemplate(gce_project, prototype)
+    instances = []
     for i in range(num_instances):
-      startup_script = os.path.join(os.path.dirname(__file__), 'startup.sh')
-      instance_name='%s-%d' % (DEMO_NAME, i)
-      instances.append(gce.Instance(
-          name=instance_name, 
-          network_interfaces=ext_net,
-          service_accounts=gce_project.settings['cloud_service_account'],
-          disk_mounts=[gce.DiskMount(boot=True, 
-                                     init_disk_name=instance_name,
-                                     init_disk_image=image_name, 
-                                     init_disk_project=image_project,
-                                     auto_delete=True)],
-          metadata=[
-              {'key': 'startup-script', 'value': open(
-                  startup_script, 'r').read()},
-              {'key': 'image', 'value': random.choice(IMAGES)},
-              {'key': 'seq', 'value': random.choice(SEQUENCES)},
-              {'key': 'machine-num', 'value': i},
-              {'key': 'tag', 'value': DEMO_NAME},
-              {'key': 'gcs-path', 'value': gcs_path}]))
+      instances.append(template.instance(
+          '%s-%d' % (DEMO_NAME, i),
+          metadata={
+              'image': random.choice(IMAGES),
+              'seq': random.choice(SEQUENCES),
+              'machine-num': i,
+          }))
 
     response = gce_appengine.GceAppEngine().run_gce_request(
         self,
@@ -168,7 +171,7 @@ class Instance(webapp2.RequestHandler):
     Returns:
       A tuple containing the image project and image name.
     """
-    if gce_project.list_images(filter='name eq ' + IMAGE):
+    if gce_project.resolve_image(IMAGE):
       return (gce_project.project_id, IMAGE)
     return (None, None)
 
@@ -160,8 +160,8 @@ class Instance(webapp2.RequestHandler):
 
     # Create a user specific route. We will apply this route to all 
     # instances without an IP address so their requests are routed
-    # through the first instance acting as a proxy. 
-    # gce_project.list_routes()
+    # through the first instance acting as a proxy. The route is only
+    # inserted if it doesn't exist yet.
     proxy_instance = gce.Instance(name='%s-0' % user_info['demo_id'],
                                   zone_name=gce_zone_name)
     proxy_instance.gce_project = gce_project
@@ -174,9 +174,9 @@ class Instance(webapp2.RequestHandler):
                           tags=['qs-%s' % user_info['ldap']])
     response = gce_appengine.GceAppEngine().run_gce_request(
         self,
-        gce_project.insert,
+        gce_project.ensure_route,
         'Error inserting route: ',
-        resource=gce_route)
+        route=gce_route)
 
     # Define a network interfaces list here that requests an ephemeral
     # external IP address. We will apply this configuration to the first
@@ -190,23 +190,27 @@ class Instance(webapp2.RequestHandler):
                                    }] 
                }]
     num_instances = int(self.request.get('num_instances'))
-    instances = [ gce.Instance('%s-%d' % (user_info['demo_id'], i), 
-                               zone_name=gce_zone_name,
-                               network_interfaces=(ext_net if i == 0 else None),
-                               metadata=([{
-                                    'key': 'startup-script', 
-                                    'value': user_data.STARTUP_SCRIPT % 'false'
-                                 }] if i==0 else [{
-                                    'key': 'startup-script',
-                                    'value': user_data.STARTUP_SCRIPT % 'true'
-                                 }]),
-                               service_accounts=[{'email': 'default', 
-                                 'scopes': ['https://www.googleapis.com/auth/compute']}],
-                               disk_mounts=[gce.DiskMount(
-                                 init_disk_name='%s-%d' % (user_info['demo_id'], i), boot=True)],
-                               can_ip_forward=(True if i == 0 else False),
-                               tags=(['qs-proxy'] if i == 0 else ['qs-%s' % user_info['ldap']]))
-                    for i in range(num_instances) ]
+    service_accounts = [{'email': 'default',
+                         'scopes': ['https://www.googleapis.com/auth/compute']}]
+    proxy_template = gce.InstanceTemplate(gce_project, gce.Instance(
+        zone_name=gce_zone_name,
+        network_interfaces=ext_net,
+        metadata=[{'key': 'startup-script',
+                   'value': user_data.STARTUP_SCRIPT % 'false'}],
+        service_accounts=service_accounts,
+        disk_mounts=[gce.DiskMount(boot=True)],
+        can_ip_forward=True,
+        tags=['qs-proxy']))
+    worker_template = gce.InstanceTemplate(gce_project, gce.Instance(
+        zone_name=gce_zone_name,
+        metadata=[{'key': 'startup-script',
+                   'value': user_data.STARTUP_SCRIPT % 'true'}],
+        service_accounts=service_accounts,
+        disk_mounts=[gce.DiskMount(boot=True)],
+        tags=['qs-%s' % user_info['ldap']]))
+    names = ['%s-%d' % (user_info['demo_id'], i) for i in range(num_instances)]
+    instances = (proxy_template.instances(names[:1]) +
+                 worker_template.instances(names[1:]))
     response = gce_appengine.GceAppEngine().run_gce_request(
         self,
         gce_project.bulk_insert,
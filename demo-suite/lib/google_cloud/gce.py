@@ -18,6 +18,11 @@ __author__ = 'kbrisbin@google.com (Kathryn Hurley)'
 
 import logging
 import os
+import Queue
+import random
+import sys
+import threading
+import time
 
 import lib_path
 from apiclient import discovery
@@ -32,10 +37,297 @@ except ImportError:
   import json
 
 import gce_exception as error
+import instance_cache
+import rate_limiter
+import tracing
 
 API = 'compute'
 GCE_URL = 'https://www.googleapis.com/%s' % API
 GOOGLE_PROJECT = 'centos-cloud'
+DISCOVERY_URI = 'https://www.googleapis.com/discovery/v1/apis/%s/%s/rest'
+DISCOVERY_DOC_DIR = os.path.join(
+    os.path.dirname(__file__), '../../discovery', API)
+SETTINGS_FILE = os.path.join(os.path.dirname(__file__), '../../settings.json')
+# Whether to re-read settings.json when its modification time changes. This
+# costs a stat per GceProject, so it's only worth enabling during development.
+RELOAD_SETTINGS = False
+# Maximum number of API requests a GceProject runs concurrently.
+MAX_CONCURRENT_REQUESTS = 8
+# Partial response fields for instance listings that only report status,
+# and for those that also need the external IP.
+INSTANCE_STATUS_FIELDS = ('name', 'status', 'zone')
+INSTANCE_NETWORK_FIELDS = INSTANCE_STATUS_FIELDS + (
+    'networkInterfaces/accessConfigs/natIP',)
+# Limits for a single batch request, and how many batches run concurrently.
+# The API accepts up to 1000 calls per batch, but insert bodies carrying
+# startup scripts reach the request size limit long before that.
+MAX_BATCH_SIZE = 100
+MAX_BATCH_BYTES = 1024 * 1024
+MAX_CONCURRENT_BATCHES = 4
+# Seconds between polls of pending operations. The interval grows by
+# OPERATION_POLL_BACKOFF after each poll, up to OPERATION_POLL_MAX_INTERVAL.
+OPERATION_POLL_INTERVAL = 1
+OPERATION_POLL_BACKOFF = 1.5
+OPERATION_POLL_MAX_INTERVAL = 10
+# Default seconds to wait for operations, leaving a handler time to answer
+# within the 60 second App Engine request deadline.
+OPERATION_TIMEOUT = 45
+# Memcache namespace and seconds the existence of prerequisite resources,
+# such as firewalls, routes and images, is cached. Missing images are only
+# cached briefly, so a new image is soon found.
+EXISTENCE_NAMESPACE = 'gce-existence'
+EXISTENCE_TTL = 10 * 60
+MISSING_TTL = 30
+
+# Parsed discovery documents, keyed by API version. Shared by every
+# GceProject in the process so the schema is fetched and parsed only once.
+_discovery_docs = {}
+# build_from_document fixes up the parameters of the document it is given in
+# place, so services are built from the shared documents one at a time.
+_discovery_lock = threading.Lock()
+
+
+def _get_discovery_doc(api_version):
+  """Returns the parsed Compute Engine discovery document for api_version.
+
+  The document is loaded once per process. A local copy in discovery/compute
+  is used if one exists for the API version, otherwise the document is
+  fetched from the discovery service. The caller must hold _discovery_lock.
+
+  Args:
+    api_version: The string API version (ex: v1).
+
+  Returns:
+    A dictionary representing the discovery document.
+
+  Raises:
+    GceError: Raised when the discovery document can't be fetched.
+  """
+
+  discovery_doc = _discovery_docs.get(api_version)
+  if discovery_doc is None:
+    discovery_doc_path = os.path.join(
+        DISCOVERY_DOC_DIR, '%s.json' % api_version)
+    if os.path.exists(discovery_doc_path):
+      content = open(discovery_doc_path, 'r').read()
+    else:
+      discovery_http = httplib2.Http(memcache, timeout=30)
+      try:
+        resp, content = discovery_http.request(
+            DISCOVERY_URI % (API, api_version))
+      except httplib2.HttpLib2Error, e:
+        logging.error(e)
+        raise error.GceError('Transport Error occurred')
+      if resp.status >= 400:
+        raise error.GceError(
+            'Discovery Error: %s %s' % (resp.status, resp.reason))
+    discovery_doc = json.loads(content)
+    _discovery_docs[api_version] = discovery_doc
+  return discovery_doc
+
+
+def _build_service(api_version, http):
+  """Builds a Compute Engine service object from the shared document.
+
+  Args:
+    api_version: The string API version (ex: v1).
+    http: The authorized httplib2.Http object the service sends requests
+        with.
+
+  Returns:
+    An apiclient.discovery.Resource object for Compute Engine.
+
+  Raises:
+    GceError: Raised when the discovery document can't be fetched.
+  """
+
+  with _discovery_lock:
+    return discovery.build_from_document(
+        _get_discovery_doc(api_version), http=http)
+
+
+# The parsed settings.json and the modification time it was read at.
+_settings = {'values': None, 'mtime': None}
+
+
+def _get_settings():
+  """Returns the parsed settings.json file.
+
+  The file is parsed once per process. The returned dictionary is shared and
+  must be treated as read-only.
+
+  Returns:
+    A dictionary of settings.
+  """
+
+  values = _settings['values']
+  if values is None or RELOAD_SETTINGS:
+    mtime = os.path.getmtime(SETTINGS_FILE)
+    if values is None or mtime != _settings['mtime']:
+      values = json.loads(open(SETTINGS_FILE, 'r').read())
+      _settings['values'], _settings['mtime'] = values, mtime
+  return values
+
+
+# Rate limiters, keyed by their rates. Local buckets must be shared by every
+# GceProject in the process, so limiters are only created once.
+_rate_limiters = {}
+
+
+def _get_rate_limiter(rates):
+  """Returns the process-wide RateLimiter for the given rates.
+
+  Args:
+    rates: A dictionary mapping method family to calls per second.
+
+  Returns:
+    A rate_limiter.RateLimiter object.
+  """
+
+  key = tuple(sorted(rates.items()))
+  limiter = _rate_limiters.get(key)
+  if limiter is None:
+    limiter = _rate_limiters.setdefault(key, rate_limiter.RateLimiter(rates))
+  return limiter
+
+
+class RetryPolicy(object):
+  """Decides whether and when failed API requests are retried.
+
+  Requests rejected by rate limiting (429, or 403 with a rate limit reason)
+  never ran, so they are always safe to retry. Server and transport errors
+  are only retried for idempotent requests (GET, DELETE). When a batch
+  request fails as a whole, this is decided for each request in it. Delays
+  grow exponentially with full jitter and honor any Retry-After header.
+
+  Attributes:
+    max_retries: The maximum number of retries for a single request.
+    base_delay: The delay ceiling in seconds for the first retry.
+    max_delay: The maximum delay in seconds between retries.
+    budget: The maximum number of retries across all requests using this
+        policy.
+    retries: The number of retries made so far.
+    gave_up: The number of retryable failures that were not retried because
+        max_retries or the budget was exhausted.
+  """
+
+  IDEMPOTENT_METHODS = ('GET', 'HEAD', 'DELETE', 'PUT')
+  RETRY_STATUSES = (500, 502, 503, 504)
+  RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+
+  def __init__(self, max_retries=3, base_delay=0.5, max_delay=16, budget=20):
+    """Initializes the RetryPolicy class.
+
+    Args:
+      max_retries: The maximum number of retries for a single request.
+      base_delay: The delay ceiling in seconds for the first retry.
+      max_delay: The maximum delay in seconds between retries.
+      budget: The maximum number of retries across all requests.
+    """
+
+    self.max_retries = max_retries
+    self.base_delay = base_delay
+    self.max_delay = max_delay
+    self.budget = budget
+    self.retries = 0
+    self.gave_up = 0
+    # Requests may run on several threads sharing this policy.
+    self._lock = threading.Lock()
+
+  def should_retry(self, attempt, request, exception):
+    """Whether a failed request should be retried.
+
+    Args:
+      attempt: The number of retries already made for the request.
+      request: The apiclient.http.HttpRequest or BatchHttpRequest object.
+      exception: The httplib2.HttpLib2Error or apiclient.errors.HttpError
+          raised by the request, or the GceError of the failed batch
+          request the request was part of.
+
+    Returns:
+      True if the request should be retried.
+    """
+
+    if not self._is_retryable(request, exception):
+      return False
+    with self._lock:
+      if attempt >= self.max_retries or self.retries >= self.budget:
+        self.gave_up += 1
+        return False
+    return True
+
+  def wait(self, attempt, exception=None):
+    """Sleep before retrying and count the retry.
+
+    Args:
+      attempt: The number of retries already made for the request.
+      exception: The exception that caused the retry, if any.
+    """
+
+    delay = random.uniform(
+        0, min(self.max_delay, self.base_delay * 2 ** attempt))
+    retry_after = self._retry_after(exception)
+    if retry_after:
+      delay = max(delay, min(retry_after, self.max_delay))
+    with self._lock:
+      self.retries += 1
+    logging.warning('Retrying request in %.2fs after: %s', delay, exception)
+    time.sleep(delay)
+
+  def _is_retryable(self, request, exception):
+    """Whether the failure is transient and retrying the request is safe."""
+
+    # BatchHttpRequest objects have no method; batches are always POSTed.
+    idempotent = getattr(request, 'method', 'POST') in self.IDEMPOTENT_METHODS
+    if isinstance(exception, httplib2.HttpLib2Error):
+      return idempotent
+
+    if isinstance(exception, error.GceError):
+      status = exception.status
+    else:
+      resp = getattr(exception, 'resp', None)
+      if resp is None:
+        return False
+      status = int(resp.status)
+      if status == 403 and self._is_rate_limited(exception):
+        return True
+    if status == 429:
+      return True
+    return idempotent and status in self.RETRY_STATUSES
+
+  def _is_rate_limited(self, exception):
+    """Whether a 403 error was caused by a rate limit."""
+
+    try:
+      errors = json.loads(exception.content)['error']['errors']
+    except (ValueError, KeyError, TypeError):
+      return False
+    return any(e.get('reason') in self.RATE_LIMIT_REASONS for e in errors)
+
+  def _retry_after(self, exception):
+    """Returns the Retry-After header of the failed response in seconds."""
+
+    resp = getattr(exception, 'resp', None)
+    try:
+      return int(resp.get('retry-after'))
+    except (AttributeError, TypeError, ValueError):
+      return None
+
+
+def _instance_class(summary):
+  """Returns the class used for listed instances.
+
+  Args:
+    summary: Whether compact InstanceSummary objects are wanted.
+
+  Returns:
+    The InstanceSummary or Instance class.
+  """
+
+  if summary:
+    return InstanceSummary
+  return Instance
+
 
 class GceProject(object):
   """Gce classes and methods to work with Compute Engine.
@@ -45,11 +337,16 @@ class GceProject(object):
     gce_url: The string URL of the Compute Engine API endpoint.
     project_id: A string name for the Compute Engine project.
     zone_name: A string name for the default zone.
+    credentials: An oauth2client.client.Credentials object.
     service: An apiclient.discovery.Resource object for Compute Engine.
+    retry_policy: The RetryPolicy object applied to API requests. Its
+        counters report the retries made for this project.
+    rate_limiter: The rate_limiter.RateLimiter object API calls wait on.
   """
 
   def __init__(
-      self, credentials, project_id=None, zone_name=None, settings=None):
+      self, credentials, project_id=None, zone_name=None, settings=None,
+      retry_policy=None, rate_limiter=None):
     """Initializes the GceProject class.
 
     Sets default values for class attributes. See the instance resource for
@@ -64,27 +361,26 @@ class GceProject(object):
       settings: A dictionary of GCE settings. These settings will override
           any settings in the settings.json file. See the settings.json file for
           key names.
+      retry_policy: A RetryPolicy object. Defaults to a new RetryPolicy.
+      rate_limiter: A rate_limiter.RateLimiter object. Defaults to one shared
+          by the process, using the rate_limits in the settings.
     """
 
-    settings_file = os.path.join(
-        os.path.dirname(__file__), '../../settings.json')
-    self.settings = json.loads(open(settings_file, 'r').read())
+    # A shallow copy is enough to overlay the per-project overrides; nested
+    # values are shared with the process-wide settings and are read-only.
+    self.settings = dict(_get_settings())
     if settings:
       self.settings.update(settings)
 
     api_version = self.settings['compute']['api_version']
     self.gce_url = '%s/%s' % (GCE_URL, api_version)
 
-    # Ability to build API from a local discovery doc is disabled here,
-    # by commenting out code. We're not removing the code altogether, 
-    # in case we ever want to revert to using a local discovery doc.
-    #discovery_doc_path = 'discovery/compute/%s.json' % api_version
-    #discovery_doc = open(discovery_doc_path, 'r').read()
-
+    # The discovery document is cached per process, so only the credentials
+    # are bound for each new GceProject.
+    self.credentials = credentials
     auth_http = self._auth_http(credentials)
-    #self.service = discovery.build_from_document(
-      #discovery_doc, api_version, http=auth_http)
-    self.service = discovery.build('compute', api_version, http=auth_http)
+    self.service = _build_service(api_version, auth_http)
+    self._collections = {}
 
     self.project_id = project_id
     if not self.project_id:
@@ -94,7 +390,32 @@ class GceProject(object):
     if not self.zone_name:
       self.zone_name = self.settings['compute']['zone']
 
-  def list_instances(self, zone_name=None, **args):
+    self.retry_policy = retry_policy or RetryPolicy()
+    self.rate_limiter = rate_limiter or _get_rate_limiter(
+        self.settings['compute'].get('rate_limits', {}))
+
+  def collection(self, name):
+    """Returns a collection of the apiclient.discovery.Resource object.
+
+    Building a collection creates a new Resource with all of its methods, so
+    collections are cached for the lifetime of the project. They are bound
+    to this project's credentials, so they're never shared between projects.
+
+    Args:
+      name: The string name of the collection (ex: instances, firewalls).
+
+    Returns:
+      The collection apiclient.discovery.Resource object.
+    """
+
+    collection = self._collections.get(name)
+    if collection is None:
+      collection = self._collections.setdefault(
+          name, getattr(self.service, name)())
+    return collection
+
+  def list_instances(
+      self, zone_name=None, summary=False, fields=None, **args):
     """Lists all instances for a project and zone with an optional filter.
 
     Args represent any optional parameters for the list instances request.
@@ -104,11 +425,69 @@ class GceProject(object):
 
     Args:
       zone_name: The zone in which to query.
+      summary: If True, return compact InstanceSummary objects.
+      fields: An optional list of instance fields to fetch, such as
+          INSTANCE_STATUS_FIELDS. Implies summary.
+
+    Returns:
+      A list of Instance or InstanceSummary objects, see iter_instances.
+    """
+
+    return list(self.iter_instances(zone_name and [zone_name],
+                                    summary=summary, fields=fields, **args))
+
+  def list_instances_all_zones(self, summary=False, fields=None, **args):
+    """Lists instances in every zone of the project with an optional filter.
+
+    Uses the aggregated list request, so a multi-zone cluster is listed in a
+    single round trip per page. Each instance's zone is set to the zone it
+    lives in. Args represent any optional parameters for the aggregated list
+    instances request. See the API documentation:
+
+    https://developers.google.com/compute/docs/reference/v1/instances/aggregatedList
+
+    Args:
+      summary: If True, return compact InstanceSummary objects.
+      fields: An optional list of instance fields to fetch, such as
+          INSTANCE_STATUS_FIELDS. Implies summary.
 
     Returns:
-      A list of Instance objects.
+      A list of Instance or InstanceSummary objects.
     """
-    return self._list(Instance, zone_name=zone_name, **args)
+
+    return list(self._iter_aggregated_list(
+        _instance_class(summary or fields), fields=fields, **args))
+
+  def iter_instances(
+      self, zone_names=None, summary=False, fields=None, **args):
+    """Iterates over the instances in one or more zones.
+
+    Zones are listed concurrently and instances are yielded as each page of
+    results arrives, so the order of the instances is not defined. Args
+    represent any optional parameters for the list instances request.
+
+    Args:
+      zone_names: A list of string zone names to query. Defaults to the
+          project's zone.
+      summary: If True, yield compact InstanceSummary objects.
+      fields: An optional list of instance fields to fetch, such as
+          INSTANCE_STATUS_FIELDS. Implies summary.
+
+    Returns:
+      A generator of Instance or InstanceSummary objects.
+    """
+
+    instance_class = _instance_class(summary or fields)
+    if not zone_names:
+      zone_names = [self.zone_name]
+    if len(zone_names) == 1:
+      return self._iter_list(instance_class, zone_name=zone_names[0],
+                             fields=fields, **args)
+
+    def list_zone(zone_name, http):
+      return self._iter_list(instance_class, zone_name=zone_name, http=http,
+                             fields=fields, **args)
+    return self._fan_out(list_zone, zone_names)
 
   def list_firewalls(self, **args):
     """Lists all firewalls for a project.
@@ -187,50 +566,338 @@ class GceProject(object):
       raise
 
   def bulk_insert(self, resources):
-    """Insert multiple resources using a batch request.
+    """Insert multiple resources using batch requests.
+
+    Resources are split into batches bounded by MAX_BATCH_SIZE calls and
+    MAX_BATCH_BYTES of request bodies, which run concurrently.
 
     Args:
       resources: A list of GceResource objects.
 
+    Returns:
+      A BatchResult object with the operation or error for each resource.
+
     Raises:
-      GceError: Raised when API call fails.
+      GceError: Raised when API call fails for every resource.
       GceTokenError: Raised when the access token fails to refresh.
     """
 
-    batch = http.BatchHttpRequest()
-    for resource in resources:
-      resource.gce_project = self
-      batch.add(self._insert_request(resource), callback=self._batch_response)
-
-    try:
-      self._run_request(batch)
-    except error.GceError:
-      raise
-    except error.GceTokenError:
-      raise
+    return self._bulk(
+        [(resource, self._insert_request) for resource in resources])
 
   def bulk_delete(self, resources):
-    """Delete resources using a batch request.
+    """Delete resources using batch requests.
+
+    Resources are split into batches bounded by MAX_BATCH_SIZE calls, which
+    run concurrently.
 
     Args:
       resources: A list of GceResource objects.
 
+    Returns:
+      A BatchResult object with the operation or error for each resource.
+
+    Raises:
+      GceError: Raised when API call fails for every resource.
+      GceTokenError: Raised when the access token fails to refresh.
+    """
+
+    self._forget(resources)
+    return self._bulk(
+        [(resource, self._delete_request) for resource in resources])
+
+  def bulk_apply(self, inserts=None, deletes=None):
+    """Insert and delete resources in the same batch requests.
+
+    Args:
+      inserts: A list of GceResource objects to insert.
+      deletes: A list of GceResource objects to delete.
+
+    Returns:
+      A BatchResult object with the operation or error for each resource.
+
+    Raises:
+      GceError: Raised when API call fails for every resource.
+      GceTokenError: Raised when the access token fails to refresh.
+    """
+
+    self._forget(deletes or [])
+    return self._bulk(
+        [(resource, self._insert_request) for resource in inserts or []] +
+        [(resource, self._delete_request) for resource in deletes or []])
+
+  def reconcile_instances(self, target_names, current, build):
+    """Insert and delete instances so that exactly the targets exist.
+
+    Only the missing instances are built, and insertions and deletions go
+    out in the same batch requests, see bulk_apply.
+
+    Args:
+      target_names: A list of the string names of the instances to run.
+      current: A list of the Instance or InstanceSummary objects that exist.
+          Those not named in target_names are deleted.
+      build: A callable taking a sorted list of the names of the missing
+          instances, and returning their Instance objects. It is only called
+          if instances are missing.
+
+    Returns:
+      A BatchResult object with the operation or error for each instance, or
+      None if the instances were already reconciled.
+
+    Raises:
+      GceError: Raised when API call fails for every instance.
+      GceTokenError: Raised when the access token fails to refresh.
+    """
+
+    target_set = set(target_names)
+    current_names = set(instance.name for instance in current)
+    to_add = sorted(target_set - current_names)
+    to_remove = [instance for instance in current
+                 if instance.name not in target_set]
+    logging.info('Reconciling instances, adding %s, removing %s',
+                 to_add, [instance.name for instance in to_remove])
+    if not to_add and not to_remove:
+      return None
+    return self.bulk_apply(inserts=to_add and build(to_add),
+                           deletes=to_remove)
+
+  def set_common_metadata(self, items, replace_prefix=None):
+    """Sets metadata entries common to all instances of the project.
+
+    Other entries of the project's metadata are kept, except for those
+    replaced by prefix. Nothing is sent if the entries are already set.
+
+    Args:
+      items: A list of dictionaries with the key and value of each entry.
+      replace_prefix: An optional string key prefix. Existing entries with
+          this prefix that aren't in items are removed.
+
+    Returns:
+      The dictionary operation, or None if the metadata was up to date.
+
     Raises:
       GceError: Raised when API call fails.
       GceTokenError: Raised when the access token fails to refresh.
     """
 
-    batch = http.BatchHttpRequest()
-    for resource in resources:
-      resource.gce_project = self
-      batch.add(self._delete_request(resource), callback=self._batch_response)
+    projects = self.collection('projects')
+    project = self._run_request(projects.get(
+        project=self.project_id, fields='commonInstanceMetadata'))
+    metadata = project.get('commonInstanceMetadata', {})
+
+    current = dict((item['key'], item.get('value'))
+                   for item in metadata.get('items', []))
+    updated = dict(current)
+    if replace_prefix:
+      for key in current:
+        if key.startswith(replace_prefix):
+          del updated[key]
+    updated.update((item['key'], item['value']) for item in items)
+    if updated == current:
+      return None
+
+    body = {'items': [{'key': key, 'value': value}
+                      for key, value in sorted(updated.items())]}
+    if 'fingerprint' in metadata:
+      body['fingerprint'] = metadata['fingerprint']
+    return self._run_request(projects.setCommonInstanceMetadata(
+        project=self.project_id, body=body))
+
+  def ensure_firewall(self, firewall, ttl=EXISTENCE_TTL):
+    """Insert the firewall unless it exists.
+
+    See _ensure.
+
+    Args:
+      firewall: A Firewall object.
+      ttl: The number of seconds the firewall's existence is cached.
+
+    Returns:
+      True if the firewall was inserted, False if it existed.
+
+    Raises:
+      GceError: Raised when API call fails.
+      GceTokenError: Raised when the access token fails to refresh.
+    """
+
+    return self._ensure(firewall, ttl)
+
+  def ensure_route(self, route, ttl=EXISTENCE_TTL):
+    """Insert the route unless it exists.
+
+    See _ensure.
+
+    Args:
+      route: A Route object.
+      ttl: The number of seconds the route's existence is cached.
+
+    Returns:
+      True if the route was inserted, False if it existed.
+
+    Raises:
+      GceError: Raised when API call fails.
+      GceTokenError: Raised when the access token fails to refresh.
+    """
+
+    return self._ensure(route, ttl)
+
+  def resolve_image(self, name, project_id=None, ttl=EXISTENCE_TTL,
+                    missing_ttl=MISSING_TTL):
+    """Get an image by name, if it exists.
+
+    The image is fetched directly by name. The outcome is cached in memcache,
+    for ttl seconds if the image exists and missing_ttl seconds if not.
+
+    Args:
+      name: The string name of the image.
+      project_id: The string name of the project owning the image. Defaults
+          to this project.
+      ttl: The number of seconds an existing image is cached.
+      missing_ttl: The number of seconds a missing image is cached.
+
+    Returns:
+      An Image object, or None if the image doesn't exist.
+
+    Raises:
+      GceError: Raised when API call fails.
+      GceTokenError: Raised when the access token fails to refresh.
+    """
+
+    image = Image(name=name, project_id=project_id or self.project_id)
+    image.gce_project = self
+    key = self._existence_key(image)
+    image_json = memcache.get(key, namespace=EXISTENCE_NAMESPACE)
+    if image_json is None:
+      try:
+        image_json = self._run_request(self._get_request(image))
+      except error.GceError, e:
+        if e.status != 404:
+          raise
+        image_json = {}
+      memcache.set(key, image_json, time=image_json and ttl or missing_ttl,
+                   namespace=EXISTENCE_NAMESPACE)
+
+    if not image_json:
+      return None
+    image.from_json(image_json)
+    return image
+
+  def wait_for_operations(
+      self, operations, timeout=OPERATION_TIMEOUT, callback=None):
+    """Wait for zone and global operations to complete.
+
+    Pending operations are polled with one batch request per tick, with an
+    exponentially growing interval between ticks.
+
+    Args:
+      operations: A list of operation resource dictionaries, such as the
+          values of BatchResult.operations.
+      timeout: The maximum number of seconds to wait. Callers in a request
+          handler must stay within its deadline.
+      callback: An optional callable invoked with each operation resource
+          as soon as it is DONE.
+
+    Returns:
+      A dictionary mapping operation name to the latest operation resource.
+      Operations still pending after the timeout have a status other than
+      DONE. Operations that could not be polled are reported DONE, with the
+      poll error under 'error', like operations that failed.
+
+    Raises:
+      GceTokenError: Raised when the access token fails to refresh.
+    """
+
+    latest = {}
+    pending = {}
+    for operation in operations:
+      latest[operation['name']] = operation
+      if operation.get('status') == 'DONE':
+        if callback:
+          callback(operation)
+      else:
+        pending[operation['name']] = operation
+
+    deadline = time.time() + timeout
+    interval = OPERATION_POLL_INTERVAL
+    while pending and time.time() < deadline:
+      time.sleep(min(interval, max(deadline - time.time(), 0)))
+      interval = min(interval * OPERATION_POLL_BACKOFF,
+                     OPERATION_POLL_MAX_INTERVAL)
+
+      requests = [(name, self._operation_request(operation))
+                  for name, operation in pending.items()]
+      for name, response, exception in self._run_batches(requests):
+        if exception is not None:
+          response = dict(latest[name], status='DONE', error={'errors': [{
+              'code': 'POLL_FAILED',
+              'message': 'Error polling operation: %s' % exception}]})
+        elif not response:
+          continue
+        latest[name] = response
+        if response.get('status') == 'DONE':
+          del pending[name]
+          if callback:
+            callback(response)
+
+    if pending:
+      logging.warning('Operations still pending after %ss: %s',
+                      timeout, sorted(pending))
+    return latest
+
+  def _ensure(self, resource, ttl):
+    """Insert a resource unless it exists.
+
+    Resources known to exist are cached in memcache for ttl seconds, so
+    these calls usually make no API requests. Otherwise the resource is
+    fetched directly by name, and inserted if it's missing. An insert that
+    fails because the resource already exists, say, because a concurrent
+    request inserted it, counts as success.
 
+    Args:
+      resource: A named, global or zonal GceResource object.
+      ttl: The number of seconds the resource's existence is cached.
+
+    Returns:
+      True if the resource was inserted, False if it existed.
+
+    Raises:
+      GceError: Raised when API call fails.
+      GceTokenError: Raised when the access token fails to refresh.
+    """
+
+    resource.gce_project = self
+    key = self._existence_key(resource)
+    if memcache.get(key, namespace=EXISTENCE_NAMESPACE):
+      return False
+
+    inserted = False
     try:
-      self._run_request(batch)
-    except error.GceError:
-      raise
-    except error.GceTokenError:
-      raise
+      self._run_request(self._get_request(resource))
+    except error.GceError, e:
+      if e.status != 404:
+        raise
+      try:
+        self.insert(resource)
+        inserted = True
+      except error.GceError, e:
+        if e.status != 409:
+          raise
+    memcache.set(key, True, time=ttl, namespace=EXISTENCE_NAMESPACE)
+    return inserted
+
+  def _existence_key(self, resource):
+    """Returns the memcache key caching the existence of a resource."""
+
+    project_id = getattr(resource, 'project_id', None) or self.project_id
+    return '%s:%s:%s' % (project_id, resource.type, resource.name)
+
+  def _forget(self, resources):
+    """Drop the cached existence of resources about to be deleted."""
+
+    keys = [self._existence_key(resource) for resource in resources
+            if resource.type != 'instance']
+    if keys:
+      memcache.delete_multi(keys, namespace=EXISTENCE_NAMESPACE)
 
   def _list(self, resource_class, zone_name=None, **args):
     """Get a list of all project resources of type resource_class.
@@ -247,30 +914,274 @@ class GceProject(object):
       GceTokenError: Raised when the access token fails to refresh.
     """
 
-    resources = []
+    return list(self._iter_list(resource_class, zone_name=zone_name, **args))
+
+  def _iter_list(self, resource_class, zone_name=None, http=None,
+                 fields=None, **args):
+    """Iterates over all project resources of type resource_class.
+
+    Pages are fetched lazily, one request per page.
+
+    Args:
+      resource_class: A class of type GceResource.
+      zone_name: A string zone to apply to the request, if applicable.
+      http: An optional httplib2.Http object to run the requests with.
+      fields: An optional list of resource fields to fetch. The API then
+          sends a partial response with only these fields.
+
+    Yields:
+      resource_class objects.
+
+    Raises:
+      GceError: Raised when API call fails.
+      GceTokenError: Raised when the access token fails to refresh.
+    """
+
     resource = resource_class()
     resource.gce_project = self
 
+    if fields:
+      args['fields'] = 'items(%s),nextPageToken' % ','.join(fields)
     request = self._list_request(resource, zone_name=zone_name, **args)
     while request:
-      results = {}
-      try:
-        results = self._run_request(request)
-      except error.GceError:
-        raise
-      except error.GceTokenError:
-        raise
+      results = self._run_request(request, http=http)
 
       for result in results.get('items', []):
         new_resource = resource_class()
         new_resource.from_json(result)
-        resources.append(new_resource)
+        yield new_resource
 
-      request = resource.service_resource().list_next(
-          self._list_request(resource, zone_name=zone_name, **args),
-          results)
+      # list_next copies the previous request, only swapping the page token.
+      request = resource.service_resource().list_next(request, results)
 
-    return resources
+  def _bulk(self, builders):
+    """Run a request per resource as chunked, concurrent batch requests.
+
+    Args:
+      builders: A list of (GceResource, build_request) tuples, where
+          build_request is a callable taking the GceResource and returning
+          its apiclient.http.HttpRequest object.
+
+    Returns:
+      A BatchResult object with the operation or error for each resource.
+
+    Raises:
+      GceError: Raised when API call fails for every resource.
+      GceTokenError: Raised when the access token fails to refresh.
+    """
+
+    requests = []
+    for resource, build_request in builders:
+      resource.gce_project = self
+      requests.append((resource, build_request(resource)))
+
+    batch_result = BatchResult()
+    for resource, response, exception in self._run_batches(requests):
+      batch_result.add(resource, response, exception)
+
+    # Cached listings no longer reflect the instances being changed.
+    if any(resource.type == 'instance' for resource, _ in requests):
+      instance_cache.invalidate(self.project_id)
+
+    if batch_result.failed and not batch_result.succeeded:
+      raise error.GceError(
+          'Batch Error: all %d requests failed' % len(batch_result.failed))
+    return batch_result
+
+  def _run_batches(self, requests):
+    """Run requests as chunked batch requests, several at a time.
+
+    Args:
+      requests: A list of (key, apiclient.http.HttpRequest) tuples. Keys
+          identify the requests in the results.
+
+    Returns:
+      A generator of (key, response, exception) tuples, one per request.
+      Requests that got no response of their own, such as those of a batch
+      that failed as a whole, are reported with the batch's GceError, unless
+      the retry policy retries them.
+
+    Raises:
+      GceTokenError: Raised when the access token fails to refresh.
+    """
+
+    def run_batch(chunk, batch_http):
+      results = []
+      attempt = 0
+      while chunk:
+        retry = []
+        answered = set()
+
+        def callback(request_id, response, exception):
+          answered.add(request_id)
+          key, request = chunk[int(request_id)]
+          if exception is not None and self.retry_policy.should_retry(
+              attempt, request, exception):
+            retry.append((key, request, exception))
+            return
+          self._batch_response(request_id, response, exception)
+          results.append((key, response, exception))
+
+        batch = http.BatchHttpRequest()
+        for i, (_, request) in enumerate(chunk):
+          # Keys needn't be strings or unique, so ids are chunk positions.
+          batch.add(request, callback=callback, request_id=str(i))
+        batch_error = None
+        try:
+          self._throttle([request for _, request in chunk])
+          self._run_request(batch, http=batch_http)
+        except error.GceError, e:
+          batch_error = e
+        # Requests without a response of their own fail with the batch. If
+        # it failed transiently, those it's safe to are retried.
+        unanswered = [(key, request) for i, (key, request) in enumerate(chunk)
+                      if str(i) not in answered]
+        exception = batch_error or error.GceError(
+            'Batch Error: no response for %d requests' % len(unanswered))
+        for key, request in unanswered:
+          if batch_error and self.retry_policy.should_retry(
+              attempt, request, batch_error):
+            retry.append((key, request, batch_error))
+          else:
+            results.append((key, None, exception))
+
+        # Calls that failed transiently are retried together in a new batch.
+        if retry:
+          self.retry_policy.wait(attempt, retry[0][2])
+        chunk = [(key, request) for key, request, _ in retry]
+        attempt += 1
+      return results
+
+    return self._fan_out(
+        run_batch, self._chunk_requests(requests),
+        max_workers=MAX_CONCURRENT_BATCHES)
+
+  def _chunk_requests(self, requests):
+    """Split requests into chunks that fit in a single batch request.
+
+    Args:
+      requests: A list of (key, apiclient.http.HttpRequest) tuples.
+
+    Returns:
+      A list of lists of (key, apiclient.http.HttpRequest) tuples, each
+      with at most MAX_BATCH_SIZE requests and MAX_BATCH_BYTES of bodies.
+      A request bigger than MAX_BATCH_BYTES gets a chunk of its own.
+    """
+
+    chunks = []
+    chunk = []
+    chunk_bytes = 0
+    for key, request in requests:
+      request_bytes = len(request.body or '')
+      if chunk and (len(chunk) >= MAX_BATCH_SIZE or
+                    chunk_bytes + request_bytes > MAX_BATCH_BYTES):
+        chunks.append(chunk)
+        chunk = []
+        chunk_bytes = 0
+      chunk.append((key, request))
+      chunk_bytes += request_bytes
+    if chunk:
+      chunks.append(chunk)
+    return chunks
+
+  def _iter_aggregated_list(
+      self, resource_class, http=None, fields=None, **args):
+    """Iterates over zonal resources of type resource_class in all zones.
+
+    Args:
+      resource_class: A class of type GceResource with a zonal scope.
+      http: An optional httplib2.Http object to run the requests with.
+      fields: An optional list of resource fields to fetch. The API then
+          sends a partial response with only these fields.
+
+    Yields:
+      resource_class objects.
+
+    Raises:
+      GceError: Raised when API call fails.
+      GceTokenError: Raised when the access token fails to refresh.
+    """
+
+    resource = resource_class()
+    resource.gce_project = self
+    # Results are grouped by scope (ex: zones/us-central1-a), then by the
+    # plural resource type (ex: instances).
+    items_key = '%ss' % resource.type
+
+    params = {'project': self.project_id}
+    params.update(args)
+    if fields:
+      params['fields'] = 'items/*/%s(%s),nextPageToken' % (
+          items_key, ','.join(fields))
+    request = resource.service_resource().aggregatedList(**params)
+    while request:
+      results = self._run_request(request, http=http)
+
+      for scoped_results in results.get('items', {}).values():
+        for result in scoped_results.get(items_key, []):
+          new_resource = resource_class()
+          new_resource.from_json(result)
+          yield new_resource
+
+      request = resource.service_resource().aggregatedList_next(
+          request, results)
+
+  def _fan_out(self, work, items, max_workers=MAX_CONCURRENT_REQUESTS):
+    """Runs work for each item on a pool of threads, streaming the results.
+
+    httplib2.Http objects are not thread safe, so each thread authorizes its
+    own and passes it to work along with the item.
+
+    Args:
+      work: A callable taking an item and an httplib2.Http object, returning
+          an iterable of results.
+      items: A list of items to process.
+      max_workers: The maximum number of threads to run.
+
+    Yields:
+      The results of work, in the order they are produced.
+
+    Raises:
+      Any exception raised by work. Results of other items are discarded.
+    """
+
+    pending = Queue.Queue()
+    for item in items:
+      pending.put(item)
+    results = Queue.Queue()
+    done = object()
+    trace_id = tracing.correlation_id()
+
+    def worker():
+      try:
+        with tracing.restore(trace_id):
+          http = self._auth_http(self.credentials)
+          while True:
+            try:
+              item = pending.get_nowait()
+            except Queue.Empty:
+              break
+            for result in work(item, http):
+              results.put((result, None))
+      except Exception:
+        results.put((None, sys.exc_info()))
+      finally:
+        results.put((done, None))
+
+    num_workers = min(len(items), max_workers)
+    for _ in range(num_workers):
+      thread = threading.Thread(target=worker)
+      thread.daemon = True
+      thread.start()
+
+    while num_workers:
+      result, exc_info = results.get()
+      if result is done:
+        num_workers -= 1
+      elif exc_info:
+        raise exc_info[0], exc_info[1], exc_info[2]
+      else:
+        yield result
 
   def _insert_request(self, resource):
     """Construct an insert request for the resource.
@@ -286,6 +1197,7 @@ class GceProject(object):
     params = {'project': self.project_id, 'body': resource.json}
     if resource.scope == 'zonal':
       params['zone'] = self.zone_name
+    tracing.event('insert_request', type=resource.type, body=params['body'])
     return resource.service_resource().insert(**params)
 
   def _list_request(self, resource, zone_name=None, **args):
@@ -308,6 +1220,24 @@ class GceProject(object):
       params['zone'] = zone_name
     return resource.service_resource().list(**params)
 
+  def _get_request(self, resource):
+    """Construct a get request for the resource, by name.
+
+    Args:
+      resource: A GceResource object. Images are fetched from the project
+          owning them.
+
+    Returns:
+      The get method of the apiclient.discovery.Resource object.
+    """
+
+    project_id = getattr(resource, 'project_id', None) or self.project_id
+    zone = getattr(resource, 'zone', None)
+    params = {'project': project_id, resource.type: resource.name}
+    if resource.scope == 'zonal':
+      params['zone'] = zone and zone.name or self.zone_name
+    return resource.service_resource().get(**params)
+
   def _delete_request(self, resource):
     """Return the delete method of the apiclient.discovery.Resource object.
 
@@ -318,17 +1248,44 @@ class GceProject(object):
       The delete method of the apiclient.discovery.Resource object.
     """
 
+    # Listed resources know their zone, which may not be the project's zone.
+    zone = getattr(resource, 'zone', None)
+    zone_name = zone and zone.name or self.zone_name
+
     resource.set_defaults()
     params = {'project': self.project_id, resource.type: resource.name}
     if resource.scope == 'zonal':
-      params['zone'] = self.zone_name
+      params['zone'] = zone_name
     return resource.service_resource().delete(**params)
 
-  def _run_request(self, request):
+  def _operation_request(self, operation):
+    """Construct a get request for a zone or global operation.
+
+    Args:
+      operation: An operation resource dictionary.
+
+    Returns:
+      The get method of the apiclient.discovery.Resource object.
+    """
+
+    if operation.get('zone'):
+      return self.collection('zoneOperations').get(
+          project=self.project_id,
+          zone=operation['zone'].split('/')[-1],
+          operation=operation['name'])
+    return self.collection('globalOperations').get(
+        project=self.project_id, operation=operation['name'])
+
+  def _run_request(self, request, http=None):
     """Run API request and handle any errors.
 
+    The request waits for the rate limiter, and transient failures are
+    retried according to the retry policy.
+
     Args:
       request: An apiclient.http.HttpRequest object.
+      http: An optional httplib2.Http object to run the request with, in
+          place of the one the request was built with.
 
     Returns:
       Dictionary results of the API call.
@@ -338,26 +1295,50 @@ class GceProject(object):
       GceTokenError: Raised if there's a failure refreshing the access token.
     """
 
-    result = {}
-    try:
-      result = request.execute()
-    except httplib2.HttpLib2Error, e:
-      logging.error(e)
-      raise error.GceError('Transport Error occurred')
-    except client.AccessTokenRefreshError, e:
-      logging.error(e)
-      raise error.GceTokenError('Access Token refresh error')
-    except api_errors.BatchError, e:
-      logging.error(e)
-      logging.error('BatchError: %s %s' % (e.resp.status, e.content))
-      if e.resp.status != 200:
-        raise error.GceError(
-            'Batch Error: %s %s' % (e.resp.status, e.resp.reason))
-    except api_errors.HttpError, e:
-      logging.error(e)
-      raise error.GceError(
-          'HttpError: %s %s' % (e.resp.status, e.resp.reason))
-    return result
+    attempt = 0
+    while True:
+      # Batches are throttled per call when they're built; only API method
+      # requests carry a method id.
+      if getattr(request, 'methodId', None):
+        self._throttle([request])
+      tracing.event('api_request', attempt=attempt,
+                    method=getattr(request, 'methodId', 'batch'))
+      try:
+        return request.execute(http=http)
+      except client.AccessTokenRefreshError, e:
+        logging.error(e)
+        raise error.GceTokenError('Access Token refresh error')
+      except (httplib2.HttpLib2Error, api_errors.HttpError), e:
+        if self.retry_policy.should_retry(attempt, request, e):
+          self.retry_policy.wait(attempt, e)
+          attempt += 1
+          continue
+
+        logging.error(e)
+        if isinstance(e, api_errors.BatchError):
+          status = getattr(e.resp, 'status', None)
+          logging.error('BatchError: %s %s' % (status, e.content))
+          raise error.GceError('Batch Error: %s %s' % (status, e.reason),
+                               status=status and int(status))
+        if isinstance(e, api_errors.HttpError):
+          raise error.GceError(
+              'HttpError: %s %s' % (e.resp.status, e.resp.reason),
+              status=int(e.resp.status))
+        raise error.GceError('Transport Error occurred')
+
+  def _throttle(self, requests):
+    """Wait until the rate limiter allows the requests to run.
+
+    Args:
+      requests: A list of apiclient.http.HttpRequest objects.
+    """
+
+    families = {}
+    for request in requests:
+      family = rate_limiter.method_family(request)
+      families[family] = families.get(family, 0) + 1
+    for family, count in families.items():
+      self.rate_limiter.acquire(self.project_id, family, count)
 
   def _batch_response(self, request_id, response, exception):
     """Log information about the batch request response.
@@ -388,6 +1369,97 @@ class GceProject(object):
     return auth_http
 
 
+class BatchResult(object):
+  """The per-resource results of a bulk operation.
+
+  A BatchResult is true if at least one call succeeded.
+
+  Attributes:
+    operations: A dictionary mapping resource name to the operation resource
+        returned for its call.
+    errors: A dictionary mapping resource name to the exception raised for
+        its call.
+  """
+
+  def __init__(self):
+    """Initializes the BatchResult class."""
+
+    self.operations = {}
+    self.errors = {}
+    self._resources = {}
+
+  def add(self, resource, response=None, exception=None):
+    """Record the result of the call for a resource.
+
+    Args:
+      resource: The GceResource object the call was made for.
+      response: The deserialized operation resource, if the call succeeded.
+      exception: The exception raised, if the call failed.
+    """
+
+    self._resources[resource.name] = resource
+    if exception is not None:
+      self.errors[resource.name] = exception
+      self.operations.pop(resource.name, None)
+    else:
+      self.operations[resource.name] = response or {}
+      self.errors.pop(resource.name, None)
+
+  @property
+  def succeeded(self):
+    """The names of the resources whose calls succeeded."""
+
+    return sorted(self.operations)
+
+  @property
+  def failed(self):
+    """The names of the resources whose calls failed."""
+
+    return sorted(self.errors)
+
+  def failed_resources(self):
+    """Returns the GceResource objects whose calls failed, for retrying."""
+
+    return [self._resources[name] for name in self.failed]
+
+  def operation_id(self, name):
+    """Returns the string operation name for a resource, if any."""
+
+    return self.operations.get(name, {}).get('name')
+
+  def status(self, name):
+    """Returns the operation status for a resource, or ERROR if it failed."""
+
+    if name in self.errors:
+      return 'ERROR'
+    return self.operations.get(name, {}).get('status')
+
+  @property
+  def json(self):
+    """Create a json representation of the results.
+
+    Returns:
+      A dictionary mapping resource name to a dictionary with the operation
+      name, status and, for failed calls, the error message.
+    """
+
+    results = {}
+    for name in self.succeeded:
+      results[name] = {
+          'operation': self.operation_id(name),
+          'status': self.status(name),
+      }
+    for name, exception in self.errors.items():
+      results[name] = {'status': 'ERROR', 'error': str(exception)}
+    return results
+
+  def __nonzero__(self):
+    return bool(self.operations)
+
+  def __len__(self):
+    return len(self.operations) + len(self.errors)
+
+
 class GceResource(object):
   """A GCE resource belonging to a GCE project.
 
@@ -518,7 +1590,7 @@ class DiskMount(object):
       image = Image(self.init_disk_image, self.init_disk_project)
       image.gce_project = self.gce_project
       mount['initializeParams']['sourceImage'] = image.url
-    logging.info('mount: ' + json.dumps(mount))
+    tracing.event('disk_mount', mount=mount)
     return mount
 
   def from_json(self, json_resource):
@@ -584,9 +1656,6 @@ class Instance(GceResource):
         service accounts.
   """
 
-  # Static class var for caching references to client lib instances() method.
-  method_ref = None
-
   def __init__(self,
                name=None,
                zone_name=None,
@@ -662,9 +1731,10 @@ class Instance(GceResource):
     """
 
     self.name = json_resource['name']
-    self.zone_name = Zone(json_resource['zone'].split('/')[-1])
+    zone_name = json_resource['zone'].split('/')[-1]
+    self.zone = Zone(zone_name)
     self.machine_type = MachineType(json_resource['machineType'].split('/')[-1],
-                                    self.zone_name)
+                                    zone_name)
     self.network_interfaces = json_resource['networkInterfaces']
     if json_resource.get('description', None):
       self.description = json_resource['description']
@@ -722,14 +1792,237 @@ class Instance(GceResource):
       The instances method of the apiclient.discovery.Resource object.
     """
 
-    # Obtain a method reference if we don't already have one. Otherwise, 
-    # reuse the one we've already obtained and cached in a static class 
-    # variable. This avoids significant real time delay.
-    # TEMP COMMENTED OUT
-    #if not Instance.method_ref:
-      #Instance.method_ref = self.gce_project.service.instances()
-    #return Instance.method_ref
-    return self.gce_project.service.instances()
+    return self.gce_project.collection('instances')
+
+
+class InstanceSummary(object):
+  """A compact, read-only view of a listed GCE Instance resource.
+
+  Only the fields needed to report on an instance are kept. Metadata values
+  (such as startup scripts), disks and service accounts are dropped, and the
+  Zone object is only created when asked for. A summary can be passed to
+  bulk_delete in place of an Instance.
+
+  Attributes:
+    name: The string name of the instance.
+    zone_name: The string name of the instance's zone.
+    machine_type_name: The string name of the instance's machine type.
+    status: The string status of the instance.
+    status_message: An optional string explaining the status.
+    tags: A list of string tags for the instance.
+    network_interfaces: A list of dictionaries representing the instance's
+        network interfaces.
+    metadata_keys: A list of the string keys of the instance's metadata.
+  """
+
+  __slots__ = (
+      'name', 'zone_name', 'machine_type_name', 'status', 'status_message',
+      'tags', 'network_interfaces', 'metadata_keys', 'gce_project')
+
+  type = 'instance'
+  scope = 'zonal'
+
+  def __init__(self):
+    """Initializes the InstanceSummary class."""
+
+    for attribute in self.__slots__:
+      setattr(self, attribute, None)
+
+  def __getstate__(self):
+    """Returns the state to pickle, leaving out the GceProject."""
+
+    return dict((attribute, getattr(self, attribute))
+                for attribute in self.__slots__ if attribute != 'gce_project')
+
+  def __setstate__(self, state):
+    """Restores the pickled state."""
+
+    self.__init__()
+    for attribute, value in state.items():
+      setattr(self, attribute, value)
+
+  @property
+  def zone(self):
+    """A Zone object for the instance's zone."""
+
+    return Zone(self.zone_name)
+
+  @property
+  def external_ip(self):
+    """The string external (NAT) IP of the instance, or None."""
+
+    for interface in self.network_interfaces or []:
+      for config in interface.get('accessConfigs', []):
+        if 'natIP' in config:
+          return config['natIP']
+    return None
+
+  def from_json(self, json_resource):
+    """Sets member variables from a dictionary representing an instance.
+
+    Args:
+      json_resource: A dictionary representing the instance.
+    """
+
+    # Partial responses may leave out any field but the name.
+    self.name = json_resource['name']
+    if json_resource.get('zone'):
+      self.zone_name = json_resource['zone'].split('/')[-1]
+    if json_resource.get('machineType'):
+      self.machine_type_name = json_resource['machineType'].split('/')[-1]
+    self.status = json_resource.get('status')
+    self.status_message = json_resource.get('statusMessage')
+    self.tags = json_resource.get('tags', {}).get('items')
+    self.network_interfaces = json_resource.get('networkInterfaces')
+    self.metadata_keys = [
+        item['key']
+        for item in json_resource.get('metadata', {}).get('items', [])]
+
+  def set_defaults(self):
+    """Listed instances are complete, so there are no defaults to set."""
+
+  def service_resource(self):
+    """Return the instances method of the apiclient.discovery.Resource object.
+
+    Returns:
+      The instances method of the apiclient.discovery.Resource object.
+    """
+
+    return self.gce_project.collection('instances')
+
+
+class InstanceTemplate(object):
+  """Stamps out instances that share everything but their names.
+
+  The JSON body shared by the instances, with the machine type, network
+  interfaces, disks, metadata and service accounts, is built once from a
+  prototype Instance. Each instance's body only substitutes the instance
+  name, the names of its auto-created disks and any metadata of its own.
+  Parts of the shared body are shared between the instances' bodies, so
+  they must not be modified.
+  """
+
+  def __init__(self, gce_project, prototype, disk_name_format='%s'):
+    """Initializes the InstanceTemplate class.
+
+    Args:
+      gce_project: An object of type GceProject.
+      prototype: An Instance object with the settings of every instance. Its
+          name is not used, and defaults are set from the project.
+      disk_name_format: A format string applied to the instance name to name
+          the disk created for the instance (ex: 'boot-%s'). Only one disk
+          can be created per instance.
+    """
+
+    prototype.gce_project = gce_project
+    prototype.set_defaults()
+    self.gce_project = gce_project
+    self.zone = prototype.zone
+    self.disk_name_format = disk_name_format
+    self.body = prototype.json
+    self.metadata = self.body.get('metadata', {}).get('items', [])
+
+  def instance(self, name, metadata=None):
+    """Returns an instance based on the template.
+
+    Args:
+      name: The string name of the instance.
+      metadata: An optional dictionary of metadata values by key for this
+          instance. These are added to, or replace, the template's metadata.
+
+    Returns:
+      A TemplateInstance object, which can be passed to bulk_insert.
+    """
+
+    return TemplateInstance(self, name, metadata)
+
+  def instances(self, names):
+    """Returns a list of instances based on the template, one per name."""
+
+    return [TemplateInstance(self, name) for name in names]
+
+  def json(self, name, metadata=None):
+    """Create a json representation of an instance.
+
+    Args:
+      name: The string name of the instance.
+      metadata: An optional dictionary of metadata values by key.
+
+    Returns:
+      A dictionary representing the instance.
+    """
+
+    instance = dict(self.body, name=name)
+    if 'disks' in instance:
+      instance['disks'] = [self._disk(disk, name) for disk in instance['disks']]
+    if metadata:
+      items = [item for item in self.metadata if item['key'] not in metadata]
+      items.extend({'key': key, 'value': value}
+                   for key, value in sorted(metadata.items()))
+      instance['metadata'] = {'items': items}
+    return instance
+
+  def _disk(self, disk, name):
+    """Returns the disk mount of an instance, naming the disk it creates."""
+
+    params = disk.get('initializeParams')
+    if not params:
+      return disk
+    disk = dict(disk)
+    disk['initializeParams'] = dict(
+        params, diskName=self.disk_name_format % name)
+    return disk
+
+
+class TemplateInstance(object):
+  """An instance to insert, whose body comes from an InstanceTemplate."""
+
+  __slots__ = ('name', 'template', 'metadata', 'gce_project')
+
+  type = 'instance'
+  scope = 'zonal'
+
+  def __init__(self, template, name, metadata=None):
+    """Initializes the TemplateInstance class.
+
+    Args:
+      template: The InstanceTemplate object.
+      name: The string name of the instance.
+      metadata: An optional dictionary of metadata values by key.
+    """
+
+    self.template = template
+    self.name = name
+    self.metadata = metadata
+    self.gce_project = template.gce_project
+
+  @property
+  def zone(self):
+    """The Zone object of the template."""
+
+    return self.template.zone
+
+  @property
+  def json(self):
+    """Create a json representation of the resource.
+
+    Returns:
+      A dictionary representing the resource.
+    """
+
+    return self.template.json(self.name, self.metadata)
+
+  def set_defaults(self):
+    """Defaults were set once on the template."""
+
+  def service_resource(self):
+    """Return the instances method of the apiclient.discovery.Resource object.
+
+    Returns:
+      The instances method of the apiclient.discovery.Resource object.
+    """
+
+    return self.gce_project.collection('instances')
 
 
 class Firewall(GceResource):
@@ -842,7 +2135,7 @@ class Firewall(GceResource):
       The firewalls method of the apiclient.discovery.Resource object.
     """
 
-    return self.gce_project.service.firewalls()
+    return self.gce_project.collection('firewalls')
 
 
 class Route(GceResource):
@@ -950,7 +2243,7 @@ class Route(GceResource):
       The routes method of the apiclient.discovery.Resource object.
     """
 
-    return self.gce_project.service.routes()
+    return self.gce_project.collection('routes')
 
 
 
@@ -1035,7 +2328,7 @@ class Image(GceResource):
       The images method of the apiclient.discovery.Resource object.
     """
 
-    return self.gce_project.service.images()
+    return self.gce_project.collection('images')
 
 
 class Disk(GceResource):
@@ -1048,9 +2341,6 @@ class Disk(GceResource):
     size_gb: The size of the disk in GB
   """
 
-  # Static class var for caching references to client lib disks() method.
-  method_ref = None
-
   def __init__(self,
                name=None,
                zone_name=None,
@@ -1114,14 +2404,7 @@ class Disk(GceResource):
       The disks method of the apiclient.discovery.Resource object.
     """
 
-    # Obtain a method reference if we don't already have one. Otherwise, 
-    # reuse the one we've already obtained and cached in a static class 
-    # variable. This avoids significant real time delay.
-    # TEMP COMMENTED OUT
-    #if not Disk.method_ref:
-      #Disk.method_ref = self.gce_project.service.disks()
-    #return Disk.method_ref
-    return self.gce_project.service.disks()
+    return self.gce_project.collection('disks')
 
 class MachineType(GceResource):
   """A class representing a GCE Machine Type resource.
@@ -1148,7 +2431,7 @@ class MachineType(GceResource):
       The machineTypes method of the apiclient.discovery.Resource object.
     """
 
-    return self.gce_project.service.machineTypes()
+    return self.gce_project.collection('machineTypes')
 
   def set_defaults(self):
     """Set any defaults before insert."""
@@ -1182,7 +2465,7 @@ class Zone(GceResource):
       The zones method of the apiclient.discovery.Resource object.
     """
 
-    return self.gce_project.service.zones()
+    return self.gce_project.collection('zones')
 
 
 class Network(GceResource):
@@ -1209,4 +2492,4 @@ class Network(GceResource):
       The networks method of the apiclient.discovery.Resource object.
     """
 
-    return self.gce_project.service.networks()
+    return self.gce_project.collection('networks')
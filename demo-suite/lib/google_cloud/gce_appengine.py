@@ -14,14 +14,45 @@
 
 """GCE App Engine Helper class."""
 
+import hashlib
 import json
 import logging
+import time
 
+from google.appengine.api import memcache
 from google.appengine.api import users
+import gce
 import gce_exception as error
+import instance_cache
+import single_flight
+import tracing
 
 
 MAX_RESULTS = 100
+# Prefixes of the names of GCE methods that only read state. Concurrent
+# identical calls to these are coalesced.
+READ_METHOD_PREFIXES = ('list_', 'get_', 'resolve_')
+# Memcache namespace and lifetime, in seconds, of the instance snapshots
+# that delta responses are computed against.
+SNAPSHOT_NAMESPACE = 'gce-instance-snapshots'
+SNAPSHOT_TTL = 60
+# Maximum seconds a long-poll request is held waiting for a state change.
+# Each open status page holds a request, counted against the instance's
+# concurrent requests, so this is kept short.
+LONG_POLL_TIMEOUT = 10
+# Seconds between checks of the project's instance cache generation by a
+# held request, which wakes it when instances are inserted or deleted. A
+# check is a single memcache get.
+LONG_POLL_TICK = 0.25
+# Seconds between state reads of a held request, to see status changes that
+# don't invalidate the cache, such as an instance starting. Matches the
+# instance cache TTL, so held requests share the cached listings.
+LONG_POLL_INTERVAL = instance_cache.TTL
+# Fields of an instance record that make up the state version. Other fields,
+# like server stats, change on every request and don't end a long poll.
+VERSION_FIELDS = ('status', 'zone', 'externalIp')
+
+_single_flight = single_flight.SingleFlight()
 
 class GceAppEngine(object):
   """Contains generic GCE methods for demos."""
@@ -30,7 +61,9 @@ class GceAppEngine(object):
     """Retrieves instance list for the demo.
 
     Sends the instance list in the response as a JSON object, mapping instance
-    name to status.
+    name to status and zone. Instances are listed across all zones, through
+    the shared instance cache. See poll_instance_state for long polling and
+    write_instance_state for versioning.
 
     Args:
       request_handler: An instance of webapp2.RequestHandler.
@@ -38,28 +71,178 @@ class GceAppEngine(object):
       demo_name: The string name of the demo.
     """
 
+    self.poll_instance_state(
+        request_handler,
+        lambda: self._demo_instance_state(
+            request_handler, gce_project, demo_name),
+        project_id=gce_project.project_id)
+
+  def _demo_instance_state(self, request_handler, gce_project, demo_name):
+    """Returns the state of the demo instances, for list_demo_instances."""
+
     instances = self.run_gce_request(
         request_handler,
-        gce_project.list_instances,
+        instance_cache.list_instances,
         'Error listing instances: ',
+        gce_project=gce_project,
+        user_id=users.get_current_user().user_id(),
+        fields=gce.INSTANCE_STATUS_FIELDS,
         filter='name eq ^%s.*' % demo_name,
         maxResults=MAX_RESULTS)
 
     instance_dict = {}
-    for instance in instances:
-      instance_dict[instance.name] = {'status': instance.status}
+    for instance in instances or []:
+      instance_dict[instance.name] = {
+          'status': instance.status,
+          'zone': instance.zone_name,
+      }
 
     result_dict = {
       'instances': instance_dict,
     }
-    request_handler.response.headers['Content-Type'] = 'application/json'
-    request_handler.response.out.write(json.dumps(result_dict))
+    return result_dict
+
+  def poll_instance_state(self, request_handler, get_state, project_id=None):
+    """Sends the instance state once it differs from the client's version.
+
+    A request with 'since' and 'wait' parameters is held until the state
+    version differs from 'since', or for 'wait' seconds (at most
+    LONG_POLL_TIMEOUT). Other requests are answered right away. The version
+    only covers the instance names and VERSION_FIELDS, so changing server
+    stats don't end the wait; they are sent when it times out. The state is
+    sent with write_instance_state.
+
+    A held request reads the state again as soon as the project's instance
+    cache is invalidated, which inserting or deleting instances does, so
+    those changes are sent within LONG_POLL_TICK seconds. Other changes,
+    like instances starting, are only seen by listing again, so the state is
+    also read every LONG_POLL_INTERVAL seconds, and they are sent up to that
+    late.
+
+    Args:
+      request_handler: An instance of webapp2.RequestHandler.
+      get_state: A callable returning the current state, see
+          write_instance_state.
+      project_id: The string name of the project the instances are listed
+          from, whose instance cache generation is watched. If None, the
+          state is only read every LONG_POLL_INTERVAL seconds.
+    """
+
+    since = request_handler.request.get('since')
+    try:
+      wait = min(float(request_handler.request.get('wait') or 0),
+                 LONG_POLL_TIMEOUT)
+    except ValueError:
+      wait = 0
+    deadline = time.time() + wait
+
+    state = get_state()
+    read_at = time.time()
+    generation = project_id and instance_cache.generation(project_id)
+    while (since and request_handler.response.status_int == 200 and
+           self._state_version(state) == since):
+      if time.time() + LONG_POLL_TICK >= deadline:
+        # Send fresh server stats with the unchanged state.
+        if time.time() - read_at >= LONG_POLL_TICK:
+          state = get_state()
+        break
+      time.sleep(LONG_POLL_TICK)
+      invalidated = False
+      if project_id:
+        current = instance_cache.generation(project_id)
+        invalidated = current != generation
+        generation = current
+      if invalidated or time.time() - read_at >= LONG_POLL_INTERVAL:
+        state = get_state()
+        read_at = time.time()
+    self.write_instance_state(request_handler, state)
+
+  def write_instance_state(self, request_handler, state):
+    """Sends the instance state in the response as a versioned JSON object.
+
+    The version, see _state_version, is sent in the 'version' field. The
+    ETag is a fingerprint of the whole state. A request with a matching
+    If-None-Match header gets an empty 304 response. A request whose
+    If-None-Match header names a recent ETag gets only the instances added or
+    changed since then, under 'instances', and the names of the removed ones,
+    under 'removed', with 'delta' set to true. Otherwise the full state is
+    sent.
+
+    Args:
+      request_handler: An instance of webapp2.RequestHandler.
+      state: A dictionary with the instance dictionary under 'instances', and
+          any other values to send.
+    """
+
+    response = request_handler.response
+    response.headers['Content-Type'] = 'application/json'
+    if response.status_int != 200:
+      # Listing failed, the state is incomplete.
+      response.out.write(json.dumps(state))
+      return
+
+    etag = hashlib.sha1(json.dumps(state, sort_keys=True)).hexdigest()
+    response.headers['Cache-Control'] = 'no-cache'
+    response.etag = etag
+    if_none_match = self._if_none_match(request_handler.request)
+    if etag in if_none_match:
+      response.set_status(304)
+      return
+
+    instances = state['instances']
+    memcache.add(etag, instances, time=SNAPSHOT_TTL,
+                 namespace=SNAPSHOT_NAMESPACE)
+
+    result_dict = dict(state, version=self._state_version(state))
+    previous = None
+    if if_none_match:
+      previous = memcache.get(if_none_match[0], namespace=SNAPSHOT_NAMESPACE)
+    if previous is not None:
+      result_dict['delta'] = True
+      result_dict['instances'] = dict(
+          (name, record) for name, record in instances.iteritems()
+          if previous.get(name) != record)
+      result_dict['removed'] = [
+          name for name in previous if name not in instances]
+    response.out.write(json.dumps(result_dict))
+
+  def _if_none_match(self, request):
+    """Returns the list of entity tags of a request's If-None-Match header."""
+
+    tags = []
+    for tag in request.headers.get('If-None-Match', '').split(','):
+      tag = tag.strip()
+      if tag.startswith('W/'):
+        tag = tag[2:]
+      if tag:
+        tags.append(tag.strip('"'))
+    return tags
+
+  def _state_version(self, state):
+    """Returns the string version of an instance state.
+
+    The version is a fingerprint of the instance names and their
+    VERSION_FIELDS only, so it changes when instances come, go or change
+    status, but not with their stats.
+
+    Args:
+      state: A dictionary with the instance dictionary under 'instances'.
+
+    Returns:
+      The string version.
+    """
+
+    stable = dict(
+        (name, [record.get(field) for field in VERSION_FIELDS])
+        for name, record in state['instances'].iteritems())
+    return hashlib.sha1(json.dumps(stable, sort_keys=True)).hexdigest()
 
   def delete_demo_instances(self, request_handler, gce_project, demo_name):
     """Deletes instances for the demo.
 
-    First retrieves an instance list with instance names starting with the
-    demo name. A bulk request is then sent to delete all these instances.
+    First retrieves an instance list, across all zones, with instance names
+    starting with the demo name. A bulk request is then sent to delete all
+    these instances.
 
     Args:
       request_handler: An instance of webapp2.RequestHandler.
@@ -67,10 +250,14 @@ class GceAppEngine(object):
       demo_name: The string name of the demo.
     """
 
+    # The listed instances are handed to bulk_delete, which binds them to
+    # this project, so they can't be shared with other requests.
     instances = self.run_gce_request(
         request_handler,
-        gce_project.list_instances,
+        gce_project.list_instances_all_zones,
         'Error listing instances: ',
+        coalesce=False,
+        fields=gce.INSTANCE_STATUS_FIELDS,
         filter='name eq ^%s-.*' % demo_name,
         maxResults=MAX_RESULTS)
 
@@ -121,6 +308,7 @@ class GceAppEngine(object):
         request_handler,
         gce_project.list_routes,
         'Error listing routes: ',
+        coalesce=False,
         filter='name eq ^%s$' % route_name,
         maxResults=MAX_RESULTS)
 
@@ -135,24 +323,43 @@ class GceAppEngine(object):
         self.response.headers['Content-Type'] = 'text/plain'
         self.response.out.write('Deleting route')
 
-  def run_gce_request(self, request_handler, gce_method, error_message, **args):
+  def run_gce_request(self, request_handler, gce_method, error_message,
+                      coalesce=None, **args):
     """Run a GCE Project list, insert, delete method.
 
-    Any extra args are used as arguments for the gce_method.
+    Any extra args are used as arguments for the gce_method. Concurrent
+    identical read calls in this process, by the same user, for the same
+    project, method and arguments, share a single execution and its result.
+    Calls without a signed in user are never coalesced. The call is traced
+    (see the tracing module) if the request has a trace parameter, or if it
+    is sampled.
 
     Args:
       request_handler: An instance of webapp2.RequestHandler.
       gce_method: A method within gce.GceProject to run.
       error_message: A string error message to prepend an error message,
           should an error occur.
+      coalesce: Whether to coalesce identical concurrent calls. Defaults to
+          True for read methods (see READ_METHOD_PREFIXES). Results of
+          coalesced calls are shared and must not be modified.
 
     Returns:
       The response object, if the API call was successful.
     """
 
+    if coalesce is None:
+      coalesce = gce_method.__name__.startswith(READ_METHOD_PREFIXES)
+    user = users.get_current_user()
+
     response = None
     try:
-      response = gce_method(**args)
+      with tracing.scope(force=bool(request_handler.request.get('trace'))):
+        if coalesce and user:
+          response = _single_flight.do(
+              self._call_key(gce_method, args, user.user_id()),
+              gce_method, **args)
+        else:
+          response = gce_method(**args)
     except error.GceError, e:
       logging.error(error_message + e.message)
       request_handler.response.set_status(500, error_message + e.message)
@@ -161,3 +368,21 @@ class GceAppEngine(object):
       request_handler.redirect(users.create_login_url(request_handler.uri))
       return
     return response
+
+  def _call_key(self, gce_method, args, user_id):
+    """Returns a key identifying a call by user, project, method and args.
+
+    Args:
+      gce_method: The method, bound to a gce.GceProject, or a function
+          taking a gce_project argument.
+      args: The dictionary of arguments for the method.
+      user_id: The string id of the user whose credentials the call uses.
+
+    Returns:
+      A hashable key.
+    """
+
+    gce_project = getattr(gce_method, '__self__', None) or args['gce_project']
+    args = [(k, v) for k, v in sorted(args.items()) if k != 'gce_project']
+    return (user_id, gce_project.project_id, gce_method.__module__,
+            gce_method.__name__, repr(args))
@@ -0,0 +1,217 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the gce_appengine module."""
+
+import json
+import threading
+import time
+import unittest
+
+import testing
+import gce_exception as error
+import gce_appengine
+import instance_cache
+
+
+class RunGceRequestTest(unittest.TestCase):
+  """Tests of coalescing read calls in run_gce_request."""
+
+  def setUp(self):
+    testing.reset()
+    testing.api.add_instance('demo-00')
+    testing.api.latency = 0.05
+    self.gce_appengine = gce_appengine.GceAppEngine()
+
+  def list_concurrently(self, user_ids):
+    """Lists instances in a thread per user id, returns the listings."""
+
+    listings = []
+
+    def list_instances(user_id):
+      testing.login(user_id)
+      project = testing.project(credentials=testing.Credentials(user_id))
+      listings.append(self.gce_appengine.run_gce_request(
+          testing.RequestHandler(), project.list_instances,
+          'Error listing instances: ', filter='name eq demo-.*'))
+
+    threads = [threading.Thread(target=list_instances, args=(user_id,))
+               for user_id in user_ids]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    return listings
+
+  def test_concurrent_reads_of_a_user_share_one_call(self):
+    listings = self.list_concurrently(['alice'] * 5)
+    self.assertEqual(5, len(listings))
+    self.assertEqual(['demo-00'], [i.name for i in listings[0]])
+    self.assertEqual(1, testing.api.count('compute.instances.list'))
+
+  def test_reads_are_not_shared_between_users(self):
+    self.list_concurrently(['alice', 'bob', 'carol'])
+    self.assertEqual(3, testing.api.count('compute.instances.list'))
+
+  def test_reads_without_a_user_are_not_coalesced(self):
+    self.list_concurrently([None] * 3)
+    self.assertEqual(3, testing.api.count('compute.instances.list'))
+
+  def test_errors_reach_every_coalesced_caller(self):
+    calls = []
+
+    def list_failing(gce_project):
+      calls.append(gce_project)
+      time.sleep(0.05)
+      raise error.GceError('Deadline')
+
+    handlers = [testing.RequestHandler() for _ in range(3)]
+
+    def run(handler):
+      testing.login('alice')
+      self.gce_appengine.run_gce_request(
+          handler, list_failing, 'Error listing instances: ',
+          gce_project=testing.project())
+
+    threads = [threading.Thread(target=run, args=(handler,))
+               for handler in handlers]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(1, len(calls))
+    self.assertEqual([500] * 3,
+                     [handler.response.status_int for handler in handlers])
+
+
+class PollInstanceStateTest(unittest.TestCase):
+  """Tests of the versioned, long-polled instance state."""
+
+  def setUp(self):
+    testing.reset()
+    testing.patch(self, gce_appengine, 'LONG_POLL_TICK', 0.01)
+    testing.patch(self, gce_appengine, 'LONG_POLL_INTERVAL', 0.05)
+    self.gce_appengine = gce_appengine.GceAppEngine()
+    self.status = 'RUNNING'
+    self.reads = 0
+
+  def get_state(self):
+    """Returns a state like fractal's, with stats changing on every read."""
+
+    self.reads += 1
+    return {
+        'instances': {
+            'demo-00': {'status': self.status, 'zone': testing.ZONE},
+            'demo-01': {'status': 'RUNNING', 'zone': testing.ZONE},
+        },
+        'vars': {'rates': self.reads},
+        'instanceRates': {'demo-00': self.reads},
+    }
+
+  def poll(self, headers=None, **params):
+    handler = testing.RequestHandler(params, headers)
+    self.gce_appengine.poll_instance_state(
+        handler, self.get_state, project_id=testing.PROJECT)
+    return handler.response
+
+  def change_later(self, invalidate):
+    """Changes the status of an instance in 50ms, in the background."""
+
+    def change():
+      self.status = 'STOPPING'
+      if invalidate:
+        instance_cache.invalidate(testing.PROJECT)
+
+    timer = threading.Timer(0.05, change)
+    timer.start()
+    self.addCleanup(timer.join)
+
+  def test_version_ignores_server_stats(self):
+    first = self.get_state()
+    version = self.gce_appengine._state_version(first)
+    self.assertEqual(version,
+                     self.gce_appengine._state_version(self.get_state()))
+    self.status = 'STOPPING'
+    self.assertNotEqual(version,
+                        self.gce_appengine._state_version(self.get_state()))
+
+  def test_poll_waits_while_only_stats_change(self):
+    version = json.loads(self.poll().body)['version']
+    self.reads = 0
+    start = time.time()
+    response = self.poll(since=version, wait='0.2')
+    self.assertTrue(time.time() - start >= 0.15)
+    # Read once up front, every LONG_POLL_INTERVAL, and at the end.
+    self.assertTrue(3 <= self.reads <= 6, self.reads)
+    self.assertEqual(200, response.status_int)
+    result = json.loads(response.body)
+    self.assertEqual(version, result['version'])
+    self.assertEqual(self.reads, result['vars']['rates'])
+
+  def test_invalidation_wakes_the_poll(self):
+    testing.patch(self, gce_appengine, 'LONG_POLL_INTERVAL', 5)
+    version = json.loads(self.poll().body)['version']
+    self.reads = 0
+    self.change_later(invalidate=True)
+    start = time.time()
+    response = self.poll(since=version, wait='5')
+    self.assertLess(time.time() - start, 0.5)
+    self.assertEqual(2, self.reads)
+    self.assertNotEqual(version, json.loads(response.body)['version'])
+
+  def test_other_changes_are_seen_at_the_next_interval(self):
+    testing.patch(self, gce_appengine, 'LONG_POLL_INTERVAL', 0.3)
+    version = json.loads(self.poll().body)['version']
+    self.change_later(invalidate=False)
+    start = time.time()
+    response = self.poll(since=version, wait='5')
+    self.assertTrue(0.25 < time.time() - start < 1)
+    self.assertNotEqual(version, json.loads(response.body)['version'])
+
+  def test_waits_are_capped(self):
+    testing.patch(self, gce_appengine, 'LONG_POLL_TIMEOUT', 0.1)
+    version = json.loads(self.poll().body)['version']
+    start = time.time()
+    self.poll(since=version, wait='60')
+    self.assertLess(time.time() - start, 0.5)
+
+  def test_deltas_leave_out_unchanged_instances(self):
+    etag = self.poll().etag
+    response = self.poll(headers={'If-None-Match': '"%s"' % etag})
+    result = json.loads(response.body)
+    self.assertTrue(result['delta'])
+    self.assertEqual({}, result['instances'])
+    self.assertEqual([], result['removed'])
+    self.assertEqual({'demo-00': self.reads}, result['instanceRates'])
+
+  def test_deltas_hold_changed_instances(self):
+    etag = self.poll().etag
+    self.status = 'STOPPING'
+    response = self.poll(headers={'If-None-Match': '"%s"' % etag})
+    result = json.loads(response.body)
+    self.assertEqual(['demo-00'], result['instances'].keys())
+
+  def test_not_modified(self):
+    get_state = lambda: {'instances': {'demo-00': {'status': 'RUNNING'}}}
+    handler = testing.RequestHandler()
+    self.gce_appengine.poll_instance_state(handler, get_state)
+    handler = testing.RequestHandler(
+        headers={'If-None-Match': '"%s"' % handler.response.etag})
+    self.gce_appengine.poll_instance_state(handler, get_state)
+    self.assertEqual(304, handler.response.status_int)
+    self.assertEqual('', handler.response.body)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -23,8 +23,25 @@ class GcelibError(Exception):
 
 
 class GceError(Exception):
-  """GceError raised during improper use of the GceAppEngineHelper class."""
-  pass
+  """GceError raised during improper use of the GceAppEngineHelper class.
+
+  Attributes:
+    message: The string error message.
+    status: The integer HTTP status of the failed API call, if any.
+  """
+
+  def __init__(self, message='', status=None):
+    """Initializes the GceError class.
+
+    Args:
+      message: The string error message.
+      status: The integer HTTP status of the failed API call, if any.
+    """
+
+    super(GceError, self).__init__(message)
+    self.message = message
+    self.status = status
+
 
 class GceTokenError(Exception):
   """Error raised when there's an issue refreshing the access token."""
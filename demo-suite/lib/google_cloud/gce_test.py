@@ -0,0 +1,719 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the gce module."""
+
+import __builtin__
+import json
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+import testing
+import gce
+
+
+class DiscoveryTest(unittest.TestCase):
+  """Tests of the process-wide discovery document."""
+
+  def setUp(self):
+    testing.reset()
+    gce._discovery_docs.clear()
+
+  def test_concurrent_cold_builds_are_serialized(self):
+    testing.api.build_latency = 0.01
+    projects = []
+    threads = [threading.Thread(target=lambda: projects.append(
+        testing.project())) for _ in range(8)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+    self.assertEqual(8, len(projects))
+    self.assertEqual(8, testing.api.builds)
+    self.assertEqual(1, testing.api.max_concurrent_builds)
+    self.assertEqual([testing.API_VERSION], gce._discovery_docs.keys())
+
+  def test_warm_construction_is_faster(self):
+    def cold():
+      gce._discovery_docs.clear()
+      testing.project()
+
+    cold_seconds = testing.benchmark('GceProject cold', cold)
+    warm_seconds = testing.benchmark('GceProject warm', testing.project)
+    self.assertLess(warm_seconds, cold_seconds)
+
+
+class SettingsTest(unittest.TestCase):
+  """Tests of the process-wide settings."""
+
+  def setUp(self):
+    testing.reset()
+    self.directory = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.directory)
+    self.settings_file = os.path.join(self.directory, 'settings.json')
+    self.write_settings('first')
+    testing.patch(self, gce, 'SETTINGS_FILE', self.settings_file)
+    testing.patch(self, gce, '_settings', {'values': None, 'mtime': None})
+
+  def write_settings(self, project_id, mtime=1000):
+    settings = dict(testing.SETTINGS, project=project_id)
+    with open(self.settings_file, 'w') as settings_file:
+      settings_file.write(json.dumps(settings))
+    os.utime(self.settings_file, (mtime, mtime))
+
+  def count_file_io(self):
+    """Returns a list recording the files opened and stat'ed from now on."""
+
+    calls = []
+    def counted(name, function):
+      def call(*args):
+        calls.append(name)
+        return function(*args)
+      return call
+    testing.patch(self, __builtin__, 'open', counted('open', open))
+    for name in ('exists', 'getmtime'):
+      testing.patch(self, os.path, name, counted(name, getattr(os.path, name)))
+    return calls
+
+  def test_no_file_io_after_warm_up(self):
+    testing.project()
+    calls = self.count_file_io()
+    for _ in range(10):
+      testing.project()
+    self.assertEqual([], calls)
+
+  def test_overrides_do_not_change_shared_settings(self):
+    project = testing.project(project_id=None)
+    self.assertEqual('first', project.project_id)
+    self.assertEqual(testing.API_VERSION,
+                     project.settings['compute']['api_version'])
+    self.assertEqual(testing.SETTINGS['compute']['api_version'],
+                     gce._get_settings()['compute']['api_version'])
+
+  def test_reload_on_mtime_change(self):
+    self.assertEqual('first', gce._get_settings()['project'])
+    self.write_settings('second', mtime=2000)
+    self.assertEqual('first', gce._get_settings()['project'])
+
+    testing.patch(self, gce, 'RELOAD_SETTINGS', True)
+    self.assertEqual('second', gce._get_settings()['project'])
+    calls = self.count_file_io()
+    self.assertEqual('second', gce._get_settings()['project'])
+    self.assertEqual(['getmtime'], calls)
+
+
+class ListingTest(unittest.TestCase):
+  """Tests of paginated, streamed and fanned out listings."""
+
+  ZONES = ['us-central1-a', 'us-central1-b', 'europe-west1-a']
+
+  def setUp(self):
+    testing.reset()
+    self.project = testing.project()
+    testing.api.page_size = 2
+    for zone in self.ZONES:
+      for i in range(5):
+        testing.api.add_instance('%s-%d' % (zone, i), zone=zone)
+
+  def test_pages_are_fetched_lazily(self):
+    instances = self.project.iter_instances(zone_names=[self.ZONES[0]])
+    self.assertEqual('us-central1-a-0', next(instances).name)
+    self.assertEqual(1, testing.api.count('compute.instances.list'))
+
+    names = ['us-central1-a-0'] + [instance.name for instance in instances]
+    self.assertEqual(['us-central1-a-%d' % i for i in range(5)], names)
+    self.assertEqual(3, testing.api.count('compute.instances.list'))
+
+  def test_next_pages_keep_the_request_parameters(self):
+    instances = self.project.list_instances(
+        filter='name eq ^us-central1-a-[0-3]$', fields=['name', 'status'])
+    self.assertEqual(['us-central1-a-%d' % i for i in range(4)],
+                     [instance.name for instance in instances])
+    self.assertEqual(2, testing.api.count('compute.instances.list'))
+
+  def test_iter_instances_lists_every_zone(self):
+    instances = list(self.project.iter_instances(zone_names=self.ZONES))
+    self.assertEqual(
+        sorted('%s-%d' % (zone, i) for zone in self.ZONES for i in range(5)),
+        sorted(instance.name for instance in instances))
+    self.assertEqual(9, testing.api.count('compute.instances.list'))
+
+  def test_list_instances_all_zones(self):
+    instances = self.project.list_instances_all_zones(
+        fields=gce.INSTANCE_STATUS_FIELDS)
+    self.assertEqual(15, len(instances))
+    self.assertEqual(
+        set(self.ZONES), set(instance.zone_name for instance in instances))
+    self.assertEqual(8, testing.api.count('compute.instances.aggregatedList'))
+
+  def test_concurrent_zones_are_faster_than_serial(self):
+    testing.api.latency = 0.01
+
+    def serial():
+      for zone in self.ZONES:
+        self.project.list_instances(zone_name=zone)
+
+    def concurrent():
+      list(self.project.iter_instances(zone_names=self.ZONES))
+
+    serial_seconds = testing.benchmark(
+        'list 3 zones x 3 pages serially', serial, repeat=3)
+    concurrent_seconds = testing.benchmark(
+        'list 3 zones x 3 pages concurrently', concurrent, repeat=3)
+    self.assertLess(concurrent_seconds, serial_seconds)
+
+
+class BatchTest(unittest.TestCase):
+  """Tests of chunked, concurrent batch requests."""
+
+  def setUp(self):
+    testing.reset()
+    self.project = testing.project()
+    testing.patch(self, gce, 'MAX_BATCH_SIZE', 3)
+
+  def firewalls(self, count):
+    return [gce.Firewall(name='firewall-%d' % i) for i in range(count)]
+
+  def test_bulk_insert_is_chunked(self):
+    result = self.project.bulk_insert(self.firewalls(7))
+    self.assertEqual(3, testing.api.count('batch'))
+    self.assertEqual(['firewall-%d' % i for i in range(7)],
+                     testing.api.names('firewalls'))
+    self.assertEqual(['firewall-%d' % i for i in range(7)], result.succeeded)
+
+  def test_chunks_are_bounded_by_bytes(self):
+    testing.patch(self, gce, 'MAX_BATCH_BYTES', 300)
+    self.project.bulk_insert(self.firewalls(3))
+    self.assertEqual(3, testing.api.count('batch'))
+
+  def test_failed_requests_are_reported(self):
+    testing.api.add('firewalls', {'name': 'firewall-1'})
+    result = self.project.bulk_insert(self.firewalls(3))
+    self.assertEqual(['firewall-0', 'firewall-2'], result.succeeded)
+    self.assertEqual(['firewall-1'], result.failed)
+    self.assertEqual(409, result.errors['firewall-1'].resp.status)
+    self.assertEqual('ERROR', result.json['firewall-1']['status'])
+
+  def test_unanswered_requests_are_reported(self):
+    testing.api.batch_unanswered = 1
+    result = self.project.bulk_insert(self.firewalls(4))
+    self.assertEqual(['firewall-1', 'firewall-2'], result.succeeded)
+    self.assertEqual(['firewall-0', 'firewall-3'], result.failed)
+    self.assertIsInstance(result.errors['firewall-0'], gce.error.GceError)
+
+  def test_failed_batches_are_reported_for_every_request(self):
+    testing.api.batch_error = testing.BatchError(
+        'Response not in multipart/mixed format.',
+        resp=testing.HttpResponse(200, 'OK'))
+    requests = []
+    for firewall in self.firewalls(4):
+      firewall.gce_project = self.project
+      requests.append((firewall.name, self.project._insert_request(firewall)))
+    results = sorted(self.project._run_batches(requests))
+    self.assertEqual(['firewall-%d' % i for i in range(4)],
+                     [key for key, _, _ in results])
+    for _, response, exception in results:
+      self.assertIsNone(response)
+      self.assertEqual(200, exception.status)
+
+  def test_bulk_raises_when_every_request_fails(self):
+    testing.api.batch_error = testing.http_error(503, 'Unavailable')
+    self.project.retry_policy.max_retries = 0
+    self.assertRaises(gce.error.GceError,
+                      self.project.bulk_insert, self.firewalls(4))
+
+
+class CollectionTest(unittest.TestCase):
+  """Tests of the per-project cache of discovery collections."""
+
+  def setUp(self):
+    testing.reset()
+    testing.api.page_size = 1
+    for i in range(20):
+      testing.api.add_instance('instance-%02d' % i)
+    self.project = testing.project()
+
+  def test_collections_are_built_once(self):
+    instances = self.project.collection('instances')
+    self.assertIs(instances, self.project.collection('instances'))
+    self.project.list_instances()
+    self.assertEqual(20, testing.api.count('compute.instances.list'))
+    self.assertEqual(1, testing.api.count('collection:instances'))
+
+  def test_projects_do_not_share_collections(self):
+    other = testing.project(credentials=testing.Credentials('other'))
+    self.assertIsNot(self.project.collection('instances'),
+                     other.collection('instances'))
+    self.assertIsNot(self.project.service, other.service)
+
+  def test_list_with_and_without_the_cache(self):
+    def cached():
+      self.project.list_instances()
+
+    uncached_project = testing.project()
+    uncached_project.collection = lambda name: getattr(
+        uncached_project.service, name)()
+    def uncached():
+      uncached_project.list_instances()
+
+    testing.benchmark('list 20 pages with collection cache', cached)
+    builds = testing.api.count('collection:instances')
+    testing.benchmark('list 20 pages without collection cache', uncached)
+    self.assertEqual(1, builds)
+    self.assertEqual(
+        1 + 5 * 21, testing.api.count('collection:instances'))
+
+
+def deep_size(value, seen=None):
+  """Returns the bytes taken by an object and everything it references."""
+
+  if seen is None:
+    seen = set()
+  if id(value) in seen or isinstance(value, type):
+    return 0
+  seen.add(id(value))
+  size = sys.getsizeof(value)
+  if isinstance(value, dict):
+    size += sum(deep_size(k, seen) + deep_size(v, seen)
+                for k, v in value.items())
+  elif isinstance(value, (list, tuple, set)):
+    size += sum(deep_size(item, seen) for item in value)
+  if hasattr(value, '__dict__'):
+    size += deep_size(value.__dict__, seen)
+  for attribute in getattr(type(value), '__slots__', ()):
+    size += deep_size(getattr(value, attribute, None), seen)
+  return size
+
+
+class InstanceSummaryTest(unittest.TestCase):
+  """Tests of the compact representation of listed instances."""
+
+  def setUp(self):
+    testing.reset()
+    self.project = testing.project()
+    for i in range(50):
+      testing.api.add_instance(
+          'instance-%02d' % i,
+          tags={'items': ['fractal']},
+          networkInterfaces=[{'accessConfigs': [{'natIP': '10.0.0.%d' % i}]}],
+          metadata={'items': [
+              {'key': 'startup-script', 'value': 'x' * 20000},
+              {'key': 'goprog', 'value': 'y' * 50000}]})
+
+  def test_summary_keeps_only_what_is_reported(self):
+    instance = self.project.list_instances(summary=True)[3]
+    self.assertIsInstance(instance, gce.InstanceSummary)
+    self.assertFalse(hasattr(instance, '__dict__'))
+    self.assertEqual('instance-03', instance.name)
+    self.assertEqual('RUNNING', instance.status)
+    self.assertEqual(testing.ZONE, instance.zone.name)
+    self.assertEqual('n1-standard-1', instance.machine_type_name)
+    self.assertEqual(['fractal'], instance.tags)
+    self.assertEqual('10.0.0.3', instance.external_ip)
+    self.assertEqual(['startup-script', 'goprog'], instance.metadata_keys)
+
+  def test_summary_pickles_without_its_project(self):
+    instance = self.project.list_instances(summary=True)[0]
+    instance.gce_project = self.project
+    copy = pickle.loads(pickle.dumps(instance))
+    self.assertEqual('instance-00', copy.name)
+    self.assertIsNone(copy.gce_project)
+
+  def test_summaries_use_less_memory(self):
+    instances = self.project.list_instances()
+    summaries = self.project.list_instances(summary=True)
+    instances_size = deep_size(instances)
+    summaries_size = deep_size(summaries)
+    sys.stderr.write('\nbenchmark memory of 50 listed instances: '
+                     '%d KB as Instance, %d KB as InstanceSummary\n' % (
+                         instances_size / 1024, summaries_size / 1024))
+    self.assertLess(summaries_size * 10, instances_size)
+
+
+class ReconcileTest(unittest.TestCase):
+  """Tests of reconciling instances with a target set of names."""
+
+  def setUp(self):
+    testing.reset()
+    self.project = testing.project()
+    self.built = []
+
+  def names(self, count):
+    return ['demo-%02d' % i for i in range(count)]
+
+  def build(self, names):
+    self.built.append(names)
+    # As big as the fractal demo's, with its startup script and program.
+    metadata = [{'key': 'startup-script', 'value': 'x' * 20000},
+                {'key': 'goprog', 'value': 'y' * 50000}]
+    prototype = gce.Instance(
+        zone_name=testing.ZONE,
+        disk_mounts=[gce.DiskMount(boot=True, auto_delete=True)],
+        metadata=metadata)
+    template = gce.InstanceTemplate(
+        self.project, prototype, disk_name_format='boot-%s')
+    return template.instances(names)
+
+  def reconcile(self, count):
+    current = self.project.list_instances_all_zones(
+        fields=gce.INSTANCE_STATUS_FIELDS)
+    return self.project.reconcile_instances(
+        self.names(count), current, self.build)
+
+  def add_instances(self, count):
+    for name in self.names(count):
+      testing.api.add_instance(name)
+
+  def test_scaling_up_inserts_only_the_missing_instances(self):
+    self.add_instances(3)
+    result = self.reconcile(5)
+    self.assertEqual([['demo-03', 'demo-04']], self.built)
+    self.assertEqual(['demo-03', 'demo-04'], sorted(result.succeeded))
+    self.assertEqual(self.names(5), testing.api.names('instances'))
+
+  def test_scaling_down_deletes_only_the_extras(self):
+    self.add_instances(5)
+    result = self.reconcile(3)
+    self.assertEqual([], self.built)
+    self.assertEqual(['demo-03', 'demo-04'], sorted(result.succeeded))
+    self.assertEqual(self.names(3), testing.api.names('instances'))
+
+  def test_reconciled_instances_are_left_alone(self):
+    self.add_instances(3)
+    self.assertIsNone(self.reconcile(3))
+    self.assertEqual([], self.built)
+    self.assertEqual(0, testing.api.count('batch'))
+
+  def test_benchmark_scale_by_one(self):
+    self.add_instances(64)
+
+    def incremental():
+      self.reconcile(65)
+      testing.api.remove('instances', 'demo-64')
+
+    def full():
+      # Building every target instance before diffing, as set_instances did.
+      current = set(instance.name for instance in
+                    self.project.list_instances_all_zones(
+                        fields=gce.INSTANCE_STATUS_FIELDS))
+      self.project.bulk_insert([instance for instance in
+                                self.build(self.names(65))
+                                if instance.name not in current])
+      testing.api.remove('instances', 'demo-64')
+
+    testing.benchmark('scale 64 to 65 instances, incremental', incremental)
+    self.assertEqual([['demo-64']] * 5, self.built)
+    self.assertEqual(5, testing.api.count('batch'))
+    testing.benchmark('scale 64 to 65 instances, building all', full)
+
+
+class EnsureTest(unittest.TestCase):
+  """Tests of inserting resources unless they exist, and of the cache."""
+
+  def setUp(self):
+    testing.reset()
+    self.project = testing.project()
+
+  def firewall(self):
+    return gce.Firewall(name='demo-firewall')
+
+  def test_missing_resources_are_inserted(self):
+    self.assertTrue(self.project.ensure_firewall(self.firewall()))
+    self.assertEqual(['demo-firewall'], testing.api.names('firewalls'))
+    self.assertEqual(1, testing.api.count('compute.firewalls.get'))
+    self.assertEqual(1, testing.api.count('compute.firewalls.insert'))
+
+  def test_existing_resources_are_left_alone(self):
+    testing.api.add('firewalls', {'name': 'demo-firewall'})
+    self.assertFalse(self.project.ensure_firewall(self.firewall()))
+    self.assertEqual(0, testing.api.count('compute.firewalls.insert'))
+
+  def test_existence_is_cached(self):
+    self.project.ensure_firewall(self.firewall())
+    calls = len(testing.api.calls)
+    self.assertFalse(self.project.ensure_firewall(self.firewall()))
+    self.assertFalse(testing.project().ensure_firewall(self.firewall()))
+    self.assertEqual(calls, len(testing.api.calls))
+
+  def test_concurrent_inserts_count_as_success(self):
+    insert = self.project.insert
+
+    def racing_insert(resource):
+      testing.api.add('firewalls', {'name': resource.name})
+      return insert(resource)
+
+    self.project.insert = racing_insert
+    self.assertFalse(self.project.ensure_firewall(self.firewall()))
+    self.assertEqual(1, testing.api.count('compute.firewalls.insert'))
+    self.assertFalse(testing.project().ensure_firewall(self.firewall()))
+    self.assertEqual(1, testing.api.count('compute.firewalls.get'))
+
+  def test_deleting_invalidates_the_cache(self):
+    self.project.ensure_firewall(self.firewall())
+    self.project.bulk_delete([self.firewall()])
+    self.assertEqual([], testing.api.names('firewalls'))
+    self.assertTrue(self.project.ensure_firewall(self.firewall()))
+    self.assertEqual(2, testing.api.count('compute.firewalls.get'))
+
+  def test_missing_images_are_cached(self):
+    self.assertIsNone(self.project.resolve_image('demo-image'))
+    self.assertIsNone(self.project.resolve_image('demo-image'))
+    self.assertEqual(1, testing.api.count('compute.images.get'))
+
+  def test_images_are_resolved_and_cached(self):
+    testing.api.add('images', {'name': 'demo-image'})
+    image = self.project.resolve_image('demo-image')
+    self.assertEqual('demo-image', image.name)
+    self.assertEqual('demo-image', self.project.resolve_image(
+        'demo-image').name)
+    self.assertEqual(1, testing.api.count('compute.images.get'))
+
+
+class SetCommonMetadataTest(unittest.TestCase):
+  """Tests of setting the project's common instance metadata."""
+
+  def setUp(self):
+    testing.reset()
+    testing.api.add_project(testing.PROJECT, {
+        'sshKeys': 'keys',
+        'goprog-old': 'old program',
+    })
+    self.project = testing.project()
+
+  def test_entries_are_added_to_the_others(self):
+    self.assertTrue(self.project.set_common_metadata(
+        [{'key': 'goprog-new', 'value': 'new program'}]))
+    self.assertEqual({
+        'sshKeys': 'keys',
+        'goprog-old': 'old program',
+        'goprog-new': 'new program',
+    }, testing.api.metadata())
+
+  def test_entries_with_the_prefix_are_replaced(self):
+    self.project.set_common_metadata(
+        [{'key': 'goprog-new', 'value': 'new program'}],
+        replace_prefix='goprog-')
+    self.assertEqual({
+        'sshKeys': 'keys',
+        'goprog-new': 'new program',
+    }, testing.api.metadata())
+
+  def test_up_to_date_metadata_is_not_sent(self):
+    self.assertEqual(None, self.project.set_common_metadata(
+        [{'key': 'goprog-old', 'value': 'old program'}],
+        replace_prefix='goprog-'))
+    self.assertEqual(1, testing.api.count('compute.projects.get'))
+    self.assertEqual(
+        0, testing.api.count('compute.projects.setCommonInstanceMetadata'))
+
+  def test_the_fingerprint_is_sent_back(self):
+    self.project.set_common_metadata([{'key': 'a', 'value': '1'}])
+    # A stale fingerprint would be refused.
+    self.project.set_common_metadata([{'key': 'b', 'value': '2'}])
+    self.assertEqual('2', testing.api.metadata()['b'])
+    self.assertEqual(
+        2, testing.api.count('compute.projects.setCommonInstanceMetadata'))
+
+
+class WaitForOperationsTest(unittest.TestCase):
+  """Tests of polling operations until they are done."""
+
+  def setUp(self):
+    testing.reset()
+    self.project = testing.project()
+    testing.patch(self, gce, 'OPERATION_POLL_INTERVAL', 0.001)
+    self.done = []
+
+  def operation(self, name, status='RUNNING', zone=testing.ZONE):
+    operation = {'name': name, 'status': status}
+    if zone:
+      operation['zone'] = 'zones/%s' % zone
+      testing.api.add('zoneOperations', operation)
+    else:
+      testing.api.add('globalOperations', operation)
+    return dict(operation)
+
+  def finish(self, name, **fields):
+    """Completes an operation after its first poll."""
+
+    operation = testing.api.get('zoneOperations', name) or testing.api.get(
+        'globalOperations', name)
+    operation.update(fields, status='DONE')
+
+  def test_done_operations_are_not_polled(self):
+    result = self.project.wait_for_operations(
+        [self.operation('op-1', status='DONE')], callback=self.done.append)
+    self.assertEqual('DONE', result['op-1']['status'])
+    self.assertEqual(['op-1'], [op['name'] for op in self.done])
+    self.assertEqual(0, testing.api.count('batch'))
+
+  def test_zone_and_global_operations_are_polled_in_one_batch(self):
+    operations = [self.operation('op-1'), self.operation('op-2', zone=None)]
+    self.finish('op-1')
+    self.finish('op-2')
+    result = self.project.wait_for_operations(
+        operations, callback=self.done.append)
+    self.assertEqual(['DONE', 'DONE'],
+                     [result[name]['status'] for name in ('op-1', 'op-2')])
+    self.assertEqual(['op-1', 'op-2'],
+                     sorted(op['name'] for op in self.done))
+    self.assertEqual(1, testing.api.count('batch'))
+
+  def test_failed_operations_report_their_error(self):
+    operation = self.operation('op-1')
+    self.finish('op-1', error={'errors': [{'code': 'QUOTA_EXCEEDED'}]})
+    result = self.project.wait_for_operations([operation])
+    self.assertEqual('QUOTA_EXCEEDED',
+                     result['op-1']['error']['errors'][0]['code'])
+
+  def test_poll_errors_fail_the_operation(self):
+    operation = self.operation('op-1')
+    testing.api.remove('zoneOperations', 'op-1')
+    result = self.project.wait_for_operations(
+        [operation], timeout=5, callback=self.done.append)
+    self.assertEqual('DONE', result['op-1']['status'])
+    self.assertEqual('POLL_FAILED',
+                     result['op-1']['error']['errors'][0]['code'])
+    self.assertEqual(1, len(self.done))
+    self.assertEqual(1, testing.api.count('batch'))
+
+  def test_timeout(self):
+    operation = self.operation('op-1')
+    start = time.time()
+    result = self.project.wait_for_operations([operation], timeout=0.05)
+    self.assertLess(time.time() - start, 1)
+    self.assertEqual('RUNNING', result['op-1']['status'])
+    self.assertEqual([], self.done)
+
+  def test_default_timeout_is_within_the_request_deadline(self):
+    self.assertLess(gce.OPERATION_TIMEOUT, 60)
+
+
+class RetryTest(unittest.TestCase):
+  """Tests of the retry policy and the retries of API requests."""
+
+  def setUp(self):
+    testing.reset()
+    self.project = testing.project()
+    self.policy = self.project.retry_policy
+    self.delays = []
+    testing.patch(self, gce.time, 'sleep', self.delays.append)
+    # The full delay, without jitter.
+    testing.patch(self, gce.random, 'uniform', lambda low, high: high)
+
+  def get_firewall(self):
+    return self.project._run_request(self.project.collection(
+        'firewalls').get(project=testing.PROJECT, firewall='demo'))
+
+  def insert_firewall(self):
+    return self.project.insert(gce.Firewall(name='demo'))
+
+  def test_delays_grow_exponentially_up_to_the_maximum(self):
+    for attempt in range(7):
+      self.policy.wait(attempt)
+    self.assertEqual([0.5, 1, 2, 4, 8, 16, 16], self.delays)
+    self.assertEqual(7, self.policy.retries)
+
+  def test_retry_after_is_honored(self):
+    exception = testing.http_error(503, 'Unavailable')
+    exception.resp['retry-after'] = '3'
+    self.policy.wait(0, exception)
+    exception.resp['retry-after'] = '60'
+    self.policy.wait(0, exception)
+    self.assertEqual([3, 16], self.delays)
+
+  def test_idempotent_requests_are_retried(self):
+    testing.api.add('firewalls', {'name': 'demo'})
+    testing.api.fail('compute.firewalls.get',
+                     testing.http_error(503, 'Unavailable'),
+                     testing.HttpLib2Error('reset'))
+    self.assertEqual('demo', self.get_firewall()['name'])
+    self.assertEqual(3, testing.api.count('compute.firewalls.get'))
+    self.assertEqual(2, self.policy.retries)
+
+  def test_other_requests_are_not_retried(self):
+    testing.api.fail('compute.firewalls.insert',
+                     testing.http_error(503, 'Unavailable'))
+    self.assertRaises(gce.error.GceError, self.insert_firewall)
+    self.assertEqual(1, testing.api.count('compute.firewalls.insert'))
+    self.assertEqual(0, self.policy.retries)
+
+  def test_rate_limited_requests_are_always_retried(self):
+    testing.api.fail('compute.firewalls.insert',
+                     testing.http_error(429, 'Too Many Requests'))
+    self.insert_firewall()
+    self.assertEqual(['demo'], testing.api.names('firewalls'))
+    self.assertEqual(1, self.policy.retries)
+
+  def test_client_errors_are_not_retried(self):
+    self.assertRaises(gce.error.GceError, self.get_firewall)
+    self.assertEqual(1, testing.api.count('compute.firewalls.get'))
+
+  def test_retries_per_request_are_limited(self):
+    testing.api.fail('compute.firewalls.get',
+                     *[testing.http_error(503, 'Unavailable')] * 5)
+    self.assertRaises(gce.error.GceError, self.get_firewall)
+    self.assertEqual(4, testing.api.count('compute.firewalls.get'))
+    self.assertEqual(3, self.policy.retries)
+    self.assertEqual(1, self.policy.gave_up)
+
+  def test_retry_budget_is_shared(self):
+    self.policy.budget = 2
+    testing.api.add('firewalls', {'name': 'demo'})
+    testing.api.fail('compute.firewalls.get',
+                     *[testing.http_error(503, 'Unavailable')] * 3)
+    self.assertRaises(gce.error.GceError, self.get_firewall)
+    self.assertEqual('demo', self.get_firewall()['name'])
+    self.assertEqual(2, self.policy.retries)
+    self.assertEqual(1, self.policy.gave_up)
+
+  def test_failed_requests_of_a_batch_are_retried(self):
+    testing.api.add_instance('demo-00')
+    testing.api.fail('compute.instances.delete',
+                     testing.http_error(503, 'Unavailable'))
+    instances = self.project.list_instances()
+    result = self.project.bulk_delete(instances)
+    self.assertEqual(['demo-00'], result.succeeded)
+    self.assertEqual(2, testing.api.count('batch'))
+
+  def test_failed_batches_of_idempotent_requests_are_retried(self):
+    testing.api.add_instance('demo-00')
+    testing.api.add_instance('demo-01')
+    testing.api.fail('batch', testing.http_error(503, 'Unavailable'))
+    result = self.project.bulk_delete(self.project.list_instances())
+    self.assertEqual(['demo-00', 'demo-01'], sorted(result.succeeded))
+    self.assertEqual(2, testing.api.count('batch'))
+    self.assertEqual(1, self.policy.retries)
+
+  def test_failed_batches_only_retry_idempotent_requests(self):
+    testing.api.add_instance('demo-00')
+    testing.api.fail('batch', testing.http_error(503, 'Unavailable'))
+    result = self.project.bulk_apply(
+        inserts=[gce.Firewall(name='demo')],
+        deletes=self.project.list_instances())
+    self.assertEqual(['demo-00'], result.succeeded)
+    self.assertEqual(['demo'], result.failed)
+    self.assertEqual(503, result.errors['demo'].status)
+    self.assertEqual([], testing.api.names('firewalls'))
+
+
+if __name__ == '__main__':
+  unittest.main()
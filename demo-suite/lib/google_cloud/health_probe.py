@@ -0,0 +1,286 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Concurrent HTTP health probes of demo servers."""
+
+import json
+import logging
+import time
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+from google.appengine.api import urlfetch
+
+# Seconds all probes of a run have to complete.
+DEADLINE = 1
+NAMESPACE = 'gce-health-probes'
+# Seconds a cached result is fresh. Stale results are still served, and
+# refreshed in the background.
+FRESHNESS = 5
+# Seconds after which a cached result is too old to serve, and the probe
+# is run again before answering.
+MAX_AGE = 60
+
+
+class Probe(object):
+  """An HTTP health check of one server.
+
+  The server is healthy if it answers its path with a 200. Subclasses can
+  probe another path, or override check to look at the content.
+  """
+
+  path = '/'
+
+  def __init__(self, key, host, project_id=None):
+    """Initializes the Probe class.
+
+    Args:
+      key: A hashable key identifying the probe to the caller, such as an
+          instance name.
+      host: The string host, with an optional port, to probe.
+      project_id: The string id of the project the host belongs to. IPs
+          are reused across projects, so cached results are kept apart by
+          project.
+    """
+
+    self.key = key
+    self.host = host
+    self.project_id = project_id
+
+  @property
+  def url(self):
+    """Returns the URL to fetch. The timestamp defeats caching proxies."""
+
+    return 'http://%s%s?t=%d' % (self.host, self.path, int(time.time()))
+
+  def check(self, response):
+    """Checks a response from the server.
+
+    Args:
+      response: The urlfetch response object.
+
+    Returns:
+      A (healthy, value) tuple. value is any data parsed from the response,
+      None here.
+    """
+
+    return response.status_code == 200, None
+
+
+class VarsProbe(Probe):
+  """Fetches the exported variables of a Go server from /debug/vars."""
+
+  path = '/debug/vars'
+
+  def check(self, response):
+    """A server is healthy if it exports memstats. The value is the vars."""
+
+    if 'memstats' not in response.content:
+      return False, None
+    try:
+      return True, json.loads(response.content)
+    except ValueError, e:
+      logging.error('Error decoding vars json for %s: %s', self.key, e)
+      return True, None
+
+
+class HealthProbe(Probe):
+  """Fetches /health, which answers ok when the server is serving."""
+
+  path = '/health'
+
+  def check(self, response):
+    """A server is healthy if it answers ok. There is no value."""
+
+    return 'ok' in response.content, None
+
+
+class ProbeResult(object):
+  """The outcome of a probe, and when it was collected."""
+
+  def __init__(self, probe, healthy, value=None, error=None, latency=None,
+               status_code=None):
+    """Initializes the ProbeResult class.
+
+    Args:
+      probe: The Probe object.
+      healthy: True if the server passed the check.
+      value: Any data parsed from the response.
+      error: The fetch error, if the fetch failed.
+      latency: Seconds from sending the probe until its result was collected.
+      status_code: The HTTP status code, if the fetch succeeded.
+    """
+
+    self.probe = probe
+    self.healthy = healthy
+    self.value = value
+    self.error = error
+    self.latency = latency
+    self.status_code = status_code
+    self.timestamp = time.time()
+
+
+class HealthProber(object):
+  """Runs probes concurrently, under a deadline shared by all of them.
+
+  Outside App Engine, subclasses can replace urlfetch by overriding _start,
+  _wait_any and _get_result.
+  """
+
+  def __init__(self, deadline=DEADLINE):
+    """Initializes the HealthProber class.
+
+    Args:
+      deadline: The number of seconds all probes have to complete.
+    """
+
+    self.deadline = deadline
+
+  def run(self, probes):
+    """Sends all probes and yields their results as they complete.
+
+    Args:
+      probes: A list of Probe objects.
+
+    Yields:
+      A ProbeResult object for each probe, in order of completion. Probes
+      that miss the deadline fail with a fetch error.
+    """
+
+    start = time.time()
+    pending = {}
+    for probe in probes:
+      logging.debug('Health checking %s', probe.url)
+      pending[self._start(probe)] = probe
+
+    while pending:
+      rpc = self._wait_any(pending.keys())
+      probe = pending.pop(rpc)
+      try:
+        response = self._get_result(rpc)
+      except urlfetch.Error, e:
+        yield ProbeResult(probe, False, error=e, latency=time.time() - start)
+        continue
+      healthy, value = probe.check(response)
+      yield ProbeResult(probe, healthy, value=value,
+                        latency=time.time() - start,
+                        status_code=response.status_code)
+
+  def _start(self, probe):
+    """Starts fetching a probe's URL and returns the RPC."""
+
+    rpc = urlfetch.create_rpc(deadline=self.deadline)
+    urlfetch.make_fetch_call(rpc, url=probe.url)
+    return rpc
+
+  def _wait_any(self, rpcs):
+    """Waits for one of the RPCs to complete and returns it."""
+
+    return apiproxy_stub_map.UserRPC.wait_any(rpcs)
+
+  def _get_result(self, rpc):
+    """Returns the response of a completed RPC."""
+
+    return rpc.get_result()
+
+
+class ProbeCache(object):
+  """Caches probe results in memcache, shared by all requests.
+
+  Each result is stored under its probe's project, path and host. Fresh
+  results are served as is. Stale results are served too, and handed to the
+  refresh callable, at most once per freshness window, to be probed again in
+  the background. Missing and expired results are probed before returning.
+  """
+
+  def __init__(self, prober=None, refresh=None, freshness=FRESHNESS,
+               max_age=MAX_AGE):
+    """Initializes the ProbeCache class.
+
+    Args:
+      prober: The HealthProber running the probes. Defaults to a
+          HealthProber with the default deadline.
+      refresh: A callable taking a list of stale probes, which should
+          arrange for them to be passed to update, for example from a
+          task. Defaults to updating them right away.
+      freshness: The number of seconds a result is fresh.
+      max_age: The number of seconds a result may be served.
+    """
+
+    self.prober = prober or HealthProber()
+    self.refresh = refresh or self.update
+    self.freshness = freshness
+    self.max_age = max_age
+
+  def get_results(self, probes):
+    """Returns the latest result of each probe.
+
+    Args:
+      probes: A list of Probe objects.
+
+    Returns:
+      A list of ProbeResult objects, one per probe, in no particular order.
+    """
+
+    keys = dict((self._key(probe), probe) for probe in probes)
+    cached = memcache.get_multi(keys.keys(), namespace=NAMESPACE)
+
+    now = time.time()
+    results = []
+    stale = {}
+    missing = []
+    for key, probe in keys.iteritems():
+      timestamp, result = cached.get(key, (0, None))
+      age = now - timestamp
+      if result is None or age > self.max_age:
+        missing.append(probe)
+        continue
+      if age > self.freshness:
+        stale['refresh:' + key] = probe
+      result.probe = probe
+      results.append(result)
+
+    if stale:
+      # Only one request per freshness window refreshes a result.
+      taken = memcache.add_multi(
+          dict.fromkeys(stale, 1), time=self.freshness, namespace=NAMESPACE)
+      refresh = [probe for key, probe in stale.iteritems() if key not in taken]
+      if refresh:
+        self.refresh(refresh)
+
+    if missing:
+      results.extend(self.update(missing))
+    return results
+
+  def update(self, probes):
+    """Runs probes and caches their results.
+
+    Args:
+      probes: A list of Probe objects.
+
+    Returns:
+      A list of ProbeResult objects, in order of completion.
+    """
+
+    results = list(self.prober.run(probes))
+    now = time.time()
+    memcache.set_multi(
+        dict((self._key(result.probe), (now, result)) for result in results),
+        time=self.max_age, namespace=NAMESPACE)
+    return results
+
+  def _key(self, probe):
+    """Returns the memcache key of a probe's result."""
+
+    return '%s:%s:%s' % (probe.project_id, probe.path, probe.host)
@@ -0,0 +1,168 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the health_probe module, against local stand-in servers."""
+
+import json
+import time
+import unittest
+
+import testing
+from google.appengine.api import urlfetch
+import health_probe
+
+VARS = json.dumps({'memstats': {'Alloc': 1}, 'tiles': 10})
+
+
+class HealthProberTest(unittest.TestCase):
+  """Tests of running probes concurrently under a deadline."""
+
+  def setUp(self):
+    testing.reset()
+    self.prober = health_probe.HealthProber(deadline=0.5)
+
+  def serve(self, pages, delay=0):
+    server = testing.StandInServer(pages, delay)
+    self.addCleanup(server.stop)
+    return server.host
+
+  def run_probes(self, probes):
+    return dict((result.probe.key, result)
+                for result in self.prober.run(probes))
+
+  def test_probe_types(self):
+    host = self.serve({
+        '/debug/vars': (200, VARS),
+        '/health': (200, 'ok'),
+    })
+    results = self.run_probes([
+        health_probe.VarsProbe('vars', host),
+        health_probe.HealthProbe('health', host),
+    ])
+    self.assertTrue(results['vars'].healthy)
+    self.assertEqual(json.loads(VARS), results['vars'].value)
+    self.assertTrue(results['health'].healthy)
+    self.assertEqual(None, results['health'].value)
+    self.assertEqual(200, results['health'].status_code)
+
+  def test_plain_probe(self):
+    up = self.serve({'/': (200, '<html></html>')})
+    down = self.serve({'/': (500, 'error')})
+    results = self.run_probes([
+        health_probe.Probe('up', up),
+        health_probe.Probe('down', down),
+    ])
+    self.assertTrue(results['up'].healthy)
+    self.assertEqual(None, results['up'].value)
+    self.assertFalse(results['down'].healthy)
+    self.assertEqual(500, results['down'].status_code)
+
+  def test_unhealthy_servers(self):
+    host = self.serve({
+        '/debug/vars': (200, '{}'),
+        '/health': (503, 'starting'),
+    })
+    results = self.run_probes([
+        health_probe.VarsProbe('vars', host),
+        health_probe.HealthProbe('health', host),
+        health_probe.HealthProbe('down', '127.0.0.1:1'),
+    ])
+    self.assertFalse(results['vars'].healthy)
+    self.assertFalse(results['health'].healthy)
+    self.assertEqual(503, results['health'].status_code)
+    self.assertFalse(results['down'].healthy)
+    self.assertTrue(isinstance(results['down'].error, urlfetch.Error))
+
+  def test_results_in_order_of_completion(self):
+    fast = self.serve({'/health': (200, 'ok')})
+    slow = self.serve({'/health': (200, 'ok')}, delay=0.2)
+    results = list(self.prober.run([
+        health_probe.HealthProbe('slow', slow),
+        health_probe.HealthProbe('fast', fast),
+    ]))
+    self.assertEqual(['fast', 'slow'],
+                     [result.probe.key for result in results])
+    self.assertTrue(results[0].latency < 0.2 <= results[1].latency)
+
+  def test_probes_run_concurrently(self):
+    hosts = [self.serve({'/health': (200, 'ok')}, delay=0.1)
+             for _ in range(5)]
+    start = time.time()
+    results = self.run_probes(
+        [health_probe.HealthProbe(host, host) for host in hosts])
+    self.assertTrue(time.time() - start < 0.3)
+    self.assertEqual([True] * 5, [r.healthy for r in results.values()])
+
+  def test_deadline(self):
+    host = self.serve({'/health': (200, 'ok')}, delay=1)
+    start = time.time()
+    results = self.run_probes([health_probe.HealthProbe('slow', host)])
+    self.assertTrue(time.time() - start < 0.9)
+    self.assertFalse(results['slow'].healthy)
+    self.assertTrue(isinstance(results['slow'].error, urlfetch.Error))
+
+
+class CountingProber(health_probe.HealthProber):
+  """A prober of local stand-in servers that records the probes it runs."""
+
+  def __init__(self):
+    health_probe.HealthProber.__init__(self, deadline=0.5)
+    self.probed = []
+
+  def run(self, probes):
+    self.probed.extend((probe.project_id, probe.host) for probe in probes)
+    return health_probe.HealthProber.run(self, probes)
+
+
+class ProbeCacheTest(unittest.TestCase):
+  """Tests of the cached probe results."""
+
+  def setUp(self):
+    testing.reset()
+    server = testing.StandInServer({'/health': (200, 'ok')})
+    self.addCleanup(server.stop)
+    self.host = server.host
+    self.prober = CountingProber()
+    self.refreshed = []
+    self.cache = health_probe.ProbeCache(
+        prober=self.prober, refresh=self.refreshed.extend, freshness=0.1)
+
+  def get_results(self, project_id='project-a'):
+    return self.cache.get_results(
+        [health_probe.HealthProbe('lb', self.host, project_id)])
+
+  def test_results_are_cached(self):
+    self.assertTrue(self.get_results()[0].healthy)
+    self.assertTrue(self.get_results()[0].healthy)
+    self.assertEqual([('project-a', self.host)], self.prober.probed)
+
+  def test_results_are_kept_apart_by_project(self):
+    self.get_results('project-a')
+    self.get_results('project-b')
+    self.assertEqual([('project-a', self.host), ('project-b', self.host)],
+                     self.prober.probed)
+
+  def test_stale_results_are_served_and_refreshed_once(self):
+    self.get_results()
+    time.sleep(0.15)
+    self.assertTrue(self.get_results()[0].healthy)
+    self.get_results()
+    self.assertEqual(1, len(self.prober.probed))
+    self.assertEqual([('project-a', self.host)],
+                     [(probe.project_id, probe.host)
+                      for probe in self.refreshed])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,195 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Short-lived cache of instance listings shared by polling requests.
+
+Every open demo page polls its instance status every couple of seconds.
+Listings are cached per project, user and query in memcache, with an
+in-process LRU in front of it, so all of a user's pollers of a project
+share one API call per TTL. Listings are never shared between users, as
+each user's credentials may not grant access to the project. Inserting or
+deleting instances invalidates the project's listings.
+"""
+
+import collections
+import hashlib
+import threading
+import time
+
+from google.appengine.api import memcache
+
+import single_flight
+
+NAMESPACE = 'gce-instance-cache'
+# Seconds a listing is served from the cache. Matches the client heartbeat.
+TTL = 2
+# Maximum number of listings kept in the in-process cache.
+LOCAL_CACHE_SIZE = 128
+
+
+class LocalCache(object):
+  """A thread-safe, in-process LRU cache with expiring entries."""
+
+  def __init__(self, size=LOCAL_CACHE_SIZE):
+    """Initializes the LocalCache class.
+
+    Args:
+      size: The maximum number of entries.
+    """
+
+    self.size = size
+    self._entries = collections.OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, key):
+    """Returns the unexpired value for key, or None."""
+
+    with self._lock:
+      entry = self._entries.pop(key, None)
+      if entry is None or entry[0] < time.time():
+        return None
+      self._entries[key] = entry
+      return entry[1]
+
+  def set(self, key, value, ttl):
+    """Store value for key for ttl seconds."""
+
+    with self._lock:
+      self._entries.pop(key, None)
+      self._entries[key] = (time.time() + ttl, value)
+      while len(self._entries) > self.size:
+        self._entries.popitem(last=False)
+
+
+class InstanceCache(object):
+  """Caches values per project, invalidated as a whole per project.
+
+  Each project has a generation number in memcache that is part of every
+  cache key, so invalidating a project only takes one increment. Cached
+  values are shared between requests and must not be modified.
+  """
+
+  def __init__(self, ttl=TTL, local_size=LOCAL_CACHE_SIZE):
+    """Initializes the InstanceCache class.
+
+    Args:
+      ttl: The number of seconds values are cached.
+      local_size: The maximum number of values in the in-process cache.
+    """
+
+    self.ttl = ttl
+    self._local = LocalCache(local_size)
+    self._single_flight = single_flight.SingleFlight()
+
+  def get(self, project_id, key, loader):
+    """Returns the cached value for the project and key, loading it if needed.
+
+    Concurrent misses for the same key in this process share one call to
+    loader.
+
+    Args:
+      project_id: The string name of the Compute Engine project.
+      key: A string identifying the value within the project.
+      loader: A callable returning the value. Exceptions are not cached.
+
+    Returns:
+      The cached or loaded value.
+    """
+
+    cache_key = '%s:%s:%s' % (
+        project_id, self.generation(project_id), hashlib.sha1(key).hexdigest())
+
+    value = self._local.get(cache_key)
+    if value is None:
+      value = memcache.get(cache_key, namespace=NAMESPACE)
+      if value is None:
+        value = self._single_flight.do(cache_key, self._load, cache_key, loader)
+      self._local.set(cache_key, value, self.ttl)
+    return value
+
+  def generation(self, project_id):
+    """Returns the project's generation number, bumped by invalidate."""
+
+    return memcache.get(
+        self._generation_key(project_id), namespace=NAMESPACE) or 0
+
+  def invalidate(self, project_id):
+    """Drop every cached value of the project.
+
+    Args:
+      project_id: The string name of the Compute Engine project.
+    """
+
+    memcache.incr(self._generation_key(project_id), initial_value=0,
+                  namespace=NAMESPACE)
+
+  def _load(self, cache_key, loader):
+    """Load a value and store it in memcache."""
+
+    value = loader()
+    memcache.set(cache_key, value, time=self.ttl, namespace=NAMESPACE)
+    return value
+
+  def _generation_key(self, project_id):
+    """Returns the memcache key of the project's generation number."""
+
+    return 'generation:%s' % project_id
+
+
+_cache = InstanceCache()
+
+
+def list_instances(gce_project, user_id, **args):
+  """Lists instances in all zones of the project through the shared cache.
+
+  Listings are shared by the calls for the same user.
+
+  Args:
+    gce_project: A gce.GceProject object, with the user's credentials.
+    user_id: The string id of the user.
+    args: Arguments for GceProject.list_instances_all_zones, such as fields
+        and filter.
+
+  Returns:
+    A list of gce.InstanceSummary or gce.Instance objects, which must not be
+    modified.
+
+  Raises:
+    GceError: Raised when API call fails.
+    GceTokenError: Raised when the access token fails to refresh.
+  """
+
+  key = repr((user_id, sorted(args.items())))
+  return _cache.get(gce_project.project_id, key,
+                    lambda: gce_project.list_instances_all_zones(**args))
+
+
+def generation(project_id):
+  """Returns a number that changes whenever the project is invalidated.
+
+  Args:
+    project_id: The string name of the Compute Engine project.
+  """
+
+  return _cache.generation(project_id)
+
+
+def invalidate(project_id):
+  """Drop every cached listing of the project.
+
+  Args:
+    project_id: The string name of the Compute Engine project.
+  """
+
+  _cache.invalidate(project_id)
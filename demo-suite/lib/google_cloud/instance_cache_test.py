@@ -0,0 +1,74 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the instance_cache module."""
+
+import threading
+import unittest
+
+import testing
+import gce
+import instance_cache
+
+
+class ListInstancesTest(unittest.TestCase):
+  """Tests of the cached instance listings."""
+
+  def setUp(self):
+    testing.reset()
+    testing.patch(
+        self, instance_cache, '_cache', instance_cache.InstanceCache())
+    testing.api.add_instance('demo-00')
+    self.project = testing.project()
+
+  def list_names(self, user_id='alice', project=None):
+    instances = instance_cache.list_instances(
+        project or self.project, user_id, fields=gce.INSTANCE_STATUS_FIELDS)
+    return [instance.name for instance in instances]
+
+  def test_listings_are_cached(self):
+    self.assertEqual(['demo-00'], self.list_names())
+    self.assertEqual(['demo-00'], self.list_names())
+    self.assertEqual(1, testing.api.count('compute.instances.aggregatedList'))
+
+  def test_listings_are_not_shared_between_users(self):
+    self.list_names('alice')
+    testing.api.add_instance('demo-01')
+    other_project = testing.project(credentials=testing.Credentials('bob'))
+    self.assertEqual(['demo-00', 'demo-01'],
+                     self.list_names('bob', project=other_project))
+    self.assertEqual(2, testing.api.count('compute.instances.aggregatedList'))
+
+  def test_bulk_operations_invalidate_the_project(self):
+    self.list_names()
+    instance = self.project.list_instances()[0]
+    self.project.bulk_delete([instance])
+    self.assertEqual([], self.list_names())
+    self.assertEqual(2, testing.api.count('compute.instances.aggregatedList'))
+
+  def test_concurrent_misses_share_one_call(self):
+    testing.api.latency = 0.05
+    names = []
+    threads = [threading.Thread(target=lambda: names.append(
+        self.list_names())) for _ in range(5)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual([['demo-00']] * 5, names)
+    self.assertEqual(1, testing.api.count('compute.instances.aggregatedList'))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,173 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Client-side rate limiting of Compute Engine API calls."""
+
+import logging
+import random
+import time
+
+from google.appengine.api import memcache
+
+NAMESPACE = 'gce-rate-limiter'
+# Seconds of traffic at the full rate that a bucket can hold.
+BURST_SECONDS = 2
+# Maximum seconds a call waits for tokens. After that the call is sent
+# anyway and the API enforces its own quota.
+MAX_WAIT = 30
+# Attempts at a compare-and-set update of a bucket. If they all fail, the
+# call backs off for up to CAS_BACKOFF seconds and tries again.
+CAS_ATTEMPTS = 5
+CAS_BACKOFF = 0.1
+
+# Method families, keyed by the last part of the API method id.
+FAMILIES = {
+    'list': 'list',
+    'aggregatedList': 'list',
+    'get': 'get',
+    'insert': 'insert',
+    'delete': 'delete',
+}
+
+
+def method_family(request):
+  """Returns the method family (ex: list, insert) of an API request.
+
+  Args:
+    request: An apiclient.http.HttpRequest object.
+
+  Returns:
+    The string method family, or 'default' if the method isn't known.
+  """
+
+  method_id = getattr(request, 'methodId', None) or ''
+  return FAMILIES.get(method_id.split('.')[-1], 'default')
+
+
+class RateLimiter(object):
+  """Token buckets per project and method family.
+
+  Each bucket refills at the family's rate, in calls per second, and holds
+  up to BURST_SECONDS worth of calls. Bucket state lives in memcache so it
+  is shared by all App Engine instances. When memcache is unavailable or
+  the bucket is heavily contended, calls back off and try again, until
+  they have waited max_wait seconds.
+
+  Calls wait for tokens rather than fail. A call taking more tokens than a
+  bucket holds, such as a large batch, is let through once the bucket is
+  full, and later calls wait until the debt is paid back.
+  """
+
+  def __init__(self, rates, max_wait=MAX_WAIT):
+    """Initializes the RateLimiter class.
+
+    Args:
+      rates: A dictionary mapping method family to the allowed calls per
+          second. The 'default' entry applies to families not listed. A
+          family without a rate is not limited.
+      max_wait: The maximum number of seconds a call waits for tokens.
+    """
+
+    self.rates = rates
+    self.max_wait = max_wait
+
+  def acquire(self, project_id, family, tokens=1):
+    """Wait until tokens are available in the bucket and take them.
+
+    Args:
+      project_id: The string name of the Compute Engine project.
+      family: The string method family (ex: list, insert).
+      tokens: The number of calls to take tokens for.
+
+    Returns:
+      The number of seconds spent waiting.
+    """
+
+    rate = self.rates.get(family, self.rates.get('default'))
+    if not rate or tokens <= 0:
+      return 0
+    key = '%s:%s' % (project_id, family)
+    capacity = rate * BURST_SECONDS
+
+    waited = 0
+    while True:
+      wait = self._take(key, rate, capacity, tokens)
+      if not wait:
+        return waited
+      if waited + wait > self.max_wait:
+        logging.warning('Rate limit wait for %s exceeded %ss, sending %d '
+                        'calls anyway', key, self.max_wait, tokens)
+        return waited
+      time.sleep(wait)
+      waited += wait
+
+  def _take(self, key, rate, capacity, tokens):
+    """Take tokens from the shared bucket if enough are available.
+
+    Args:
+      key: The string bucket key.
+      rate: The refill rate in tokens per second.
+      capacity: The maximum number of tokens in the bucket.
+      tokens: The number of tokens to take.
+
+    Returns:
+      0 if the tokens were taken, otherwise the number of seconds to wait
+      before trying again.
+    """
+
+    # The client keeps the cas ids of the values it got, so it can't be
+    # shared by concurrent calls.
+    client = memcache.Client()
+    for _ in range(CAS_ATTEMPTS):
+      now = time.time()
+      bucket = client.gets(key, namespace=NAMESPACE)
+      if bucket is None:
+        # New buckets start full.
+        if client.add(key, (capacity - tokens, now), namespace=NAMESPACE):
+          return 0
+        continue
+
+      level, wait = self._refill(bucket, now, rate, capacity, tokens)
+      if wait:
+        return wait
+      if client.cas(key, (level, now), namespace=NAMESPACE):
+        return 0
+
+    # Memcache is unavailable or heavily contended. Jitter spreads out the
+    # next attempts of the contending calls.
+    logging.warning('Rate limiter bucket %s is unavailable, backing off', key)
+    return random.uniform(CAS_BACKOFF / 2, CAS_BACKOFF)
+
+  def _refill(self, bucket, now, rate, capacity, tokens):
+    """Refill a bucket and try to take tokens from it.
+
+    Args:
+      bucket: A (level, timestamp) tuple of the bucket's last state.
+      now: The current timestamp.
+      rate: The refill rate in tokens per second.
+      capacity: The maximum number of tokens in the bucket.
+      tokens: The number of tokens to take.
+
+    Returns:
+      A (level, wait) tuple. If wait is 0 the tokens were taken and level is
+      the new level. Otherwise wait is the number of seconds until enough
+      tokens should be available.
+    """
+
+    level, timestamp = bucket
+    level = min(capacity, level + (now - timestamp) * rate)
+    needed = min(tokens, capacity)
+    if level < needed:
+      return level, (needed - level) / float(rate)
+    return level - tokens, 0
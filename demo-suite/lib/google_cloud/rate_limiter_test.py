@@ -0,0 +1,131 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the rate_limiter module."""
+
+import threading
+import unittest
+
+import testing
+from google.appengine.api import memcache
+import rate_limiter
+
+
+class Clock(object):
+  """Stands in for the time module, with time passing only on sleep."""
+
+  def __init__(self):
+    self.now = 1000.0
+    self.slept = []
+
+  def time(self):
+    return self.now
+
+  def sleep(self, seconds):
+    self.slept.append(seconds)
+    self.now += seconds
+
+
+class FailingClient(testing.MemcacheClient):
+  """A memcache client whose compare-and-set always fails."""
+
+  def cas(self, key, value, time=0, namespace=None):
+    return False
+
+
+class RateLimiterTest(unittest.TestCase):
+  """Tests of the token buckets shared through memcache."""
+
+  def setUp(self):
+    testing.reset()
+    self.clock = Clock()
+    testing.patch(self, rate_limiter, 'time', self.clock)
+    # 8 calls per second, with buckets of 16. Powers of two keep the
+    # arithmetic exact.
+    self.limiter = rate_limiter.RateLimiter({'get': 8}, max_wait=5)
+
+  def take(self, tokens=1):
+    return self.limiter._take('project:get', 8, 16, tokens)
+
+  def test_new_buckets_start_full(self):
+    self.assertEqual([0] * 16, [self.take() for _ in range(16)])
+    self.assertEqual(0.125, self.take())
+
+  def test_buckets_refill_at_the_rate(self):
+    self.take(16)
+    self.clock.now += 0.5
+    self.assertEqual([0] * 4, [self.take() for _ in range(4)])
+    self.assertEqual(0.125, self.take())
+
+  def test_refills_are_capped(self):
+    self.take(16)
+    self.clock.now += 60
+    self.assertEqual(0, self.take(16))
+    self.assertEqual(0.125, self.take())
+
+  def test_calls_wait_until_tokens_are_available(self):
+    self.take(16)
+    self.assertEqual(0.375, self.take(3))
+    self.assertEqual(0.375, self.limiter.acquire('project', 'get', 3))
+    self.assertEqual([0.375], self.clock.slept)
+
+  def test_large_calls_go_into_debt(self):
+    self.assertEqual(0, self.take(100))
+    self.assertEqual(0.125 * 85, self.take())
+
+  def test_buckets_are_shared_by_limiters(self):
+    self.take(16)
+    other = rate_limiter.RateLimiter({'get': 8})
+    self.assertEqual(0.125, other._take('project:get', 8, 16, 1))
+
+  def test_unlimited_families_never_wait(self):
+    self.assertEqual(0, self.limiter.acquire('project', 'insert', 1000))
+    self.assertEqual([], self.clock.slept)
+
+  def test_waits_are_bounded(self):
+    self.take(100)
+    self.assertEqual(0, self.limiter.acquire('project', 'get'))
+    self.assertEqual([], self.clock.slept)
+
+  def test_concurrent_calls_take_each_token_once(self):
+    taken = []
+
+    def take():
+      for _ in range(10):
+        if not self.take():
+          taken.append(1)
+
+    threads = [threading.Thread(target=take) for _ in range(8)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    # The clock is stopped, so only the bucket's 16 tokens are taken.
+    self.assertEqual(16, len(taken))
+
+  def test_contended_buckets_back_off_instead_of_going_local(self):
+    self.take()
+    testing.patch(self, memcache, 'Client', FailingClient)
+    waits = [self.take() for _ in range(3)]
+    for wait in waits:
+      self.assertTrue(0 < wait <= rate_limiter.CAS_BACKOFF)
+    # Acquiring keeps backing off until it gives up after max_wait.
+    self.assertEqual(0, len(self.clock.slept))
+    waited = self.limiter.acquire('project', 'get')
+    self.assertTrue(4.8 < waited <= 5)
+    self.assertTrue(len(self.clock.slept) > 40)
+
+
+if __name__ == '__main__':
+  unittest.main()
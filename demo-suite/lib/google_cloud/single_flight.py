@@ -0,0 +1,80 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Coalescing of concurrent identical calls."""
+
+import sys
+import threading
+
+
+class _Call(object):
+  """A call in flight and its outcome."""
+
+  def __init__(self):
+    self.done = threading.Event()
+    self.result = None
+    self.exc_info = None
+
+
+class SingleFlight(object):
+  """Runs at most one call per key at a time, sharing its outcome.
+
+  Threads calling with a key that is already in flight wait for that call
+  and get its result, or its exception, instead of running the function
+  again.
+  """
+
+  def __init__(self):
+    """Initializes the SingleFlight class."""
+
+    self._lock = threading.Lock()
+    self._calls = {}
+
+  def do(self, key, function, *args, **kwargs):
+    """Call function, or wait for the call already in flight for key.
+
+    Args:
+      key: A hashable key identifying the call.
+      function: The callable to run. Any extra args are passed to it.
+
+    Returns:
+      The result of the call.
+
+    Raises:
+      Any exception raised by the call.
+    """
+
+    with self._lock:
+      call = self._calls.get(key)
+      leader = call is None
+      if leader:
+        call = self._calls[key] = _Call()
+
+    if leader:
+      try:
+        call.result = function(*args, **kwargs)
+      except BaseException:
+        # Including DeadlineExceededError, which waiting threads must see
+        # rather than a result of None.
+        call.exc_info = sys.exc_info()
+      finally:
+        with self._lock:
+          del self._calls[key]
+        call.done.set()
+    else:
+      call.done.wait()
+
+    if call.exc_info:
+      raise call.exc_info[0], call.exc_info[1], call.exc_info[2]
+    return call.result
@@ -0,0 +1,86 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the single_flight module."""
+
+import threading
+import time
+import unittest
+
+import single_flight
+
+
+class DeadlineExceededError(BaseException):
+  """Like App Engine's, not an Exception so that handlers don't catch it."""
+
+
+class SingleFlightTest(unittest.TestCase):
+  """Tests of coalescing concurrent calls."""
+
+  def setUp(self):
+    self.flight = single_flight.SingleFlight()
+    self.calls = []
+
+  def slow(self, result):
+    self.calls.append(result)
+    time.sleep(0.05)
+    if isinstance(result, type):
+      raise result('failed')
+    return result
+
+  def run_concurrently(self, key, result, count=5):
+    """Returns the results, or exception types, of concurrent calls."""
+
+    outcomes = []
+
+    def call():
+      try:
+        outcomes.append(self.flight.do(key, self.slow, result))
+      except BaseException, e:
+        outcomes.append(type(e))
+
+    threads = [threading.Thread(target=call) for _ in range(count)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    return outcomes
+
+  def test_concurrent_calls_share_one_execution(self):
+    self.assertEqual(['result'] * 5, self.run_concurrently('key', 'result'))
+    self.assertEqual(['result'], self.calls)
+
+  def test_different_keys_run_separately(self):
+    self.run_concurrently('a', 'result', count=1)
+    self.run_concurrently('b', 'result', count=1)
+    self.assertEqual(2, len(self.calls))
+
+  def test_exceptions_reach_waiting_threads(self):
+    self.assertEqual([ValueError] * 5,
+                     self.run_concurrently('key', ValueError))
+    self.assertEqual(1, len(self.calls))
+
+  def test_base_exceptions_reach_waiting_threads(self):
+    self.assertEqual([DeadlineExceededError] * 5,
+                     self.run_concurrently('key', DeadlineExceededError))
+    self.assertEqual(1, len(self.calls))
+
+  def test_sequential_calls_run_again(self):
+    self.assertEqual('result', self.flight.do('key', self.slow, 'result'))
+    self.assertEqual('result', self.flight.do('key', self.slow, 'result'))
+    self.assertEqual(2, len(self.calls))
+
+
+if __name__ == '__main__':
+  unittest.main()
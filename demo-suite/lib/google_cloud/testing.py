@@ -0,0 +1,1060 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Fakes of App Engine and the API client libraries for unit tests.
+
+The modules of this package use App Engine services and the Google API
+client libraries, which aren't available outside App Engine. Importing this
+module installs in-memory fakes of them in sys.modules, so it must be
+imported before the modules under test. The fake Compute Engine API keeps
+its resources in the module's Api object, which reset replaces. The fake
+urlfetch fetches over real HTTP, from local stand-in servers (see
+StandInServer). The web framework, datastore and task queue modules the
+demos import are faked only as far as importing a demo's main module takes.
+
+Run the tests from the demo-suite directory with Python 2.7:
+
+  python -m unittest discover -s lib/google_cloud -p '*_test.py'
+  python -m unittest discover -s demos/fractal -p '*_test.py'
+"""
+
+import BaseHTTPServer
+import json
+import logging
+import os
+import pickle
+import re
+import socket
+import SocketServer
+import sys
+import threading
+import time
+import types
+import urllib2
+
+# The API version of the discovery document checked in to discovery/compute.
+API_VERSION = 'v1beta15'
+PROJECT = 'test-project'
+# The settings.json file of the demos.
+SETTINGS = json.load(open(os.path.join(
+    os.path.dirname(__file__), '../../settings.json')))
+ZONE = 'us-central1-a'
+
+# Failures the tests provoke on purpose are logged as errors.
+logging.disable(logging.ERROR)
+
+
+def _module(name, **attributes):
+  """Installs a fake module, and its parent packages, in sys.modules."""
+
+  parent, _, child = name.rpartition('.')
+  if parent and parent not in sys.modules:
+    _module(parent)
+  module = sys.modules.get(name)
+  if module is None:
+    module = sys.modules[name] = types.ModuleType(name)
+    module.__path__ = []
+  module.__dict__.update(attributes)
+  if parent:
+    setattr(sys.modules[parent], child, module)
+  return module
+
+
+def benchmark(name, function, repeat=5):
+  """Times the best of repeat calls to function and reports it.
+
+  Args:
+    name: The string name of the benchmark.
+    function: The callable to time.
+    repeat: The number of calls.
+
+  Returns:
+    The number of seconds taken by the fastest call.
+  """
+
+  best = None
+  for _ in range(repeat):
+    start = time.time()
+    function()
+    elapsed = time.time() - start
+    if best is None or elapsed < best:
+      best = elapsed
+  sys.stderr.write('\nbenchmark %s: %.3f ms\n' % (name, best * 1000))
+  return best
+
+
+def patch(test, owner, name, value):
+  """Sets an attribute for the duration of a test.
+
+  Args:
+    test: The unittest.TestCase, which restores the attribute on cleanup.
+    owner: The object, such as a module, owning the attribute.
+    name: The string name of the attribute.
+    value: The value to set.
+  """
+
+  test.addCleanup(setattr, owner, name, getattr(owner, name))
+  setattr(owner, name, value)
+
+
+class Memcache(object):
+  """An in-memory memcache. Values are pickled, as by the real service."""
+
+  def __init__(self):
+    """Initializes the Memcache class."""
+
+    self._lock = threading.RLock()
+    self._entries = {}
+    self._version = 0
+
+  def flush_all(self):
+    """Drops every value."""
+
+    with self._lock:
+      self._entries.clear()
+    return True
+
+  def get(self, key, namespace=None):
+    return self.get_multi([key], namespace=namespace).get(key)
+
+  def get_multi(self, keys, key_prefix='', namespace=None):
+    values = {}
+    with self._lock:
+      for key in keys:
+        entry = self._entry(key_prefix + key, namespace)
+        if entry is not None:
+          values[key] = pickle.loads(entry[0])
+    return values
+
+  def set(self, key, value, time=0, namespace=None):
+    return not self.set_multi({key: value}, time=time, namespace=namespace)
+
+  def set_multi(self, mapping, time=0, key_prefix='', namespace=None):
+    with self._lock:
+      for key, value in mapping.items():
+        self._store(key_prefix + key, value, time, namespace)
+    return []
+
+  def add(self, key, value, time=0, namespace=None):
+    return not self.add_multi({key: value}, time=time, namespace=namespace)
+
+  def add_multi(self, mapping, time=0, key_prefix='', namespace=None):
+    not_added = []
+    with self._lock:
+      for key, value in mapping.items():
+        if self._entry(key_prefix + key, namespace) is None:
+          self._store(key_prefix + key, value, time, namespace)
+        else:
+          not_added.append(key)
+    return not_added
+
+  def delete(self, key, namespace=None):
+    with self._lock:
+      self._entries.pop((namespace, key), None)
+    return 2
+
+  def delete_multi(self, keys, key_prefix='', namespace=None):
+    with self._lock:
+      for key in keys:
+        self._entries.pop((namespace, key_prefix + key), None)
+    return True
+
+  def incr(self, key, delta=1, namespace=None, initial_value=None):
+    with self._lock:
+      entry = self._entry(key, namespace)
+      if entry is None:
+        if initial_value is None:
+          return None
+        value = initial_value
+      else:
+        value = pickle.loads(entry[0])
+      self._store(key, value + delta, 0, namespace)
+      return value + delta
+
+  def _entry(self, key, namespace):
+    """Returns the unexpired (pickled value, expiry, version) of a key."""
+
+    entry = self._entries.get((namespace, key))
+    if entry is None or (entry[1] and entry[1] < time.time()):
+      return None
+    return entry
+
+  def _store(self, key, value, seconds, namespace):
+    """Stores a value for a number of seconds, or forever if 0."""
+
+    self._version += 1
+    expiry = seconds and time.time() + seconds
+    self._entries[(namespace, key)] = (
+        pickle.dumps(value), expiry, self._version)
+
+
+class MemcacheClient(object):
+  """A memcache.Client, with compare-and-set."""
+
+  def __init__(self):
+    """Initializes the MemcacheClient class."""
+
+    self._versions = {}
+
+  def get(self, key, namespace=None):
+    return memcache.get(key, namespace=namespace)
+
+  def set(self, key, value, time=0, namespace=None):
+    return memcache.set(key, value, time=time, namespace=namespace)
+
+  def add(self, key, value, time=0, namespace=None):
+    return memcache.add(key, value, time=time, namespace=namespace)
+
+  def gets(self, key, namespace=None):
+    with memcache._lock:
+      entry = memcache._entry(key, namespace)
+      if entry is None:
+        return None
+      self._versions[(namespace, key)] = entry[2]
+      return pickle.loads(entry[0])
+
+  def cas(self, key, value, time=0, namespace=None):
+    with memcache._lock:
+      entry = memcache._entry(key, namespace)
+      version = self._versions.pop((namespace, key), None)
+      if entry is None or entry[2] != version:
+        return False
+      memcache._store(key, value, time, namespace)
+      return True
+
+
+class HttpResponse(dict):
+  """An httplib2.Response: a dictionary of headers, with a status."""
+
+  def __init__(self, status, reason='', headers=None):
+    """Initializes the HttpResponse class.
+
+    Args:
+      status: The integer HTTP status.
+      reason: The string reason phrase.
+      headers: A dictionary of lower case header names to values.
+    """
+
+    super(HttpResponse, self).__init__(headers or {})
+    self.status = status
+    self.reason = reason
+
+
+class HttpError(Exception):
+  """apiclient.errors.HttpError."""
+
+  def __init__(self, resp, content, uri=None):
+    super(HttpError, self).__init__(resp.status, resp.reason)
+    self.resp = resp
+    self.content = content
+    self.uri = uri
+
+  def __str__(self):
+    return '<HttpError %s "%s">' % (self.resp.status, self.resp.reason)
+
+
+class BatchError(HttpError):
+  """apiclient.errors.BatchError."""
+
+  def __init__(self, reason, resp=None, content=None):
+    Exception.__init__(self, reason)
+    self.reason = reason
+    self.resp = resp
+    self.content = content
+    self.uri = None
+
+  def __str__(self):
+    return '<BatchError %s "%s">' % (self.resp and self.resp.status,
+                                     self.reason)
+
+
+def http_error(status, reason=''):
+  """Returns an HttpError with the status, as raised by an API request."""
+
+  return HttpError(HttpResponse(status, reason), json.dumps(
+      {'error': {'code': status, 'message': reason}}))
+
+
+class HttpLib2Error(Exception):
+  """httplib2.HttpLib2Error."""
+
+
+class Http(object):
+  """An httplib2.Http, which can't reach the network."""
+
+  def __init__(self, cache=None, timeout=None):
+    self.cache = cache
+    self.timeout = timeout
+
+  def request(self, uri, *args, **kwargs):
+    raise HttpLib2Error('No network in tests: %s' % uri)
+
+
+class AccessTokenRefreshError(Exception):
+  """oauth2client.client.AccessTokenRefreshError."""
+
+
+class Credentials(object):
+  """oauth2client.client.Credentials, authorizing nothing."""
+
+  def __init__(self, user_id='user'):
+    self.user_id = user_id
+
+  def authorize(self, http):
+    return http
+
+
+class User(object):
+  """A google.appengine.api.users.User."""
+
+  def __init__(self, user_id):
+    self._user_id = user_id
+
+  def user_id(self):
+    return self._user_id
+
+  def email(self):
+    return '%s@example.com' % self._user_id
+
+  def nickname(self):
+    return self._user_id
+
+
+# The signed in user of each thread, as App Engine keeps it per request.
+_current_user = threading.local()
+
+
+def login(user_id):
+  """Signs in a user on the calling thread, or signs out if None."""
+
+  _current_user.user = user_id and User(user_id)
+
+
+def get_current_user():
+  return getattr(_current_user, 'user', None)
+
+
+class WebRequest(object):
+  """The parts of a webapp2.Request the libraries use."""
+
+  def __init__(self, params=None, headers=None):
+    """Initializes the WebRequest class.
+
+    Args:
+      params: A dictionary of query parameters.
+      headers: A dictionary of request headers.
+    """
+
+    self.params = params or {}
+    self.headers = headers or {}
+    self.uri = 'http://localhost/'
+
+  def get(self, name, default_value=''):
+    return self.params.get(name, default_value)
+
+
+class WebResponse(object):
+  """The parts of a webapp2.Response the libraries use."""
+
+  def __init__(self):
+    self.status_int = 200
+    self.status_message = None
+    self.headers = {}
+    self.etag = None
+    self.body = ''
+    self.out = self
+
+  def write(self, text):
+    self.body += text
+
+  def set_status(self, code, message=None):
+    self.status_int = code
+    self.status_message = message
+
+
+class RequestHandler(object):
+  """A webapp2.RequestHandler, with a request and its response."""
+
+  def __init__(self, params=None, headers=None):
+    self.request = WebRequest(params, headers)
+    self.response = WebResponse()
+    self.redirected_to = None
+
+  def redirect(self, uri):
+    self.redirected_to = uri
+
+  @property
+  def uri(self):
+    return self.request.uri
+
+
+class WSGIApplication(object):
+  """A webapp2.WSGIApplication, keeping its routes."""
+
+  def __init__(self, routes=None, debug=False):
+    self.routes = routes or []
+
+
+class Route(object):
+  """A webapp2.Route."""
+
+  def __init__(self, template, handler=None, **kwargs):
+    self.template = template
+    self.handler = handler
+
+
+class TemplateEnvironment(object):
+  """A jinja2.Environment, without templates."""
+
+  def __init__(self, loader=None, **kwargs):
+    self.loader = loader
+
+
+class Property(object):
+  """A google.appengine.ext.db.Property, storing nothing."""
+
+  def __init__(self, *args, **kwargs):
+    pass
+
+
+class Model(object):
+  """A google.appengine.ext.db.Model, storing nothing."""
+
+  def __init__(self, **kwargs):
+    self.__dict__.update(kwargs)
+
+
+class OAuth2Decorator(object):
+  """An oauth2client.appengine decorator, authorizing every request."""
+
+  def __init__(self, *args, **kwargs):
+    self.credentials = Credentials()
+
+  def oauth_required(self, method):
+    return method
+
+  def oauth_aware(self, method):
+    return method
+
+
+class TaskQueueError(Exception):
+  """google.appengine.api.taskqueue.Error."""
+
+
+def defer(function, *args, **kwargs):
+  """deferred.defer, running the function right away."""
+
+  for name in [name for name in kwargs if name.startswith('_')]:
+    del kwargs[name]
+  function(*args, **kwargs)
+
+
+class UrlfetchError(Exception):
+  """google.appengine.api.urlfetch.Error."""
+
+
+class DownloadError(UrlfetchError):
+  """google.appengine.api.urlfetch.DownloadError."""
+
+
+class UrlfetchDeadlineExceededError(UrlfetchError):
+  """google.appengine.api.urlfetch.DeadlineExceededError."""
+
+
+class FetchResponse(object):
+  """A urlfetch response."""
+
+  def __init__(self, status_code, content, headers):
+    self.status_code = status_code
+    self.content = content
+    self.headers = headers
+
+
+# Notified whenever a fetch completes, for wait_any.
+_fetch_done = threading.Condition()
+
+
+class UserRPC(object):
+  """A urlfetch RPC, fetching over real HTTP in a thread."""
+
+  def __init__(self, deadline=None):
+    self.deadline = deadline or 5
+    self.done = False
+    self.response = None
+    self.exception = None
+
+  def fetch(self, url):
+    """Starts fetching url."""
+
+    thread = threading.Thread(target=self._fetch, args=(url,))
+    thread.daemon = True
+    thread.start()
+
+  def _fetch(self, url):
+    try:
+      try:
+        f = urllib2.urlopen(url, timeout=self.deadline)
+      except urllib2.HTTPError, f:
+        # urlfetch returns error responses, rather than raising.
+        pass
+      self.response = FetchResponse(f.code, f.read(), dict(f.info()))
+    except socket.timeout, e:
+      self.exception = UrlfetchDeadlineExceededError(str(e))
+    except (urllib2.URLError, socket.error), e:
+      self.exception = DownloadError(str(e))
+    with _fetch_done:
+      self.done = True
+      _fetch_done.notify_all()
+
+  def get_result(self):
+    UserRPC.wait_any([self])
+    if self.exception:
+      raise self.exception
+    return self.response
+
+  @staticmethod
+  def wait_any(rpcs):
+    """Waits for one of rpcs to complete and returns it."""
+
+    with _fetch_done:
+      while True:
+        for rpc in rpcs:
+          if rpc.done:
+            return rpc
+        _fetch_done.wait()
+
+
+def make_fetch_call(rpc, url):
+  rpc.fetch(url)
+
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  """A local HTTP server standing in for a demo server.
+
+  It serves pages, a dictionary mapping a path to a (status, content) tuple,
+  ignoring query strings, after delay seconds. Other paths are not found.
+  """
+
+  daemon_threads = True
+
+  def __init__(self, pages, delay=0):
+    BaseHTTPServer.HTTPServer.__init__(
+        self, ('127.0.0.1', 0), _StandInHandler)
+    self.pages = pages
+    self.delay = delay
+    thread = threading.Thread(target=self.serve_forever, args=(0.01,))
+    thread.daemon = True
+    thread.start()
+
+  @property
+  def host(self):
+    return '%s:%d' % self.server_address
+
+  def stop(self):
+    self.shutdown()
+    self.server_close()
+
+
+class _StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+  def do_GET(self):
+    time.sleep(self.server.delay)
+    status, content = self.server.pages.get(
+        self.path.split('?')[0], (404, 'not found'))
+    try:
+      self.send_response(status)
+      self.end_headers()
+      self.wfile.write(content)
+    except socket.error:
+      pass  # The client gave up.
+
+  def handle(self):
+    # Flushing the reply to a client that gave up breaks the pipe.
+    try:
+      BaseHTTPServer.BaseHTTPRequestHandler.handle(self)
+    except socket.error:
+      pass
+
+  def finish(self):
+    try:
+      BaseHTTPServer.BaseHTTPRequestHandler.finish(self)
+    except socket.error:
+      pass
+
+  def log_message(self, *args):
+    pass
+
+
+class Request(object):
+  """An apiclient.http.HttpRequest of the fake API."""
+
+  def __init__(self, api, method_id, method, function, body=None,
+               params=None):
+    """Initializes the Request class.
+
+    Args:
+      api: The Api object serving the request.
+      method_id: The string API method id (ex: compute.instances.list).
+      method: The string HTTP method.
+      function: A callable returning the response.
+      body: The dictionary request body, if any.
+      params: The dictionary of request parameters.
+    """
+
+    self.api = api
+    self.methodId = method_id
+    self.method = method
+    self.function = function
+    self.body = body is not None and json.dumps(body) or None
+    self.params = params or {}
+    self.uri = 'https://fake/%s' % method_id
+
+  def execute(self, http=None):
+    """Runs the request against the fake API and returns the response."""
+
+    self.api.record(self.methodId)
+    if self.api.latency:
+      time.sleep(self.api.latency)
+    exception = self.api.failure(self.methodId)
+    if exception:
+      raise exception
+    return self.function()
+
+
+class BatchHttpRequest(object):
+  """apiclient.http.BatchHttpRequest, running its requests in turn."""
+
+  def __init__(self):
+    self.requests = []
+
+  def add(self, request, callback=None, request_id=None):
+    self.requests.append((request, callback, request_id))
+
+  def execute(self, http=None):
+    api = self.requests[0][0].api
+    api.record('batch')
+    exception = api.failure('batch') or api.batch_error
+    if exception is not None:
+      raise exception
+    for request, callback, request_id in self.requests[api.batch_unanswered:]:
+      api.record(request.methodId)
+      try:
+        exception = api.failure(request.methodId)
+        if exception:
+          raise exception
+        response = request.function()
+      except HttpError, e:
+        callback(request_id, None, e)
+      else:
+        callback(request_id, response, None)
+
+
+# Singular resource names of the collections, and whether they are zonal.
+COLLECTIONS = {
+    'instances': ('instance', True),
+    'disks': ('disk', True),
+    'machineTypes': ('machineType', True),
+    'zoneOperations': ('operation', True),
+    'firewalls': ('firewall', False),
+    'routes': ('route', False),
+    'images': ('image', False),
+    'networks': ('network', False),
+    'zones': ('zone', False),
+    'globalOperations': ('operation', False),
+    'projects': ('project', False),
+}
+
+
+class Collection(object):
+  """An apiclient.discovery.Resource collection of the fake API."""
+
+  def __init__(self, api, name):
+    """Initializes the Collection class.
+
+    Args:
+      api: The Api object holding the resources.
+      name: The string name of the collection (ex: instances).
+    """
+
+    self.api = api
+    self.name = name
+    self.type, self.zonal = COLLECTIONS[name]
+
+  def list(self, **params):
+    return self._request('list', 'GET', lambda: self._page(params), params)
+
+  def list_next(self, previous_request, previous_response):
+    token = previous_response.get('nextPageToken')
+    if not token:
+      return None
+    return self.list(**dict(previous_request.params, pageToken=token))
+
+  def aggregatedList(self, **params):
+    def aggregate():
+      page = self._page(params)
+      items = {}
+      for item in page.pop('items', []):
+        scope = 'zones/%s' % item['zone'].split('/')[-1]
+        items.setdefault(scope, {}).setdefault(self.name, []).append(item)
+      page['items'] = items
+      return page
+    return self._request('aggregatedList', 'GET', aggregate, params)
+
+  def aggregatedList_next(self, previous_request, previous_response):
+    token = previous_response.get('nextPageToken')
+    if not token:
+      return None
+    return self.aggregatedList(
+        **dict(previous_request.params, pageToken=token))
+
+  def get(self, **params):
+    def get():
+      resource = self.api.get(self.name, params[self.type])
+      if resource is None:
+        raise http_error(404, 'Not Found')
+      return resource
+    return self._request('get', 'GET', get, params)
+
+  def insert(self, body=None, **params):
+    def insert():
+      if self.api.get(self.name, body['name']) is not None:
+        raise http_error(409, 'Already Exists')
+      resource = dict(body)
+      if self.zonal:
+        resource['zone'] = 'zones/%s' % params['zone']
+      self.api.add(self.name, resource)
+      return self.api.operation('insert', resource, params.get('zone'))
+    return self._request('insert', 'POST', insert, params, body)
+
+  def delete(self, **params):
+    def delete():
+      resource = self.api.remove(self.name, params[self.type])
+      if resource is None:
+        raise http_error(404, 'Not Found')
+      return self.api.operation('delete', resource, params.get('zone'))
+    return self._request('delete', 'DELETE', delete, params)
+
+  def _request(self, verb, method, function, params, body=None):
+    """Returns a Request for a method of the collection."""
+
+    return Request(self.api, 'compute.%s.%s' % (self.name, verb), method,
+                   function, body=body, params=params)
+
+  def _page(self, params):
+    """Returns a page of the listing the parameters ask for."""
+
+    items = self.api.list(self.name)
+    if self.zonal and params.get('zone'):
+      items = [item for item in items
+               if item['zone'].split('/')[-1] == params['zone']]
+    match = re.match(r'name eq (.*)$', params.get('filter') or '')
+    if match:
+      items = [item for item in items
+               if re.match(match.group(1) + '$', item['name'])]
+
+    start = int(params.get('pageToken') or 0)
+    end = start + min(params.get('maxResults') or self.api.page_size,
+                      self.api.page_size)
+    page = {}
+    if items[start:end]:
+      page['items'] = items[start:end]
+    if end < len(items):
+      page['nextPageToken'] = str(end)
+    return page
+
+
+class Projects(Collection):
+  """The projects collection of the fake API.
+
+  Projects are added with Api.add_project. Their common instance metadata
+  has a fingerprint, which setCommonInstanceMetadata checks, as the API
+  does, and changes.
+  """
+
+  def setCommonInstanceMetadata(self, body=None, **params):
+    def set_metadata():
+      project = self.api.get(self.name, params['project'])
+      if project is None:
+        raise http_error(404, 'Not Found')
+      metadata = project['commonInstanceMetadata']
+      if body.get('fingerprint') != metadata['fingerprint']:
+        raise http_error(412, 'Conditions Not Met')
+      project['commonInstanceMetadata'] = {
+          'items': [dict(item) for item in body.get('items', [])],
+          'fingerprint': str(int(metadata['fingerprint']) + 1),
+      }
+      return self.api.operation('setMetadata', project)
+    return self._request('setCommonInstanceMetadata', 'POST', set_metadata,
+                         params, body)
+
+
+class Service(object):
+  """An apiclient.discovery.Resource for the fake API."""
+
+  def __init__(self, api, http=None):
+    self._api = api
+    self._http = http
+
+  def __getattr__(self, name):
+    if name not in COLLECTIONS:
+      raise AttributeError(name)
+
+    def collection():
+      self._api.record('collection:%s' % name)
+      if name == 'projects':
+        return Projects(self._api, name)
+      return Collection(self._api, name)
+    return collection
+
+
+class Api(object):
+  """A fake Compute Engine API, serving resources held in memory.
+
+  Attributes:
+    calls: A list of the method ids of the requests run, with 'batch' for
+        each batch request and 'collection:<name>' for each collection
+        built.
+    latency: Seconds each request takes.
+    page_size: The maximum number of items in a page of a listing.
+    batch_error: An exception raised by every batch request, if set.
+    batch_unanswered: The number of requests at the start of each batch that
+        get no response.
+    build_latency: Seconds each service build takes.
+    builds: The number of services built.
+    max_concurrent_builds: The most services built at the same time from
+        the same discovery document.
+    failures: A dictionary mapping a call, as recorded in calls, to a list
+        of the exceptions its next requests raise, see fail.
+  """
+
+  def __init__(self):
+    """Initializes the Api class."""
+
+    self.calls = []
+    self.latency = 0
+    self.page_size = 500
+    self.batch_error = None
+    self.batch_unanswered = 0
+    self.build_latency = 0
+    self.builds = 0
+    self.max_concurrent_builds = 0
+    self.failures = {}
+    self._building = {}
+    self._resources = {}
+    self._operations = 0
+    self._lock = threading.Lock()
+    self.add_project(PROJECT)
+
+  def record(self, call):
+    """Records a call to the API."""
+
+    with self._lock:
+      self.calls.append(call)
+
+  def fail(self, call, *exceptions):
+    """Makes the next requests of a call raise the exceptions, one each.
+
+    Args:
+      call: A method id (ex: compute.instances.get), or 'batch'.
+      exceptions: The exceptions to raise, in order.
+    """
+
+    with self._lock:
+      self.failures.setdefault(call, []).extend(exceptions)
+
+  def failure(self, call):
+    """Returns the next exception a request of a call raises, if any."""
+
+    with self._lock:
+      exceptions = self.failures.get(call)
+      if exceptions:
+        return exceptions.pop(0)
+
+  def count(self, call):
+    """Returns the number of calls recorded with the given name."""
+
+    return self.calls.count(call)
+
+  def add(self, collection, resource):
+    """Adds a resource dictionary to a collection."""
+
+    with self._lock:
+      self._resources.setdefault(collection, {})[resource['name']] = resource
+
+  def add_instance(self, name, zone=ZONE, status='RUNNING', **fields):
+    """Adds a running instance in a zone, with any other fields given."""
+
+    instance = {
+        'name': name,
+        'zone': 'zones/%s' % zone,
+        'status': status,
+        'machineType': 'zones/%s/machineTypes/n1-standard-1' % zone,
+        'networkInterfaces': [{'network': 'global/networks/default'}],
+    }
+    instance.update(fields)
+    self.add('instances', instance)
+
+  def add_project(self, name, metadata=None):
+    """Adds a project with a dictionary of common instance metadata."""
+
+    self.add('projects', {
+        'name': name,
+        'commonInstanceMetadata': {
+            'items': [{'key': key, 'value': value}
+                      for key, value in sorted((metadata or {}).items())],
+            'fingerprint': '1',
+        },
+    })
+
+  def metadata(self, project=PROJECT):
+    """Returns the common instance metadata of a project as a dictionary."""
+
+    project = self.get('projects', project)
+    return dict((item['key'], item['value'])
+                for item in project['commonInstanceMetadata']['items'])
+
+  def get(self, collection, name):
+    """Returns a resource dictionary, or None if it doesn't exist."""
+
+    with self._lock:
+      return self._resources.get(collection, {}).get(name)
+
+  def remove(self, collection, name):
+    """Removes and returns a resource, or None if it doesn't exist."""
+
+    with self._lock:
+      return self._resources.get(collection, {}).pop(name, None)
+
+  def list(self, collection):
+    """Returns the resources of a collection, sorted by name."""
+
+    with self._lock:
+      resources = self._resources.get(collection, {})
+      return [resources[name] for name in sorted(resources)]
+
+  def names(self, collection):
+    """Returns the names of the resources of a collection, sorted."""
+
+    return [resource['name'] for resource in self.list(collection)]
+
+  def operation(self, verb, resource, zone=None):
+    """Returns a completed operation resource, kept in its collection."""
+
+    with self._lock:
+      self._operations += 1
+      operation = {
+          'name': 'operation-%d' % self._operations,
+          'operationType': verb,
+          'targetLink': resource['name'],
+          'status': 'DONE',
+      }
+    if zone:
+      operation['zone'] = 'zones/%s' % zone
+    self.add(zone and 'zoneOperations' or 'globalOperations', operation)
+    return operation
+
+  def build(self, service, http=None, **kwargs):
+    """discovery.build_from_document, fixing up the document in place."""
+
+    if isinstance(service, basestring):
+      service = json.loads(service)
+    key = id(service)
+    with self._lock:
+      self.builds += 1
+      self._building[key] = self._building.get(key, 0) + 1
+      self.max_concurrent_builds = max(
+          self.max_concurrent_builds, self._building[key])
+    try:
+      if self.build_latency:
+        time.sleep(self.build_latency)
+      # Like apiclient, copy the common parameters into every method.
+      for resource in service.get('resources', {}).values():
+        for method in resource.get('methods', {}).values():
+          parameters = method.setdefault('parameters', {})
+          for name, parameter in service.get('parameters', {}).iteritems():
+            parameters[name] = parameter
+    finally:
+      with self._lock:
+        self._building[key] -= 1
+    return Service(self, http)
+
+
+memcache = Memcache()
+api = Api()
+
+
+def reset():
+  """Replaces the fake API, empties memcache and signs out."""
+
+  global api
+  api = Api()
+  memcache.flush_all()
+  login(None)
+
+
+def project(project_id=PROJECT, credentials=None, **kwargs):
+  """Returns a GceProject using the fake API, without rate limits.
+
+  Args:
+    project_id: The string name of the project.
+    credentials: A Credentials object. Defaults to new Credentials.
+    kwargs: Any other arguments for GceProject.
+
+  Returns:
+    A gce.GceProject object.
+  """
+
+  import gce
+
+  compute = dict(SETTINGS['compute'],
+                 api_version=API_VERSION, rate_limits={}, zone=ZONE)
+  return gce.GceProject(credentials or Credentials(), project_id=project_id,
+                        settings={'compute': compute}, **kwargs)
+
+
+_module('lib_path')
+_module('google.appengine.api.memcache',
+        Client=MemcacheClient,
+        **dict((name, getattr(memcache, name)) for name in (
+            'get', 'get_multi', 'set', 'set_multi', 'add', 'add_multi',
+            'delete', 'delete_multi', 'incr', 'flush_all')))
+_module('google.appengine.api.users', User=User,
+        get_current_user=get_current_user,
+        create_login_url=lambda dest_url: '/_ah/login?continue=' + dest_url)
+_module('google.appengine.api.urlfetch', Error=UrlfetchError,
+        DownloadError=DownloadError,
+        DeadlineExceededError=UrlfetchDeadlineExceededError,
+        create_rpc=UserRPC, make_fetch_call=make_fetch_call)
+_module('google.appengine.api.apiproxy_stub_map', UserRPC=UserRPC)
+_module('apiclient.discovery',
+        build_from_document=lambda *args, **kwargs: api.build(*args, **kwargs))
+_module('apiclient.errors', Error=Exception, HttpError=HttpError,
+        BatchError=BatchError)
+_module('apiclient.http', BatchHttpRequest=BatchHttpRequest,
+        HttpRequest=Request)
+_module('httplib2', Http=Http, HttpLib2Error=HttpLib2Error)
+_module('oauth2client.client', Credentials=Credentials,
+        AccessTokenRefreshError=AccessTokenRefreshError)
+_module('oauth2client.appengine',
+        OAuth2DecoratorFromClientSecrets=OAuth2Decorator)
+_module('google.appengine.api.taskqueue', Error=TaskQueueError)
+_module('google.appengine.ext.deferred', defer=defer)
+_module('google.appengine.ext.db', Model=Model, Property=Property,
+        TextProperty=Property, UserProperty=Property,
+        StringProperty=Property)
+_module('jinja2', Environment=TemplateEnvironment,
+        FileSystemLoader=lambda path: path)
+_module('webapp2', RequestHandler=RequestHandler, Response=WebResponse,
+        WSGIApplication=WSGIApplication, Route=Route,
+        redirect=lambda uri: uri)
@@ -0,0 +1,114 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Debug tracing of API calls, enabled per request.
+
+Tracing is off by default. While it is off, event() returns right away, so
+trace points don't format or serialize anything. It is turned on for the
+current thread with scope(), and every event is then logged with the
+scope's correlation id and its fields as JSON.
+"""
+
+import binascii
+import contextlib
+import json
+import logging
+import os
+import random
+import threading
+
+# The logging level of trace events.
+LEVEL = logging.INFO
+# Fraction of the scopes that are traced when not asked for.
+SAMPLE_RATE = 0.0
+
+_local = threading.local()
+
+
+def enabled():
+  """Returns True if the current thread is tracing."""
+
+  return getattr(_local, 'correlation_id', None) is not None
+
+
+def correlation_id():
+  """Returns the correlation id of the current thread's trace, or None."""
+
+  return getattr(_local, 'correlation_id', None)
+
+
+def event(name, **fields):
+  """Log a trace event, if the current thread is tracing.
+
+  Fields are only serialized when the event is logged, so they can be
+  passed as is.
+
+  Args:
+    name: The string name of the event (ex: disk_mount).
+    fields: Values describing the event, which must be JSON serializable.
+  """
+
+  trace_id = getattr(_local, 'correlation_id', None)
+  if trace_id is None or not logging.getLogger().isEnabledFor(LEVEL):
+    return
+  logging.log(LEVEL, 'trace %s %s %s', trace_id, name,
+              json.dumps(fields, sort_keys=True, default=repr))
+
+
+@contextlib.contextmanager
+def scope(force=False, trace_id=None, sample_rate=None):
+  """Trace the current thread for the duration of the context.
+
+  Args:
+    force: If True, always trace. Otherwise the scope is sampled.
+    trace_id: An optional string correlation id. Defaults to the App Engine
+        request log id, or a random id.
+    sample_rate: The fraction of scopes to trace when not forced. Defaults
+        to SAMPLE_RATE.
+
+  Yields:
+    The string correlation id, or None if the scope isn't traced.
+  """
+
+  if sample_rate is None:
+    sample_rate = SAMPLE_RATE
+  previous = getattr(_local, 'correlation_id', None)
+  if previous is None and (force or random.random() < sample_rate):
+    _local.correlation_id = trace_id or _new_id()
+  try:
+    yield correlation_id()
+  finally:
+    _local.correlation_id = previous
+
+
+@contextlib.contextmanager
+def restore(trace_id):
+  """Continue a trace, such as the one of a parent thread, in this thread.
+
+  Args:
+    trace_id: The string correlation id from correlation_id(), or None.
+  """
+
+  previous = getattr(_local, 'correlation_id', None)
+  _local.correlation_id = trace_id
+  try:
+    yield
+  finally:
+    _local.correlation_id = previous
+
+
+def _new_id():
+  """Returns a new correlation id."""
+
+  return os.environ.get('REQUEST_LOG_ID') or binascii.hexlify(os.urandom(8))
@@ -0,0 +1,126 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the tracing module."""
+
+import logging
+import os
+import threading
+import unittest
+
+import testing
+import gce_appengine
+import tracing
+
+
+class Events(logging.Handler):
+  """Collects the trace events logged, as (id, name, fields) tuples."""
+
+  def __init__(self):
+    logging.Handler.__init__(self)
+    self.events = []
+
+  def emit(self, record):
+    self.events.append(tuple(record.getMessage().split(' ', 3)[1:]))
+
+
+class Unserializable(object):
+  """A field value recording whether it was serialized."""
+
+  serialized = False
+
+  def __repr__(self):
+    Unserializable.serialized = True
+    return 'unserializable'
+
+
+class TracingTest(unittest.TestCase):
+  """Tests of trace scopes and events."""
+
+  def setUp(self):
+    testing.reset()
+    # testing disables logging up to errors.
+    testing.patch(self, tracing, 'LEVEL', logging.CRITICAL)
+    self.handler = Events()
+    logging.getLogger().addHandler(self.handler)
+    self.addCleanup(logging.getLogger().removeHandler, self.handler)
+
+  def test_events_outside_a_scope_do_nothing(self):
+    Unserializable.serialized = False
+    tracing.event('outside', value=Unserializable())
+    self.assertEqual([], self.handler.events)
+    self.assertFalse(Unserializable.serialized)
+    self.assertFalse(tracing.enabled())
+
+  def test_forced_scopes_are_traced(self):
+    with tracing.scope(force=True, trace_id='abc') as trace_id:
+      self.assertEqual('abc', trace_id)
+      self.assertTrue(tracing.enabled())
+      tracing.event('inside', value=1)
+    tracing.event('after')
+    self.assertEqual([('abc', 'inside', '{"value": 1}')],
+                     self.handler.events)
+    self.assertEqual(None, tracing.correlation_id())
+
+  def test_scopes_are_sampled(self):
+    with tracing.scope(sample_rate=0) as trace_id:
+      self.assertEqual(None, trace_id)
+    with tracing.scope(sample_rate=1) as trace_id:
+      self.assertNotEqual(None, trace_id)
+
+  def test_nested_scopes_keep_the_outer_trace(self):
+    with tracing.scope(force=True, trace_id='outer'):
+      with tracing.scope(force=True, trace_id='inner') as trace_id:
+        self.assertEqual('outer', trace_id)
+      self.assertEqual('outer', tracing.correlation_id())
+    self.assertEqual(None, tracing.correlation_id())
+
+  def test_ids_default_to_the_request_log_id(self):
+    testing.patch(self, os, 'environ', {'REQUEST_LOG_ID': 'request-1'})
+    with tracing.scope(force=True) as trace_id:
+      self.assertEqual('request-1', trace_id)
+
+  def test_traces_continue_in_other_threads(self):
+    def work(trace_id):
+      with tracing.restore(trace_id):
+        tracing.event('worker')
+
+    with tracing.scope(force=True, trace_id='abc'):
+      thread = threading.Thread(target=work,
+                                args=(tracing.correlation_id(),))
+      thread.start()
+      thread.join()
+    self.assertEqual([('abc', 'worker', '{}')], self.handler.events)
+
+  def run_gce_request(self, params):
+    testing.api.add_instance('demo-00')
+    project = testing.project()
+    gce_appengine.GceAppEngine().run_gce_request(
+        testing.RequestHandler(params), project.list_instances,
+        'Error listing instances: ')
+
+  def test_requests_asking_for_a_trace_are_traced(self):
+    self.run_gce_request({'trace': '1'})
+    names = [name for _, name, _ in self.handler.events]
+    self.assertTrue('api_request' in names)
+    self.assertEqual(
+        1, len(set(trace_id for trace_id, _, _ in self.handler.events)))
+
+  def test_other_requests_are_not_traced(self):
+    self.run_gce_request({})
+    self.assertEqual([], self.handler.events)
+
+
+if __name__ == '__main__':
+  unittest.main()
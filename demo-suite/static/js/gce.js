@@ -82,6 +82,36 @@ var Gce = function(startInstanceUrl, listInstanceUrl, stopInstanceUrl,
    */
   this.doContinuousHeartbeat_ = false;
 
+  /**
+   * The last instance state received from the server, with its version.
+   * Later requests ask only for what changed since that version.
+   * @type {Object}
+   * @private
+   */
+  this.lastState_ = null;
+
+  /**
+   * The ETag of the last instance state, a fingerprint of all of it. Deltas
+   * are computed against the state it names.
+   * @type {?string}
+   * @private
+   */
+  this.lastEtag_ = null;
+
+  /**
+   * When (ms since the epoch) the last status request was sent.
+   * @type {number}
+   * @private
+   */
+  this.lastPollTime_ = 0;
+
+  /**
+   * Whether the last status request failed.
+   * @type {boolean}
+   * @private
+   */
+  this.lastPollFailed_ = false;
+
   this.setOptions(gceUiOptions);
 };
 
@@ -95,6 +125,14 @@ var Gce = function(startInstanceUrl, listInstanceUrl, stopInstanceUrl,
 Gce.prototype.HEARTBEAT_TIMEOUT_ = 2000;
 
 
+/**
+ * Time (s) the server may hold a heartbeat until the instance state changes.
+ * @type {number}
+ * @private
+ */
+Gce.prototype.LONG_POLL_WAIT_ = 10;
+
+
 /**
  * The various states (status in the GCE API) that an instance can be in. The
  *    UNKNOWN and SERVING states are synthetic.
@@ -267,9 +305,7 @@ Gce.prototype.heartbeat_ = function(numInstances, callback, terminalState) {
   if ((typeof Recovering !== 'undefined') && Recovering) {
     that.getStatuses_(success);
   } else {
-    setTimeout(function() {
-      that.getStatuses_(success);
-    }, this.HEARTBEAT_TIMEOUT_);
+    this.schedulePoll_(success);
   }
 };
 
@@ -282,23 +318,54 @@ Gce.prototype.continuousHeartbeat_ = function(callback) {
     that.continuousHeartbeat_(callback);
   };
 
+  this.schedulePoll_(success);
+}
+
+/**
+ * Schedule the next heartbeat. Once a state is known, the server holds the
+ * request until the state changes, so it is sent as soon as the last one was
+ * sent HEARTBEAT_TIMEOUT_ ago. Otherwise, or if the last request failed, it
+ * is sent after HEARTBEAT_TIMEOUT_. Heartbeats are thus never more frequent
+ * than without long polling, even if the server answers right away.
+ * @param {function} success Function to call if request is successful.
+ * @private
+ */
+Gce.prototype.schedulePoll_ = function(success) {
   var that = this;
+  var delay = this.HEARTBEAT_TIMEOUT_;
+  var data = {};
+  if (this.lastState_ && !this.lastPollFailed_) {
+    delay -= new Date().getTime() - this.lastPollTime_;
+    data = {'wait': this.LONG_POLL_WAIT_};
+  }
+  var error = function() {
+    // Keep polling, but no more often than HEARTBEAT_TIMEOUT_.
+    that.lastPollFailed_ = true;
+    that.schedulePoll_(success);
+  };
   setTimeout(function() {
-    that.getStatuses_(success);
-  }, this.HEARTBEAT_TIMEOUT_);
-
-}
+    that.getStatuses_(success, data, error);
+  }, Math.max(delay, 0));
+};
 
 /**
  * Send Ajax request to get instance information.
  * @param {function} success Function to call if request is successful.
  * @param {Object} optionalData Optional data to send with the request. The
  *    data is added as URL parameters.
+ * @param {function=} opt_error Function to call if the request fails.
  * @private
  */
-Gce.prototype.getStatuses_ = function(success, optionalData) {
+Gce.prototype.getStatuses_ = function(success, optionalData, opt_error) {
   var that = this;
-  var localSuccess = function(data) {
+  var base = this.lastState_;
+  var localSuccess = function(data, textStatus, jqXHR) {
+    that.lastPollFailed_ = false;
+    data = that.applyState_(base, data, textStatus);
+    if (textStatus != 'notmodified') {
+      that.lastEtag_ = jqXHR.getResponseHeader('ETag');
+    }
+    that.lastState_ = data;
     that.summarizeStates(data);
     that.updateUI_(data);
     success(data);
@@ -309,6 +376,7 @@ Gce.prototype.getStatuses_ = function(success, optionalData) {
     url: this.listInstanceUrl_,
     dataType: 'json',
     success: localSuccess,
+    error: opt_error,
     statusCode: this.statusCodeResponseFunctions_
   };
   ajaxRequest.data = {}
@@ -318,9 +386,41 @@ Gce.prototype.getStatuses_ = function(success, optionalData) {
   if (this.commonQueryData_) {
     $.extend(ajaxRequest.data, this.commonQueryData_)
   }
+  if (base) {
+    ajaxRequest.data['since'] = base['version'];
+  }
+  if (base && this.lastEtag_) {
+    ajaxRequest.headers = {'If-None-Match': this.lastEtag_};
+  }
+  this.lastPollTime_ = new Date().getTime();
   $.ajax(ajaxRequest);
 };
 
+/**
+ * Builds the full instance state from a server response.
+ * @param {Object} base The state the request was made against, or null.
+ * @param {Object} data Data returned from the server. Undefined if the state
+ *    has not changed.
+ * @param {string} textStatus The status of the Ajax request.
+ * @return {Object} The full state.
+ * @private
+ */
+Gce.prototype.applyState_ = function(base, data, textStatus) {
+  if (textStatus == 'notmodified' || !data) {
+    return base;
+  }
+  if (data['delta']) {
+    var instances = $.extend({}, base['instances'], data['instances']);
+    $.each(data['removed'], function(i, name) {
+      delete instances[name];
+    });
+    data['instances'] = instances;
+    delete data['delta'];
+    delete data['removed'];
+  }
+  return data;
+};
+
 /**
  * Builds a histogram of how many instances are in what state. It writes it
  *    into data as an item called stateCount